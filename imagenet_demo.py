@@ -11,13 +11,18 @@ from pathlib import Path
 
 from presto          import pipeline
 from presto.analysis import StrategyAnalysis
-from presto.strategy import Strategy
+from presto.strategy import Strategy, execute_offline_pipelines
+from presto.scaling  import geometric_sample_counts, profile_scaling
 
 thread_shard_count = int(sys.argv[1])
 compression_type   = str(sys.argv[2])
 sample_count       = int(sys.argv[3])
 runs               = int(sys.argv[4])
 pipeline_mod       = str(sys.argv[5])
+# optional "single-pass": materialize all split positions in one pass over the dataset
+# optional "scaling": profile 4 sample counts up to sample_count on stratified files, for `StrategyAnalysis.extrapolate_by_fit`
+single_pass        = len(sys.argv) > 6 and str(sys.argv[6]) == "single-pass"
+scaling            = len(sys.argv) > 6 and str(sys.argv[6]) == "scaling"
 if (pipeline_mod == 'none'):
     from imagenet_pipeline import pipeline_definition
     log_path    = "/logs"
@@ -33,7 +38,7 @@ source_path = "/dataset/ILSVRC/Data/CLS-LOC/train"
 target_path = "/tmp"
 
 # define pipeline with the source path
-imagenet_pipeline = pipeline_definition(source_path)
+imagenet_pipeline = pipeline_definition(source_path, strata_count = 10 if scaling else None)
 imagenet_loading_pipeline_op = imagenet_pipeline[0]["op"]
 imagenet_pipeline_steps = list(range(len(imagenet_pipeline)))
 del imagenet_pipeline_steps[1] # remove the 1-list-files strategy from profiling
@@ -57,12 +62,21 @@ strategies = [ Strategy(
 sample_counts = [sample_count]
 runs_total = runs
 
-for sample_count in sample_counts:
-    for strategy in strategies:
-        strategy.profile_strategy(sample_count = sample_count
-                                , runs_total = runs_total
-                                , system_cache_enabled = True)
-        strategy.print_stats()
+if scaling:
+    profile_scaling(strategies
+                  , geometric_sample_counts(max(1, sample_count // 100), sample_count, 4)
+                  , runs_total = runs_total)
+else:
+    for sample_count in sample_counts:
+        split_strategies = [strategy for strategy in strategies if strategy._split_position != None]
+        if single_pass:
+            execute_offline_pipelines(split_strategies, sample_count)
+        for strategy in strategies:
+            strategy.profile_strategy(sample_count = sample_count
+                                    , runs_total = runs_total
+                                    , system_cache_enabled = True
+                                    , offline_materialized = single_pass and strategy in split_strategies)
+            strategy.print_stats()
 
 strategy_dfs = [strat.profile_as_df()       for strat in strategies]
 dstat_dfs    = [strat.profile_as_dstat_df() for strat in strategies]
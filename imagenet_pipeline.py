@@ -1,6 +1,11 @@
+import glob
 import tensorflow as tf
+from typing import Optional
 
-def pipeline_definition(src_path: str):
+from presto.scaling import stratified_file_order
+
+def pipeline_definition(src_path: str
+                      , strata_count: Optional[int] = None):
     '''Our proposed way to defined the preprocessing pipeline. It's converted to a tf.data.Dataset via pipeline.py
     Check demo.py for the example usage.
 
@@ -10,20 +15,26 @@ def pipeline_definition(src_path: str):
     * "op": a function that transforms the data in form of "input_schema" to "output_schema"
     * "input_schema": tf.TensorSpec - i.e., the type of the data
     * "output_schema": tf.TensorSpec - i.e., the type of the data
+    * optional keys of a step, e.g. to tune its map stage, are documented in `presto.pipeline.build_pipeline`
+    Steps marked as "commutable" can be reordered around the split (see `presto.planner.reorder_for_split`)
 
     :param src_path: str
+    :param strata_count: Optional[int] (default = None), order the files with `presto.scaling.stratified_file_order` so that
+        every sample count has the file size distribution of the whole dataset, e.g. to profile the scaling
     :return: list(dict)
     '''
+    patterns = [src_path + "/*/*." + ext for ext in ["jpeg", "bmp", "png", "JPEG"]]
+    if strata_count == None:
+        files = tf.data.Dataset.list_files(patterns, seed = 42)
+    else:
+        files = tf.data.Dataset.from_tensor_slices(stratified_file_order(sorted(filepath for pattern in patterns for filepath in glob.glob(pattern))
+                                                                       , strata_count = strata_count))
 
     return [
         {
             "name": "list files",
             "type": "source",
-            "op": tf.data.Dataset.list_files([
-                src_path + "/*/*." + ext
-                for ext in ["jpeg", "bmp", "png", "JPEG"]]
-              , seed = 42
-            ),
+            "op": files,
             "output_schema": tf.TensorSpec([], tf.string)
         },
         {
@@ -51,22 +62,26 @@ def pipeline_definition(src_path: str):
             "name": "resize image",
             "type": "op",
             "op": _minsize_scale,
-            "input_schema": tf.TensorSpec([None, None, 1], tf.uint8),
-            "output_schema": tf.TensorSpec([None, None, 1], tf.uint8)
+            "input_schema": tf.TensorSpec([None, None, 3], tf.uint8),
+            "output_schema": tf.TensorSpec([None, None, 3], tf.uint8)
         },
         {
             "name": "center pixel values",
             "type": "op",
             "op": _center_pixel_values,
             "input_schema": tf.TensorSpec([None, None, 3], tf.uint8),
-            "output_schema": tf.TensorSpec([None, None, 3], tf.float32)
+            "output_schema": tf.TensorSpec([None, None, 3], tf.float32),
+            # element-wise
+            "commutable": True
         },
         {
             "name": "random crop",
             "type": "op",
             "op": _random_crop,
             "input_schema": tf.TensorSpec([None, None, 3], tf.float32),
-            "output_schema": tf.TensorSpec([224, 224, 3], tf.float32)
+            "output_schema": tf.TensorSpec([224, 224, 3], tf.float32),
+            # a different crop every epoch, it has to stay online
+            "random": True
         },
     ]
 
@@ -105,7 +120,7 @@ def _minsize_scale(image, min_length=256):
 
     return image
 
-def _random_crop(image, crop_shape=(224, 224, 1)):
+def _random_crop(image, crop_shape=(224, 224, 3)):
     return tf.image.random_crop(image, crop_shape)
 
 def _center_pixel_values(image):
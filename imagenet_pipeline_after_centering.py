@@ -1,6 +1,11 @@
+import glob
 import tensorflow as tf
+from typing import Optional
 
-def pipeline_definition(src_path: str):
+from presto.scaling import stratified_file_order
+
+def pipeline_definition(src_path: str
+                      , strata_count: Optional[int] = None):
     '''Our proposed way to defined the preprocessing pipeline. It's converted to a tf.data.Dataset via pipeline.py
     Check demo.py for the example usage.
 
@@ -12,18 +17,21 @@ def pipeline_definition(src_path: str):
     * "output_schema": tf.TensorSpec - i.e., the type of the data
 
     :param src_path: str
+    :param strata_count: Optional[int] (default = None), order the files with `presto.scaling.stratified_file_order`, see `imagenet_pipeline.pipeline_definition`
     :return: list(dict)
     '''
+    patterns = [src_path + "/*/*." + ext for ext in ["jpeg", "bmp", "png", "JPEG"]]
+    if strata_count == None:
+        files = tf.data.Dataset.list_files(patterns, seed = 42)
+    else:
+        files = tf.data.Dataset.from_tensor_slices(stratified_file_order(sorted(filepath for pattern in patterns for filepath in glob.glob(pattern))
+                                                                       , strata_count = strata_count))
 
     return [
         {
             "name": "list files",
             "type": "source",
-            "op": tf.data.Dataset.list_files([
-                src_path + "/*/*." + ext
-                for ext in ["jpeg", "bmp", "png", "JPEG"]]
-              , seed = 42
-            ),
+            "op": files,
             "output_schema": tf.TensorSpec([], tf.string)
         },
         {
@@ -4,6 +4,8 @@ import numpy as np
 import tensorflow as tf
 from typing import Optional
 
+from presto import scaling
+
 def strat_analysis_from_csv(path_to_cum_df: str
                           , path_to_cum_dstat_df: str):
         '''Helper to create a StrategyAnalysis object from the csv's saved 
@@ -16,17 +18,50 @@ def strat_analysis_from_csv(path_to_cum_df: str
             "offline_processing_and_save_time_s": np.float32
           , "shard_count": np.int32
           , "thread_count": np.int32
+          , "read_parallelism": np.int32
           , "shard_cum_size_MB": np.float32
+          , "shard_memory_MB": np.float32
+          , "shard_sizes_MB": str # list per run
           , "sample_count": np.int32
+          , "offline_build_time_s": np.float32
+          , "offline_save_time_s": np.float32
+          , "shared_offline_time_s": np.float32 # 0 without a single pass over several strategies
+          , "materialization_cache_hit": bool
+          , "online_build_time_s": np.float32
           , "online_processing_time_s": np.float32
           , "throughput_sps": np.float32
+          , "time_to_first_sample_s": np.float32 # empty with the graph sink
+          , "first_epoch_time_s": np.float32
+          , "epochs": np.int32
+          , "epoch_times_s": str # list per run
+          , "steady_epoch_time_s": np.float32 # empty with a single epoch
           , "runs_count": np.int32
           , "runs_total": np.int32
           , "ueid": str
           , "split_name": str
           , "creation_timestamp": str
           , "compression_type": str
+          , "compression_level": np.float32 # empty with the default level
           , "storage_type": str
+          , "serialization_format": str
+          , "storage_format": str
+          , "sink": str
+          , "samples_per_record": np.int32
+          , "vectorized_batch_size": np.float32 # empty if not vectorized
+          , "pipeline_cache_enabled": bool
+          , "schema_inference": bool
+          , "online_worker_count": np.float32 # empty if not distributed
+          , "streaming_materialization": bool
+          , "materialization_ratio": np.float32
+          , "memory_budget_MB": np.float32 # empty if not limited
+          , "target_shard_size_MB": np.float32 # empty with a fixed shard count
+          , "byte_balanced_shards": bool
+          , "indexed_shards": bool
+          , "global_shuffle_seed": np.float32 # empty without global shuffling
+          , "storage_dtype": str
+          , "storage_range": str # empty without an integer storage dtype
+          , "storage_max_abs_error": np.float32 # empty without a storage dtype
+          , "split_reordering": str # empty without reordering
         }
 
         cum_dstat_df_dtypes = {
@@ -63,7 +98,23 @@ def strat_analysis_from_csv(path_to_cum_df: str
           , "filelocks_read": np.float32
           , "filelocks_write": np.float32
           , "compression_type": str
+          , "compression_level": np.float32 # empty with the default level
           , "storage_type": str
+          , "serialization_format": str
+          , "storage_format": str
+          , "sink": str
+          , "samples_per_record": np.int32
+          , "online_worker_count": np.float32 # empty if not distributed
+          , "streaming_materialization": bool
+          , "materialization_ratio": np.float32
+          , "memory_budget_MB": np.float32 # empty if not limited
+          , "target_shard_size_MB": np.float32 # empty with a fixed shard count
+          , "byte_balanced_shards": bool
+          , "indexed_shards": bool
+          , "global_shuffle_seed": np.float32 # empty without global shuffling
+          , "storage_dtype": str
+          , "storage_range": str # empty without an integer storage dtype
+          , "storage_max_abs_error": np.float32 # empty without a storage dtype
         }
 
 
@@ -220,9 +271,10 @@ class StrategyAnalysis:
         '''Extrapolate the profiling dataframe by the full dataset size
 
         !!! PREMISE !!! - we assume that the samples are representative of the whole dataset. Evaluated for the Imagenet dataset, but may not be true for others
+        With profiles at several sample counts, `extrapolate_by_fit` fits the scaling including page cache effects instead
         
         :param total_dataset_size_GB: (float) - check the original dataset size from paper 
-        :param average_sample_size: (float) - calculate that with `self.calculate_avg_sample_size`
+        :param average_sample_size_KB: (float) - calculate that with `self.calculate_avg_sample_size_KB`
         :return: pd.DataFrame
         '''
 
@@ -251,6 +303,81 @@ class StrategyAnalysis:
 
         return full_pd_extra
 
+    def extrapolate_by_fit(self
+                         , total_dataset_size_GB: float
+                         , average_sample_size_KB: float
+                         , ram_GB: float
+                         , confidence: float = 0.95):
+        '''Extrapolates the strategies to the full dataset with a `scaling.ScalingModel` per metric instead of a constant factor
+        Needs profiles at several sample counts, e.g. from `scaling.profile_scaling`. The offline time and storage are fitted
+        on the runs that processed the offline part. The online time is fitted on all runs with a page cache term, a run
+        counts as cold if the cache was dropped before it. For the full dataset, the first epoch is predicted cold and the
+        following epochs with the share of the read data that fits into the RAM.
+
+        Returns a dataframe with the columns strategy, threads, metric, prediction, ci_low, ci_high, cached_fraction and observations
+        for the metrics preprocessing_time_s, storage_consumption_mb, first_epoch_online_time_s, epoch_online_time_s and throughput_sps. A bound of the throughput is NaN if the bound of the time is at or below 0 s (see `scaling.throughput_prediction`)
+
+        :param total_dataset_size_GB: (float) - check the original dataset size from paper
+        :param average_sample_size_KB: (float) - calculate that with `self.calculate_avg_sample_size_KB`, read per sample by the fully online strategy
+        :param ram_GB: (float) - memory available for the page cache
+        :param confidence: (float) - of the intervals
+        :return: pd.DataFrame
+        '''
+        total_dataset_sample_count = total_dataset_size_GB * 1000**2 / average_sample_size_KB
+        ram_MB = ram_GB * 1000
+
+        cum_df = self._cum_df.copy(deep = True)
+        # older logs do not contain the column, every run dropped the cache
+        if "system_cache_enabled" not in cum_df.columns:
+            cum_df["system_cache_enabled"] = False
+        # with system caching, only the first run of a strategy and sample count reads cold data and processes the offline part
+        first_run = cum_df.groupby(["ueid", "sample_count"])["runs_count"].transform("min") == cum_df["runs_count"]
+        cum_df["cold_run"] = ~cum_df["system_cache_enabled"].astype(bool) | first_run
+        # runs that skip the offline part log no shards, but read the ones of the first run
+        cum_df["read_shard_MB"] = cum_df.groupby(["ueid", "sample_count"])["shard_cum_size_MB"].transform("max")
+
+        extrapolated = {key: [] for key in [self._strategy_name_key, self._threads_key, "metric", "prediction", "ci_low", "ci_high", "cached_fraction", "observations"]}
+
+        def append(split_name, threads, metric, prediction, cached_fraction, observations):
+            extrapolated[self._strategy_name_key].append(split_name)
+            extrapolated[self._threads_key].append(threads)
+            extrapolated["metric"].append(metric)
+            extrapolated["prediction"].append(prediction[0])
+            extrapolated["ci_low"].append(prediction[1])
+            extrapolated["ci_high"].append(prediction[2])
+            extrapolated["cached_fraction"].append(cached_fraction)
+            extrapolated["observations"].append(observations)
+
+        for (split_name, threads), strategy_df in cum_df.groupby(["split_name", "thread_count"]):
+            cold_df = strategy_df[strategy_df["cold_run"]]
+
+            preprocessing_model = scaling.ScalingModel(cold_df["sample_count"], cold_df["offline_processing_and_save_time_s"])
+            append(split_name, threads, self._preprocessing_time_key
+                 , preprocessing_model.predict(total_dataset_sample_count, confidence = confidence), 0, len(cold_df))
+
+            storage_model = scaling.ScalingModel(cold_df["sample_count"], cold_df["shard_cum_size_MB"])
+            storage_prediction = storage_model.predict(total_dataset_sample_count, confidence = confidence)
+            append(split_name, threads, self._storage_consumption_key, storage_prediction, 0, len(cold_df))
+
+            # the fully online strategy reads the source dataset instead of shards
+            def read_MB(sample_count, shard_cum_size_MB):
+                return np.where(shard_cum_size_MB > 0, shard_cum_size_MB, sample_count * average_sample_size_KB / 1000)
+
+            cached_fractions = np.where(strategy_df["cold_run"]
+                                      , 0
+                                      , np.minimum(1, ram_MB / read_MB(strategy_df["sample_count"], strategy_df["read_shard_MB"])))
+            online_model = scaling.ScalingModel(strategy_df["sample_count"], strategy_df["online_processing_time_s"], cached_fractions)
+
+            total_cached_fraction = float(np.minimum(1, ram_MB / read_MB(total_dataset_sample_count, storage_prediction[0])))
+            for metric, cached_fraction in [("first_epoch_online_time_s", 0), ("epoch_online_time_s", total_cached_fraction)]:
+                online_prediction = online_model.predict(total_dataset_sample_count, cached_fraction, confidence = confidence)
+                append(split_name, threads, metric, online_prediction, cached_fraction, len(strategy_df))
+            append(split_name, threads, self._throughput_key
+                 , scaling.throughput_prediction(total_dataset_sample_count, online_prediction)
+                 , total_cached_fraction, len(strategy_df))
+
+        return pd.DataFrame(extrapolated)
+
     def summary(self):
         '''Returns a dataframe with 4 columns:
         * preprocessing_time - (mean) in sec
@@ -424,3 +551,125 @@ class StrategyAnalysis:
 
         return pd.DataFrame(summarized_dict)
         
+
+    def _variant_summary(self
+                       , variant_key: str
+                       , baseline_value
+                       , detail_keys = []
+                       , detail_metrics = {}):
+        '''Averages throughput and storage per strategy, threads, sample count and value of `variant_key`
+        and relates them to the rows where `variant_key` equals `baseline_value` (NaN if the baseline was not profiled)
+
+        :param variant_key: str - column of the cumulative dataframe, e.g. "samples_per_record"
+        :param baseline_value: value of `variant_key` that is used as reference
+        :param detail_keys: list(str) (default = []), columns that split the variants further, e.g. "compression_level". Empty values are kept as own group
+        :param detail_metrics: dict(str -> (str, str)) (default = {}), further aggregated columns of the summary, e.g. {"max_abs_error": ("storage_max_abs_error", "max")}
+        :return: pd.DataFrame
+        '''
+        cum_df = self._cum_df.copy(deep = True)
+        # older logs do not contain the column, they were all profiled with the baseline
+        if variant_key not in cum_df.columns:
+            cum_df[variant_key] = baseline_value
+        for detail_key in detail_keys + [column for column, _ in detail_metrics.values()]:
+            if detail_key not in cum_df.columns:
+                cum_df[detail_key] = np.nan
+
+        group_keys = ["split_name", "thread_count", "sample_count"]
+        summary_df = cum_df.groupby(group_keys + [variant_key] + detail_keys, as_index=False, dropna=False) \
+                           .agg(throughput_sps=("throughput_sps", "mean")
+                              , shard_cum_size_MB=("shard_cum_size_MB", "mean")
+                              , **detail_metrics)
+
+        baseline_df = summary_df[summary_df[variant_key] == baseline_value] \
+                          .drop(columns=[variant_key] + detail_keys + list(detail_metrics.keys())) \
+                          .rename(columns={"throughput_sps": "baseline_throughput_sps"
+                                         , "shard_cum_size_MB": "baseline_shard_cum_size_MB"})
+        summary_df = summary_df.merge(baseline_df, on=group_keys, how="left")
+
+        summary_df["throughput_speedup"] = summary_df["throughput_sps"] / summary_df["baseline_throughput_sps"]
+        summary_df["storage_savings"] = 1 - summary_df["shard_cum_size_MB"] / summary_df["baseline_shard_cum_size_MB"]
+
+        summary_df = summary_df.drop(columns=["baseline_throughput_sps", "baseline_shard_cum_size_MB"]) \
+                               .rename(columns={"split_name": self._strategy_name_key
+                                              , "thread_count": self._threads_key
+                                              , "shard_cum_size_MB": self._storage_consumption_key})
+        return summary_df
+
+    def samples_per_record_summary(self):
+        '''Compares strategies that pack multiple samples into one record against the one-sample-per-record path
+        Returns a dataframe with the columns:
+        * strategy, threads, sample_count, samples_per_record
+        * throughput_sps - (mean) in samples per second
+        * storage_consumption_mb - (mean) in MB
+        * throughput_speedup - throughput relative to one sample per record
+        * storage_savings - 0-1, saved storage relative to one sample per record
+        :return: pd.DataFrame
+        '''
+        return self._variant_summary(variant_key = "samples_per_record"
+                                   , baseline_value = 1)
+
+    def epoch_summary(self
+                    , baseline_strategy: str = "0-fully-online"):
+        '''Relates the one-time cost of every strategy (offline processing and the cold first epoch) to its steady epochs,
+        needs runs with more than one epoch (see `Strategy.execute_full_pipeline(..., epochs=n)`)
+        Returns a dataframe with the columns:
+        * strategy, threads, sample_count
+        * first_epoch_time_s - (mean) from the start of the offline part to the end of the first epoch
+        * steady_epoch_time_s - (mean) time of every further epoch
+        * break_even_epochs - after how many epochs the strategy took less time in total than the baseline with the same
+          threads and samples. 1 if it is faster from the start, inf if its steady epochs are not faster, NaN without baseline
+        :param baseline_strategy: str (default = "0-fully-online"), strategy name of the baseline
+        :return: pd.DataFrame
+        '''
+        group_keys = ["split_name", "thread_count", "sample_count"]
+        summary_df = self._cum_df.groupby(group_keys, as_index=False) \
+                                 .agg(first_epoch_time_s=("first_epoch_time_s", "mean")
+                                    , steady_epoch_time_s=("steady_epoch_time_s", "mean"))
+
+        baseline_df = summary_df[summary_df["split_name"] == baseline_strategy] \
+                          .drop(columns="split_name") \
+                          .rename(columns={"first_epoch_time_s": "baseline_first_epoch_time_s"
+                                         , "steady_epoch_time_s": "baseline_steady_epoch_time_s"})
+        summary_df = summary_df.merge(baseline_df, on=group_keys[1:], how="left")
+
+        # first + (n - 1) * steady <= baseline first + (n - 1) * baseline steady
+        extra_time_s = summary_df["first_epoch_time_s"] - summary_df["baseline_first_epoch_time_s"]
+        saved_per_epoch_s = summary_df["baseline_steady_epoch_time_s"] - summary_df["steady_epoch_time_s"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            break_even_epochs = np.where(extra_time_s <= 0, 1
+                                       , np.where(saved_per_epoch_s > 0, np.ceil(1 + extra_time_s / saved_per_epoch_s), np.inf))
+        summary_df["break_even_epochs"] = np.where(extra_time_s.isna() | saved_per_epoch_s.isna(), np.nan, break_even_epochs)
+
+        return summary_df.drop(columns=["baseline_first_epoch_time_s", "baseline_steady_epoch_time_s"]) \
+                         .rename(columns={"split_name": self._strategy_name_key
+                                        , "thread_count": self._threads_key})
+
+    def compression_summary(self):
+        '''Compares the compression types and levels against the uncompressed shards, the throughput speedup below 1 is the decoding cost
+        Returns a dataframe with the columns:
+        * strategy, threads, sample_count, compression_type, compression_level (empty for the default level)
+        * throughput_sps - (mean) in samples per second
+        * storage_consumption_mb - (mean) in MB
+        * throughput_speedup - throughput relative to no compression
+        * storage_savings - 0-1, saved storage relative to no compression
+        :return: pd.DataFrame
+        '''
+        return self._variant_summary(variant_key = "compression_type"
+                                   , baseline_value = "none"
+                                   , detail_keys = ["compression_level"])
+
+    def precision_summary(self):
+        '''Compares the storage dtypes at the split position against the features stored as computed
+        Returns a dataframe with the columns:
+        * strategy, threads, sample_count, storage_dtype, storage_range (empty for the floating point dtypes)
+        * throughput_sps - (mean) in samples per second
+        * storage_consumption_mb - (mean) in MB
+        * max_abs_error - largest absolute error of the restored features on the probed samples, NaN if not reduced
+        * throughput_speedup - throughput relative to the computed dtype
+        * storage_savings - 0-1, saved storage relative to the computed dtype
+        :return: pd.DataFrame
+        '''
+        return self._variant_summary(variant_key = "storage_dtype"
+                                   , baseline_value = "none"
+                                   , detail_keys = ["storage_range"]
+                                   , detail_metrics = {"max_abs_error": ("storage_max_abs_error", "max")})
@@ -0,0 +1,227 @@
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import types
+import pathlib
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import graph_pb2
+
+# written last into every entry, an entry without it is incomplete
+_ENTRY_INFO = "entry.json"
+
+def _update_with_value(hasher, value, visited):
+    '''Feeds a stable description of the value into the hasher
+    Functions are described by their code, defaults, closures and the globals they use, datasets by their serialized graph
+    and arrays by their bytes. Everything else falls back to `repr`, which at worst leads to cache misses, e.g. with memory addresses in it.
+
+    :param hasher: hashlib hash object
+    :param value: any
+    :param visited: set(int) - ids of the values that are already described, to stop on cycles
+    '''
+    if id(value) in visited:
+        hasher.update(b"<cycle>")
+        return
+    visited.add(id(value))
+
+    if isinstance(value, np.ndarray) or (tf.is_tensor(value) and hasattr(value, "numpy")):
+        # `repr` truncates large arrays
+        array = np.asarray(value.numpy() if tf.is_tensor(value) else value)
+        hasher.update(repr((array.dtype.str, array.shape)).encode())
+        hasher.update(array.tobytes() if array.dtype != object else repr(array.tolist()).encode())
+    elif isinstance(value, types.ModuleType):
+        hasher.update(value.__name__.encode())
+    elif isinstance(value, tf.data.Dataset):
+        hasher.update(repr(value.element_spec).encode())
+        # protobuf maps are serialized in arbitrary order
+        graph_def = graph_pb2.GraphDef.FromString(value._as_serialized_graph().numpy())
+        hasher.update(graph_def.SerializeToString(deterministic=True))
+    elif hasattr(value, "python_function"):
+        # tf.function
+        _update_with_value(hasher, value.python_function, visited)
+    elif hasattr(value, "__code__"):
+        _update_with_code(hasher, value.__code__, getattr(value, "__globals__", {}), visited)
+        for default in (value.__defaults__ or ()):
+            _update_with_value(hasher, default, visited)
+        for cell in (value.__closure__ or ()):
+            _update_with_value(hasher, cell.cell_contents, visited)
+    elif hasattr(value, "func") and hasattr(value, "args"):
+        # functools.partial
+        _update_with_value(hasher, value.func, visited)
+        _update_with_value(hasher, value.args, visited)
+        _update_with_value(hasher, value.keywords, visited)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _update_with_value(hasher, item, visited)
+    elif isinstance(value, dict):
+        for key in sorted(value.keys(), key=repr):
+            hasher.update(repr(key).encode())
+            _update_with_value(hasher, value[key], visited)
+    elif hasattr(value, "__qualname__"):
+        # builtins and classes
+        hasher.update(f"{getattr(value, '__module__', '')}.{value.__qualname__}".encode())
+    else:
+        hasher.update(repr(value).encode())
+
+
+def _update_with_code(hasher, code, function_globals, visited):
+    '''Feeds the bytecode, names and constants (including nested functions) into the hasher
+    The global names are resolved against the globals of the function, so that a change of a helper it calls changes the hash
+
+    :param hasher: hashlib hash object
+    :param code: types.CodeType
+    :param function_globals: dict - `__globals__` of the function
+    :param visited: set(int)
+    '''
+    hasher.update(code.co_code)
+    hasher.update(repr(code.co_names).encode())
+    for name in code.co_names:
+        # attribute names are in co_names as well, only the ones that are globals of the function are resolved
+        if name in function_globals:
+            _update_with_value(hasher, function_globals[name], visited)
+    for constant in code.co_consts:
+        if hasattr(constant, "co_code"):
+            _update_with_code(hasher, constant, function_globals, visited)
+        else:
+            hasher.update(repr(constant).encode())
+
+
+def pipeline_fingerprint(pipeline_spec):
+    '''Hashes the steps of a pipeline by their names, types, schemas and ops
+    An op is identified by its "cache_key" if it has one, otherwise by its code, closures and defaults (see `_update_with_value`)
+
+    :param pipeline_spec: list(dict)
+    :return: str - hex digest
+    '''
+    hasher = hashlib.sha256()
+    for step in pipeline_spec:
+        hasher.update(repr((step["name"], step["type"], step.get("input_schema"), step.get("output_schema"))).encode())
+        if "cache_key" in step:
+            hasher.update(repr(step["cache_key"]).encode())
+        else:
+            _update_with_value(hasher, step["op"], visited=set())
+    return hasher.hexdigest()
+
+
+class MaterializationCache:
+    '''On-disk cache of materialized shards, shared by all strategies and runs that use the same directory
+    Every entry is a directory named by its key, that holds a copy of the shards and an `entry.json` with the size and the last access.
+    If the entries exceed the byte budget, the least recently used ones are evicted.
+    '''
+    def __init__(self
+               , directory: str
+               , byte_budget: int):
+        '''
+        :param directory: str, where the entries are stored
+        :param byte_budget: int, maximum size of all entries in bytes
+        '''
+        self._directory = pathlib.Path(directory)
+        self._directory.mkdir(exist_ok = True, parents = True)
+        self._byte_budget = byte_budget
+
+    def entry_key(self
+                , offline_pipeline
+                , **options):
+        '''Returns the key of the materialized offline pipeline
+        :param offline_pipeline: list(dict) - the offline part, including the serialization
+        :param options: everything else that changes the shards, e.g. sample_count, shard_count, compression_type
+        :return: str
+        '''
+        hasher = hashlib.sha256(pipeline_fingerprint(offline_pipeline).encode())
+        hasher.update(repr(sorted(options.items())).encode())
+        return hasher.hexdigest()[:32]
+
+    def lookup(self, key: str):
+        '''Returns the directory of a complete entry and marks it as recently used
+        :param key: str
+        :return: Optional[str]
+        '''
+        entry_info = self._read_entry_info(self._directory / key)
+        if entry_info is None:
+            return None
+        entry_info["last_access"] = time.time()
+        self._write_entry_info(self._directory / key, entry_info)
+        return str(self._directory / key) + "/"
+
+    def insert(self
+             , key: str
+             , shard_directory: str):
+        '''Copies the shards ("shard-*" files) into a new entry and evicts least recently used entries above the byte budget
+        The copy is written into a temporary directory first, so that readers never see an incomplete entry.
+        An entry that is bigger than the whole budget is not kept
+
+        :param key: str
+        :param shard_directory: str - directory with the freshly written shards
+        :return: Optional[str] - directory of the entry or None if it was not kept
+        '''
+        shard_filepaths = sorted(pathlib.Path(shard_directory).glob("shard-*"))
+        size_b = sum(filepath.stat().st_size for filepath in shard_filepaths)
+        if size_b > self._byte_budget:
+            return None
+
+        temp_path = self._directory / f"{key}.tmp-{uuid.uuid4().hex[:6]}"
+        temp_path.mkdir(parents = True)
+        for filepath in shard_filepaths:
+            shutil.copy2(filepath, temp_path / filepath.name)
+        self._write_entry_info(temp_path, {"size_b": size_b, "last_access": time.time()})
+
+        entry_path = self._directory / key
+        if entry_path.exists():
+            shutil.rmtree(entry_path)
+        temp_path.rename(entry_path)
+
+        self._evict(keep=key)
+        return str(entry_path) + "/"
+
+    def size_b(self):
+        '''Returns the size of all complete entries in bytes
+        :return: int
+        '''
+        return sum(entry_info["size_b"] for _, entry_info in self._entries())
+
+    def _evict(self, keep: str):
+        '''Deletes the least recently used entries until all entries fit into the byte budget
+        :param keep: str - key of the entry that is never evicted
+        '''
+        entries = sorted(self._entries(), key=lambda entry: entry[1]["last_access"])
+        size_b = sum(entry_info["size_b"] for _, entry_info in entries)
+        for entry_path, entry_info in entries:
+            if size_b <= self._byte_budget:
+                break
+            if entry_path.name != keep:
+                shutil.rmtree(entry_path)
+                size_b -= entry_info["size_b"]
+
+    def _entries(self):
+        '''Returns all complete entries
+        :return: list(tuple(pathlib.Path, dict))
+        '''
+        entries = []
+        for entry_path in self._directory.iterdir():
+            entry_info = self._read_entry_info(entry_path)
+            if entry_info is not None:
+                entries.append((entry_path, entry_info))
+        return entries
+
+    def _read_entry_info(self, entry_path: pathlib.Path):
+        '''
+        :param entry_path: pathlib.Path
+        :return: Optional[dict]
+        '''
+        try:
+            with open(entry_path / _ENTRY_INFO) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry_info(self
+                        , entry_path: pathlib.Path
+                        , entry_info: dict):
+        '''
+        :param entry_path: pathlib.Path
+        :param entry_info: dict
+        '''
+        with open(entry_path / _ENTRY_INFO, "w") as entry_file:
+            json.dump(entry_info, entry_file)
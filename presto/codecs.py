@@ -0,0 +1,155 @@
+import zlib
+import threading
+import importlib
+import tensorflow as tf
+
+# compress whole TFRecord files, handled by `tf.io.TFRecordOptions`
+FILE_CODECS = ["GZIP", "ZLIB"]
+
+# zstd (de)compressors are reused per thread, they must not be shared between threads
+_ZSTD_STATE = threading.local()
+
+def _zstd_compress(data: bytes
+                 , level: int):
+    import zstandard
+    compressors = _ZSTD_STATE.__dict__.setdefault("compressors", {})
+    if level not in compressors:
+        compressors[level] = zstandard.ZstdCompressor(level=level)
+    return compressors[level].compress(data)
+
+def _zstd_decompress(data: bytes):
+    import zstandard
+    if not hasattr(_ZSTD_STATE, "decompressor"):
+        _ZSTD_STATE.decompressor = zstandard.ZstdDecompressor()
+    return _ZSTD_STATE.decompressor.decompress(data)
+
+def _lz4_compress(data: bytes
+                , level: int):
+    import lz4.frame
+    return lz4.frame.compress(data, compression_level=level)
+
+def _lz4_decompress(data: bytes):
+    import lz4.frame
+    return lz4.frame.decompress(data)
+
+def _snappy_compress(data: bytes
+                   , level: int):
+    import snappy
+    return snappy.compress(data)
+
+def _snappy_decompress(data: bytes):
+    import snappy
+    return snappy.decompress(data)
+
+
+# per record codecs: name -> compress(bytes, level), decompress(bytes), optional module, (min level, default level, max level) or None
+_RECORD_CODECS = {}
+
+def register_codec(name: str
+                 , compress
+                 , decompress
+                 , module: str = None
+                 , levels: tuple = None):
+    '''Adds a codec that compresses every record on its own, it can be used as `compression_type` of a `Strategy`
+    :param name: str
+    :param compress: function(bytes, level) -> bytes, level is None if the codec has no levels
+    :param decompress: function(bytes) -> bytes
+    :param module: str (default = None), the optional Python package the codec needs, e.g. "lz4"
+    :param levels: tuple(int, int, int) (default = None), lowest, default and highest level. None if the codec has no levels
+    '''
+    if name in FILE_CODECS or name == "none":
+        raise Exception("The codec name '{}' is reserved".format(name))
+    _RECORD_CODECS[name] = {
+        "compress": compress,
+        "decompress": decompress,
+        "module": module,
+        "levels": levels
+    }
+
+register_codec("DEFLATE", lambda data, level: zlib.compress(data, level), zlib.decompress, levels=(0, 6, 9))
+register_codec("LZ4", _lz4_compress, _lz4_decompress, module="lz4", levels=(0, 0, 16))
+register_codec("ZSTD", _zstd_compress, _zstd_decompress, module="zstandard", levels=(1, 3, 22))
+register_codec("SNAPPY", _snappy_compress, _snappy_decompress, module="snappy")
+
+
+def compression_types():
+    '''Names of the compressions of the shards
+    * none    - no compression
+    * GZIP    - whole TFRecord files, levels 0-9
+    * ZLIB    - whole TFRecord files, levels 0-9
+    * DEFLATE - zlib per record, levels 0-9
+    * LZ4     - LZ4 frames per record, levels 0-16, needs `lz4`
+    * ZSTD    - zstd per record, levels 1-22, needs `zstandard`
+    * SNAPPY  - snappy per record without levels, needs `python-snappy`
+    and the codecs added with `register_codec`
+
+    :return: list(str)
+    '''
+    return ["none"] + FILE_CODECS + list(_RECORD_CODECS.keys())
+
+def is_record_codec(compression_type: str):
+    '''
+    :param compression_type: str
+    :return: bool - True if the records are compressed one by one at the split position instead of the files
+    '''
+    return compression_type in _RECORD_CODECS
+
+def missing_module(compression_type: str):
+    '''
+    :param compression_type: str
+    :return: Optional[str] - the package the codec needs if it can not be imported
+    '''
+    module = _RECORD_CODECS[compression_type]["module"] if is_record_codec(compression_type) else None
+    if module == None:
+        return None
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        return module
+    return None
+
+def level_range(compression_type: str):
+    '''
+    :param compression_type: str
+    :return: Optional[tuple(int, int)] - lowest and highest level, None if the compression has no levels
+    '''
+    if compression_type in FILE_CODECS:
+        return (0, 9)
+    if is_record_codec(compression_type) and _RECORD_CODECS[compression_type]["levels"] != None:
+        lowest, _, highest = _RECORD_CODECS[compression_type]["levels"]
+        return (lowest, highest)
+    return None
+
+
+def record_compressor(compression_type: str
+                    , level: int = None):
+    '''Returns the op that compresses a serialized record (scalar tf.string) with a per record codec
+    The codecs run in `tf.py_function`, `tf.numpy_function` would strip trailing null bytes of the records
+
+    :param compression_type: str - one of the codecs of `register_codec`
+    :param level: int (default = None), the default level of the codec if None
+    :return: function
+    '''
+    codec = _RECORD_CODECS[compression_type]
+    if level == None and codec["levels"] != None:
+        level = codec["levels"][1]
+    compress = codec["compress"]
+
+    def compress_record(record):
+        compressed = tf.py_function(lambda data: compress(data.numpy(), level), [record], tf.string)
+        compressed.set_shape([])
+        return compressed
+    return compress_record
+
+def record_decompressor(compression_type: str):
+    '''Returns the op that decompresses a record of `record_compressor`
+    :param compression_type: str
+    :return: function
+    '''
+    decompress = _RECORD_CODECS[compression_type]["decompress"]
+
+    def decompress_record(record):
+        decompressed = tf.py_function(lambda data: decompress(data.numpy()), [record], tf.string)
+        decompressed.set_shape([])
+        return decompressed
+    return decompress_record
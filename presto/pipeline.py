@@ -1,16 +1,104 @@
+import os
+import json
+import time
+import queue
 import pathlib
+import threading
+import collections
+import concurrent.futures
+import numpy as np
 import tensorflow as tf
 
+from presto import codecs
+
+# records that are buffered per shard writer before the producer blocks
+_WRITER_QUEUE_SIZE = 64
+
+# sidecar index of fixed-length shards, see `save_ds_parallel(..., fixed_length=True)`
+FIXED_LENGTH_INDEX = "shard-index.json"
+
+# record counts of the TFRecord shards in a directory, every shard has an offset index next to it, see `indexed_shards_dataset`
+TFRECORD_MANIFEST = "shard-manifest.json"
+
+# records of a memory-mapped shard that are passed to tf.data at once, see `memmap_shards_dataset`
+_MEMMAP_SLICE_RECORDS = 1024
+
+# TFRecord framing: length (uint64) and its crc (uint32) before the data, the crc of the data (uint32) after it
+_TFRECORD_HEADER_B = 12
+_TFRECORD_FRAMING_B = 16
+# an entry of `shard-N.index`: offset and length of a record as little endian int64
+_TFRECORD_INDEX_DTYPE = "<i8"
+_TFRECORD_INDEX_ENTRY_B = 2 * np.dtype(_TFRECORD_INDEX_DTYPE).itemsize
+
+# built datasets and traced map stages of `build_pipeline(..., cache=True)`, the values keep the steps alive so the ids in the keys stay valid.
+# Both are bounded, the least recently used entries are dropped first
+_PIPELINE_CACHE_SIZE = 16
+_BUILT_PIPELINES = collections.OrderedDict()
+_TRACED_MAPPERS = collections.OrderedDict()
+
+
+def _cache_lookup(cache: collections.OrderedDict
+                , key):
+    '''Returns the cached value and marks it as recently used
+    :param cache: collections.OrderedDict
+    :param key: hashable
+    :return: cached value or None
+    '''
+    if key not in cache:
+        return None
+    cache.move_to_end(key)
+    return cache[key]
+
+
+def _cache_insert(cache: collections.OrderedDict
+                , key
+                , value):
+    '''Inserts the value and drops the least recently used entries beyond `_PIPELINE_CACHE_SIZE`
+    :param cache: collections.OrderedDict
+    :param key: hashable
+    :param value: any
+    '''
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _PIPELINE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
 def build_pipeline(pipeline_spec
                  , compress_map=True
-                 , compressed_parallelism=None):
+                 , compressed_parallelism=None
+                 , fusion_plan=None
+                 , vectorized_batch_size=None
+                 , cache=False):
     '''Convert pipeline specification into a tf.data.Dataset
+    Besides "name", "type", "op", "input_schema" and "output_schema", every step can set the optional keys
+    * "parallelism": int or tf.data.AUTOTUNE - parallel calls of the map stage of this step (default = compressed_parallelism)
+    * "deterministic": bool - if the map stage of this step has to keep the order of the elements (default = tf.data options)
+    * "prefetch": int or tf.data.AUTOTUNE - buffer size of a prefetch after this step (default = no prefetch)
+    * "vectorized": bool - the op also works on a leading batch dimension, see `vectorize_pipeline`
+    * "commutable": bool - the op gives the same results if it is swapped with a neighbouring "commutable" op, see `planner.reorder_for_split`
+    * "random": bool - the op draws random numbers, e.g. an augmentation. It is never reordered, also if it is marked as "commutable"
+    * "cache_key": hashable - identifies the op for `cache=True` if the op is recreated for the same computation (default = id of the op)
+    Consecutive ops are only fused if they agree on "parallelism" and "deterministic", a step with "prefetch" ends the fused stage
 
     :param pipeline_spec: Pipeline specification.
     :param compress_map: Pack all data conversions into a single TF map stage.
     :param compressed_parallelism: If compress_map is true, execute compressed map stage with parallel calls.
+    :param fusion_plan: Optional list(dict), fuse the steps and set the parallelism per map stage as planned by `planner.plan_fusion`. Replaces compress_map
+    :param vectorized_batch_size: Optional[int], rewrite runs of "vectorized" ops with `vectorize_pipeline` first. A fusion plan has to be planned on the rewritten pipeline
+    :param cache: bool (default = False), reuse the dataset if the same steps were already built with the same options and reuse traced map stages across options. Keeps the last `_PIPELINE_CACHE_SIZE` datasets and map stages, see `clear_pipeline_cache`
     :return: tf.data.Dataset
     '''
+    if cache:
+        cache_key = (tuple(step_cache_key(step) for step in pipeline_spec), compress_map, compressed_parallelism, repr(fusion_plan), vectorized_batch_size)
+        cached = _cache_lookup(_BUILT_PIPELINES, cache_key)
+        if cached is not None:
+            return cached[1]
+        cached_spec = pipeline_spec
+
+    if vectorized_batch_size is not None:
+        pipeline_spec = vectorize_pipeline(pipeline_spec, vectorized_batch_size)
+
     src, *rest = pipeline_spec
     ds = src["op"]
 
@@ -19,21 +107,47 @@ def build_pipeline(pipeline_spec
             for seg in ops:
                 x = seg["op"](x)
             return x
-        return {
+        stage = {
             "name": " > ".join([op["name"] for op in ops]),
             "type": "op",
-            "op": map_fn,
+            "op": _traced_mapper(ops, map_fn) if cache else map_fn,
             "input_schema": ops[0]["input_schema"],
             "output_schema": ops[-1]["output_schema"]
         }
+        for key in ["parallelism", "deterministic"]:
+            if key in ops[0]:
+                stage[key] = ops[0][key]
+        if "prefetch" in ops[-1]:
+            stage["prefetch"] = ops[-1]["prefetch"]
+        return stage
+
+    # fuse as planned
+    if fusion_plan is not None:
+        stages = {group["steps"][0]: group for group in fusion_plan}
+        fused_steps = [i for group in fusion_plan for i in group["steps"]]
+
+        planned = []
+        for i, seg in enumerate(rest, start=1):
+            if i in stages:
+                stage = get_compressed_mapper([pipeline_spec[j] for j in stages[i]["steps"]])
+                stage["parallelism"] = stage.get("parallelism", stages[i]["parallelism"])
+                planned.append(stage)
+            elif i not in fused_steps:
+                planned.append(seg)
+
+        rest = planned
 
     # optimize, compress
-    if compress_map:
+    elif compress_map:
         grouped = []
         # group map ops for compression
         buf = []
         for seg in rest:
             if seg["type"] == "op":
+                # differently configured stages can not be fused
+                if buf and (stage_settings(buf[-1]) != stage_settings(seg) or "prefetch" in buf[-1]):
+                    grouped.append(buf)
+                    buf = []
                 buf.append(seg)
             else:
                 if buf:
@@ -54,26 +168,202 @@ def build_pipeline(pipeline_spec
 
         rest = compressed
 
+    if "prefetch" in src:
+        ds = ds.prefetch(src["prefetch"])
+
     # compile the ds
     for seg in rest:
+        parallelism = seg.get("parallelism", compressed_parallelism)
+        deterministic = seg.get("deterministic")
         if seg["type"] == "op":
-            ds = ds.map(seg["op"], num_parallel_calls=compressed_parallelism)
+            ds = ds.map(seg["op"], num_parallel_calls=parallelism, deterministic=deterministic)
         if seg["type"] == "op+unbatch":
-            ds = ds.map(seg["op"], num_parallel_calls=compressed_parallelism)
+            ds = ds.map(seg["op"], num_parallel_calls=parallelism, deterministic=deterministic)
             ds = ds.unbatch()
         elif seg["type"] == "ds_transform":
             ds = ds.apply(seg["op"])
         elif seg["type"] == "unbatch":
             ds = ds.unbatch()
+        if "prefetch" in seg:
+            ds = ds.prefetch(seg["prefetch"])
+
+    if cache:
+        _cache_insert(_BUILT_PIPELINES, cache_key, (cached_spec, ds))
     return ds
 
 
-def verify_pipeline(pipeline_spec):
+def _traced_mapper(ops, map_fn):
+    '''Returns the traced map stage of the fused ops, so that the same ops are only traced once for every input signature
+    :param ops: list(dict) - fused steps
+    :param map_fn: function - applies the ops
+    :return: tf.function
+    '''
+    key = tuple(step_cache_key(op) for op in ops)
+    cached = _cache_lookup(_TRACED_MAPPERS, key)
+    if cached is None:
+        cached = (ops, tf.function(map_fn))
+        _cache_insert(_TRACED_MAPPERS, key, cached)
+    return cached[1]
+
+
+def step_cache_key(step):
+    '''Returns a hashable key of the step for the pipeline cache, built from its configuration and the "cache_key" or identity of its op
+    :param step: dict
+    :return: tuple
+    '''
+    return (step["name"]
+          , step["type"]
+          , step.get("cache_key", id(step["op"]))
+          , repr(step.get("input_schema"))
+          , repr(step.get("output_schema"))
+          , stage_settings(step)
+          , repr(step.get("prefetch"))
+          , step.get("vectorized", False))
+
+
+def clear_pipeline_cache():
+    '''Drops all datasets and traced map stages that were cached by `build_pipeline(..., cache=True)`
+    '''
+    _BUILT_PIPELINES.clear()
+    _TRACED_MAPPERS.clear()
+
+
+def vectorize_pipeline(pipeline_spec
+                     , batch_size: int):
+    '''Rewrites every run of consecutive "op" steps that are marked as "vectorized" into
+    `batch(batch_size)` -> one map stage of the ops applied on the whole batch -> `unbatch()`
+    The elements of a run need to have the same shape, which is the case for fixed-shape segments.
+    The results do not change, the last batch may be smaller.
+
+    :param pipeline_spec: list(dict)
+    :param batch_size: int
+    :return: list(dict) - rewritten pipeline specification
+    '''
+    src, *rest = pipeline_spec
+
+    def get_vectorized_steps(ops):
+        def map_fn(x):
+            for seg in ops:
+                x = seg["op"](x)
+            return x
+        stage = {
+            "name": " > ".join([op["name"] for op in ops]) + " (vectorized)",
+            "type": "op+unbatch",
+            "op": map_fn,
+            "cache_key": ("vectorized", batch_size) + tuple(step_cache_key(op) for op in ops),
+            "input_schema": _batched_schema(ops[0]["input_schema"]),
+            "output_schema": ops[-1]["output_schema"]
+        }
+        for key in ["parallelism", "deterministic"]:
+            if key in ops[0]:
+                stage[key] = ops[0][key]
+        if "prefetch" in ops[-1]:
+            stage["prefetch"] = ops[-1]["prefetch"]
+        return [{
+            "name": "batch for " + stage["name"],
+            "type": "ds_transform",
+            "op": lambda ds: ds.batch(batch_size),
+            "cache_key": ("batch", batch_size),
+            "input_schema": ops[0]["input_schema"],
+            "output_schema": stage["input_schema"]
+        }, stage]
+
+    vectorized = [src]
+    buf = []
+    for seg in rest:
+        if seg["type"] == "op" and seg.get("vectorized", False):
+            buf.append(seg)
+            continue
+        if buf:
+            vectorized += get_vectorized_steps(buf)
+            buf = []
+        vectorized.append(seg)
+    if buf:
+        vectorized += get_vectorized_steps(buf)
+
+    return vectorized
+
+
+# the materialized share of the hash buckets of the source elements
+_SELECTION_BUCKETS = 2**20
+
+
+def _is_materialized(element
+                   , ratio: float):
+    '''An element is materialized if the hash of its serialized components falls into the first `ratio` of the buckets
+    The selection only depends on the element itself, so it stays the same if the source lists or shuffles its elements
+    in another order, e.g. `list_files` for every iteration
+    :param element: tf.Tensor or nested structure of tf.Tensor
+    :param ratio: float
+    :return: tf.Tensor - bool
+    '''
+    key = tf.strings.reduce_join([tf.io.serialize_tensor(component) for component in tf.nest.flatten(element)])
+    return tf.strings.to_hash_bucket_fast(key, _SELECTION_BUCKETS) < int(round(ratio * _SELECTION_BUCKETS))
+
+
+def select_materialized(pipeline_spec
+                       , ratio: float
+                       , materialized: bool):
+    '''Inserts a step after the source that keeps only the source elements that are materialized (or computed online) at the ratio
+    The selection hashes every source element (see `_is_materialized`), so both selections of the same ratio never share an
+    element. Together they cover the elements the source returns, if its elements are distinct. The materialized share is
+    `ratio` of the source elements on average, not exactly, and of the samples only if every source element is one sample.
+
+    :param pipeline_spec: list(dict)
+    :param ratio: float - 0-1, share of the materialized source elements
+    :param materialized: bool - keep the materialized elements, otherwise the ones that are computed online
+    :return: list(dict)
+    '''
+    src, *rest = pipeline_spec
+    return [src, {
+        "name": "select materialized samples" if materialized else "select computed samples",
+        "type": "ds_transform",
+        "op": lambda ds: ds.filter(lambda *element: _is_materialized(element, ratio) == materialized),
+        "cache_key": ("select materialized", ratio, materialized),
+        "input_schema": src["output_schema"],
+        "output_schema": src["output_schema"]
+    }] + rest
+
+
+def merge_materialized(materialized_dataset
+                     , computed_dataset
+                     , ratio: float
+                     , seed: int = 42):
+    '''Merges the two selections of `select_materialized`, until both are exhausted
+    The shards return the materialized samples in their own order, so the samples are drawn at random from both datasets
+    with the weights of the ratio instead of in the order of the source. This also holds for sources with several samples per element
+
+    :param materialized_dataset: tf.data.Dataset - read from the shards
+    :param computed_dataset: tf.data.Dataset - computed by the whole pipeline
+    :param ratio: float
+    :param seed: int (default = 42)
+    :return: tf.data.Dataset
+    '''
+    # an exhausted dataset is skipped, the other one is read to its end
+    return tf.data.experimental.sample_from_datasets([materialized_dataset, computed_dataset]
+                                                   , weights=[ratio, 1 - ratio]
+                                                   , seed=seed)
+
+
+def stage_settings(step):
+    '''Returns the optional map stage settings of a step, steps with different settings are not fused
+    :param step: dict
+    :return: tuple (parallelism, deterministic)
+    '''
+    return (step.get("parallelism"), step.get("deterministic"))
+
+
+def verify_pipeline(pipeline_spec
+                  , infer_schemas: bool = False):
     '''Verify pipeline specification for matching schemas
     Throws an exception in case an error is found
 
     :param pipeline_spec: list(dict)
+    :param infer_schemas: bool (default = False), also trace every op and check the declared schemas against the inferred ones, see `refine_schemas`
     '''
+    if infer_schemas:
+        refine_schemas(pipeline_spec)
+
     if len(pipeline_spec) <= 1:
         return True
 
@@ -88,38 +378,317 @@ def verify_pipeline(pipeline_spec):
         last_output_schema = segment["output_schema"]
 
 
+def infer_output_schema(step
+                      , input_schema):
+    '''Traces the step on the input schema and returns the schema of its output
+    Only the shapes and types are traced, no data is read or processed
+
+    :param step: dict
+    :param input_schema: tf.TensorSpec or dict(tf.TensorSpec), ignored for a "source"
+    :return: tf.TensorSpec or dict(tf.TensorSpec)
+    '''
+    if step["type"] == "source":
+        return step["op"].element_spec
+
+    empty_ds = tf.data.Dataset.from_generator(lambda: iter([]), output_signature=input_schema)
+    output_schema = build_pipeline([{"name": "input", "type": "source", "op": empty_ds}, step]
+                                 , compress_map=False).element_spec
+    # a single output of tf.py_function(..., Tout=[...]) arrives as 1-tuple
+    if isinstance(output_schema, tuple) and len(output_schema) == 1:
+        output_schema = output_schema[0]
+    return output_schema
+
+
+def _merged_schema(declared_schema
+                 , inferred_schema
+                 , description: str):
+    '''Merges the declared and the inferred schema into the most specific schema that is compatible with both
+    :param declared_schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :param inferred_schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :param description: str, where the schemas belong to for the error message
+    :return: tf.TensorSpec or dict(tf.TensorSpec)
+    '''
+    try:
+        tf.nest.assert_same_structure(declared_schema, inferred_schema)
+    except (ValueError, TypeError):
+        raise Exception("Schemas do not match at {} (declared {}, inferred {})".format(description, declared_schema, inferred_schema))
+
+    def merged(declared_spec, inferred_spec):
+        if declared_spec.dtype != inferred_spec.dtype or not declared_spec.shape.is_compatible_with(inferred_spec.shape):
+            raise Exception("Schemas do not match at {} (declared {}, inferred {})".format(description, declared_schema, inferred_schema))
+        return tf.TensorSpec(declared_spec.shape.merge_with(inferred_spec.shape), declared_spec.dtype)
+
+    return tf.nest.map_structure(merged, declared_schema, inferred_schema)
+
+
+def refine_schemas(pipeline_spec):
+    '''Traces every step on the schema it receives from the previous step and checks the declared schemas against the inferred ones
+    Catches wrong schemas before running the pipeline. The declared and inferred shapes are merged, so that
+    dimensions that are only known from tracing become static for the serialization at a split.
+    Throws an exception in case a declared schema is incompatible
+
+    :param pipeline_spec: list(dict)
+    :return: list(dict) - copy of the specification with the refined "input_schema" and "output_schema" of every step
+    '''
+    refined = []
+    last_output_schema = None
+    for step in pipeline_spec:
+        step = dict(step)
+        if step["type"] != "source":
+            step["input_schema"] = _merged_schema(step["input_schema"], last_output_schema, "the input of " + step["name"])
+        inferred_schema = infer_output_schema(step, step.get("input_schema"))
+        step["output_schema"] = _merged_schema(step["output_schema"], inferred_schema, "the output of " + step["name"])
+        last_output_schema = step["output_schema"]
+        refined.append(step)
+    return refined
+
+
 def serialized_split(pipeline_spec
-                   , split_pos: int):
+                   , split_pos: int
+                   , serialization_format: str = "example"
+                   , samples_per_record: int = 1
+                   , record_codec: str = None
+                   , codec_level: int = None
+                   , storage_dtype: str = "none"
+                   , storage_range: tuple = None):
     '''Split pipeline at given position and add serialization and deserialization
     operators to the parts
 
     :param pipeline_spec: list(dict)
     :param split_pos: index to split the pipeline, operator at index will be included in second half
+    :param serialization_format: str (default = "example"), record format at the split, see `serialization_formats()`
+    :param samples_per_record: int (default = 1), packs this many samples into one record with `batch` and unpacks them with `unbatch` after deserialization. All samples of a record need the same shape
+    :param record_codec: str (default = None), compresses every serialized record with this codec of `codecs.register_codec` as part of the (de)serialization step
+    :param codec_level: int (default = None), level of the record codec, its default if None
+    :param storage_dtype: str (default = "none"), the floating point features are stored with this dtype and restored after deserialization, see `storage_dtypes()`
+    :param storage_range: tuple(float, float) (default = None), lowest and highest value of the floating point features, mapped onto the range of an integer storage dtype
     :return: tuple, with both halfs of the pipeline
     '''
     if split_pos > len(pipeline_spec):
         raise Exception("Both splits must at least contain one segment.")
+    if serialization_format not in _SERIALIZATION_FORMATS:
+        raise Exception("Unknown serialization format '{}', pick one of {}".format(serialization_format, serialization_formats()))
+    if samples_per_record < 1:
+        raise Exception("samples_per_record must be at least 1, got {}".format(samples_per_record))
+
+    if record_codec != None and not codecs.is_record_codec(record_codec):
+        raise Exception("Unknown record codec '{}', pick one of {}".format(record_codec, [c for c in codecs.compression_types() if codecs.is_record_codec(c)]))
+
+    make_serializer, make_deserializer = _SERIALIZATION_FORMATS[serialization_format]
+    reduce_precision, restore_precision = precision_reducer(storage_dtype, storage_range)
 
     a, b = pipeline_spec[:split_pos], pipeline_spec[split_pos:]
 
-    serialization_schema = a[-1]["output_schema"]
+    sample_schema = a[-1]["output_schema"]
+    serialization_schema = sample_schema
+
+    if samples_per_record > 1:
+        serialization_schema = _batched_schema(sample_schema)
+        a.append({
+            "name": "pack records",
+            "type": "ds_transform",
+            "op": lambda ds: ds.batch(samples_per_record),
+            "cache_key": ("batch", samples_per_record),
+            "input_schema": sample_schema,
+            "output_schema": serialization_schema
+        })
+        b.insert(0, {
+            "name": "unpack records",
+            "type": "unbatch",
+            "op": None,
+            "input_schema": serialization_schema,
+            "output_schema": sample_schema
+        })
+
+    serialize = make_serializer(stored_schema(serialization_schema, storage_dtype))
+    deserialize = make_deserializer(stored_schema(serialization_schema, storage_dtype))
+    # like the codec, the precision is part of the (de)serialization
+    if storage_dtype != "none":
+        serialize_stored, deserialize_stored = serialize, deserialize
+        serialize = lambda x: serialize_stored(reduce_precision(x))
+        deserialize = lambda record: restore_precision(deserialize_stored(record), serialization_schema)
+    # the codec is part of the (de)serialization, so that `multi_split_offline_pipeline` compresses the records as well
+    if record_codec != None:
+        compress, decompress = codecs.record_compressor(record_codec, codec_level), codecs.record_decompressor(record_codec)
+        serialize_record, deserialize_record = serialize, deserialize
+        serialize = lambda x: compress(serialize_record(x))
+        deserialize = lambda record: deserialize_record(decompress(record))
+
     a.append({
         "name": "serialize",
         "type": "op",
-        "op": serializer(serialization_schema),
+        "op": serialize,
+        "cache_key": ("serialize", serialization_format, repr(serialization_schema), record_codec, codec_level, storage_dtype, storage_range),
         "input_schema": serialization_schema,
         "output_schema": tf.TensorSpec([], tf.string)
     })
     b.insert(0, {
         "name": "deserialize",
         "type": "op",
-        "op": deserializer(serialization_schema),
+        "op": deserialize,
+        "cache_key": ("deserialize", serialization_format, repr(serialization_schema), record_codec, storage_dtype, storage_range),
         "input_schema": tf.TensorSpec([], tf.string),
         "output_schema": serialization_schema 
     })
 
     return a, b
 
+def multi_split_offline_pipeline(pipeline_spec
+                               , split_positions
+                               , serialize_steps):
+    '''Builds one offline part that walks the pipeline once and serializes the samples at several split positions
+    The elements are tuples with one record per split position, to be written with `save_ds_multi_parallel`.
+    All steps between the first and the last split position need to be "op" steps, so that every sample reaches every position.
+
+    :param pipeline_spec: list(dict)
+    :param split_positions: list(int) - positions like in `serialized_split`, can repeat
+    :param serialize_steps: list(dict) - per split position the "serialize" step of its offline part, see `serialized_split`
+    :return: list(dict)
+    '''
+    first_position, last_position = min(split_positions), max(split_positions)
+    if last_position > len(pipeline_spec) or first_position < 1:
+        raise Exception("Split positions have to be between 1 and {}, got {}".format(len(pipeline_spec), split_positions))
+    shared_steps = pipeline_spec[first_position:last_position]
+    if any(step["type"] != "op" for step in shared_steps):
+        raise Exception("Only \"op\" steps can be between the split positions {}".format(split_positions))
+
+    def serialize_all(x):
+        records = [None] * len(split_positions)
+        for position in range(first_position, last_position + 1):
+            for i, split_position in enumerate(split_positions):
+                if split_position == position:
+                    records[i] = serialize_steps[i]["op"](x)
+            if position < last_position:
+                x = pipeline_spec[position]["op"](x)
+        return tuple(records)
+
+    return pipeline_spec[:first_position] + [{
+        "name": "serialize at " + ", ".join([str(position) for position in split_positions]),
+        "type": "op",
+        "op": serialize_all,
+        "input_schema": pipeline_spec[first_position - 1]["output_schema"],
+        "output_schema": tuple(tf.TensorSpec([], tf.string) for _ in split_positions)
+    }]
+
+def _batched_schema(schema):
+    '''Adds an unknown leading batch dimension to the schema
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :return: tf.TensorSpec or dict(tf.TensorSpec)
+    '''
+    def batched(spec):
+        return tf.TensorSpec(tf.TensorShape([None]).concatenate(spec.shape), spec.dtype)
+
+    if isinstance(schema, dict):
+        return {feature_name: batched(feature_spec) for feature_name, feature_spec in schema.items()}
+    return batched(schema)
+
+_STORAGE_DTYPES = {
+    "none": None
+  , "float16": tf.float16
+  , "bfloat16": tf.bfloat16
+  , "uint8": tf.uint8
+  , "int16": tf.int16
+}
+
+def storage_dtypes():
+    '''Names of the dtypes the floating point features can be stored with at the split position
+    * none     - as computed
+    * float16  - IEEE half precision, relative error of about 1e-3
+    * bfloat16 - range of float32 with a relative error of about 1e-2
+    * uint8    - linear quantization of a value range onto 256 steps
+    * int16    - linear quantization of a value range onto 65536 steps
+
+    :return: list(str)
+    '''
+    return list(_STORAGE_DTYPES.keys())
+
+
+def _reduced(feature_spec
+           , storage_dtype: str):
+    '''
+    :param feature_spec: tf.TensorSpec
+    :param storage_dtype: str
+    :return: bool - if the feature is stored with the storage dtype
+    '''
+    return storage_dtype != "none" and feature_spec.dtype.is_floating
+
+
+def stored_schema(schema
+                , storage_dtype: str):
+    '''Returns the schema of the features as they are stored
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :param storage_dtype: str
+    :return: tf.TensorSpec or dict(tf.TensorSpec)
+    '''
+    return tf.nest.map_structure(lambda feature_spec: tf.TensorSpec(feature_spec.shape, _STORAGE_DTYPES[storage_dtype]) if _reduced(feature_spec, storage_dtype) else feature_spec
+                               , schema)
+
+
+def precision_reducer(storage_dtype: str
+                    , storage_range: tuple = None):
+    '''Returns the ops that reduce the floating point features to the storage dtype and restore them
+    Integer dtypes store round((x - low) / scale) with scale = (high - low) / (number of steps - 1), values outside of the
+    range are clipped. The maximum error inside the range is scale / 2
+
+    :param storage_dtype: str - see `storage_dtypes()`
+    :param storage_range: tuple(float, float) (default = None), lowest and highest value, needed for integer dtypes
+    :return: tuple(function(x) -> stored x, function(stored x, schema) -> x)
+    '''
+    if storage_dtype not in _STORAGE_DTYPES:
+        raise Exception("Unknown storage dtype '{}', pick one of {}".format(storage_dtype, storage_dtypes()))
+    dtype = _STORAGE_DTYPES[storage_dtype]
+    quantized = dtype != None and dtype.is_integer
+    if quantized and storage_range == None:
+        raise Exception("The storage dtype '{}' needs a storage_range".format(storage_dtype))
+    if quantized:
+        low, high = storage_range
+        scale = (high - low) / (dtype.max - dtype.min)
+
+    def reduce_feature(x):
+        if not x.dtype.is_floating or dtype == None:
+            return x
+        if not quantized:
+            return tf.cast(x, dtype)
+        steps = tf.round((tf.cast(x, tf.float64) - low) / scale) + dtype.min
+        return tf.cast(tf.clip_by_value(steps, dtype.min, dtype.max), dtype)
+
+    def restore_feature(x, feature_spec):
+        if not _reduced(feature_spec, storage_dtype):
+            return x
+        if not quantized:
+            return tf.cast(x, feature_spec.dtype)
+        return tf.cast((tf.cast(x, tf.float64) - dtype.min) * scale + low, feature_spec.dtype)
+
+    def reduce_precision(x):
+        return tf.nest.map_structure(reduce_feature, x)
+
+    def restore_precision(x, schema):
+        return tf.nest.map_structure(restore_feature, x, schema)
+
+    return reduce_precision, restore_precision
+
+
+def max_abs_error(dataset
+                , storage_dtype: str
+                , storage_range: tuple = None
+                , probe_count: int = 100):
+    '''Measures the largest absolute error of reducing and restoring the floating point features on the first samples
+    :param dataset: tf.data.Dataset - samples at the split position
+    :param storage_dtype: str
+    :param storage_range: tuple(float, float) (default = None)
+    :param probe_count: int (default = 100)
+    :return: float
+    '''
+    reduce_precision, restore_precision = precision_reducer(storage_dtype, storage_range)
+    error = 0.0
+    for x in dataset.take(probe_count):
+        restored = restore_precision(reduce_precision(x), tf.nest.map_structure(lambda t: tf.TensorSpec(t.shape, t.dtype), x))
+        for feature, restored_feature in zip(tf.nest.flatten(x), tf.nest.flatten(restored)):
+            if feature.dtype.is_floating and tf.size(feature) > 0:
+                error = max(error, float(tf.reduce_max(tf.abs(tf.cast(feature, tf.float64) - tf.cast(restored_feature, tf.float64)))))
+    return error
+
+
 def serializer(schema):
     '''Prepares the serialization to a string for the previous data format
     :param schema: tf.TensorSpec
@@ -198,31 +767,835 @@ def deserializer(schema):
 
     return deserialize
 
+def tensor_serializer(schema):
+    '''Prepares the serialization to a string for the previous data format with graph ops only
+    Every feature is serialized with `tf.io.serialize_tensor`. Structured samples are stacked (sorted by
+    feature name) into a string vector that is serialized once more. No `tf.py_function` is involved,
+    so the serialization runs in parallel with the rest of the fused map stage
+
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :return: function (input -> str)
+    '''
+    if not isinstance(schema, dict):
+        return tf.io.serialize_tensor
+
+    order = sorted(list(schema.keys()))
+
+    def map_fn(x):
+        return tf.io.serialize_tensor(tf.stack([tf.io.serialize_tensor(x[feature]) for feature in order]))
+
+    return map_fn
+
+
+def tensor_deserializer(schema):
+    '''Prepares the deserialization from a string created by `tensor_serializer` to the previous data format
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :return: function (str -> input)
+    '''
+    def parse(x, feature_spec):
+        value = tf.io.parse_tensor(x, feature_spec.dtype)
+        value.set_shape(feature_spec.shape)
+        return value
+
+    if not isinstance(schema, dict):
+        return lambda x: parse(x, schema)
+
+    order = sorted(list(schema.keys()))
+
+    def deserialize(x):
+        features = tf.io.parse_tensor(x, tf.string)
+        return {feature: parse(features[i], schema[feature]) for i, feature in enumerate(order)}
+
+    return deserialize
+
+
+def _raw_bytes(tensor):
+    '''Returns the contiguous raw (little endian) bytes of a numeric tensor with graph ops only
+    `tf.io.serialize_tensor` stores numeric tensors as TensorProto with `tensor_content` as the last field,
+    so the raw bytes are the suffix of the serialized proto
+
+    :param tensor: tf.Tensor
+    :return: tf.Tensor (str)
+    '''
+    serialized = tf.io.serialize_tensor(tensor)
+    byte_count = tf.size(tensor) * tensor.dtype.size
+    return tf.strings.substr(serialized, tf.strings.length(serialized) - byte_count, byte_count)
+
+
+def _raw_layout(schema):
+    '''Computes the raw record layout from the split schema
+    :param schema: dict(tf.TensorSpec)
+    :return: tuple(list(str), int) - sorted feature names and the amount of int32 header entries
+    '''
+    order = sorted(list(schema.keys()))
+    header_count = 0
+    for feature_name in order:
+        feature_spec = schema[feature_name]
+        if feature_spec.shape.rank is None:
+            raise Exception("The raw format needs a known rank for feature '{}'".format(feature_name))
+        if feature_spec.dtype == tf.string:
+            header_count += 1
+        else:
+            header_count += sum(1 for dim in feature_spec.shape if dim is None)
+    # pad the header to 8 bytes so that the payload stays aligned for 64 bit types
+    header_count += header_count % 2
+    return order, header_count
+
+
+def raw_serializer(schema):
+    '''Prepares the serialization to a compact raw record for the previous data format
+    Layout (features sorted by name): an int32 header with the dynamic dimensions of every numeric feature
+    and the byte length of every string feature, followed by the contiguous raw bytes of all features.
+    Scalar strings are stored as they are, other string tensors with `tf.io.serialize_tensor`.
+    Fully static numeric schemas have no header at all.
+
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :return: function (input -> str)
+    '''
+    singleton = not isinstance(schema, dict)
+    if singleton:
+        schema = {"data": schema}
+
+    order, header_count = _raw_layout(schema)
+
+    def serialize(x):
+        if singleton:
+            x = {"data": x}
+        header = []
+        payload = []
+        for feature_name in order:
+            feature_spec = schema[feature_name]
+            value = x[feature_name]
+            if feature_spec.dtype == tf.string:
+                if feature_spec.shape.rank != 0:
+                    value = tf.io.serialize_tensor(value)
+                header.append(tf.strings.length(value))
+                payload.append(value)
+            else:
+                shape = tf.shape(value, out_type=tf.int32)
+                header += [shape[i] for i, dim in enumerate(feature_spec.shape) if dim is None]
+                payload.append(_raw_bytes(value))
+        if header_count > 0:
+            header += [tf.constant(0, tf.int32)] * (header_count - len(header))
+            payload.insert(0, _raw_bytes(tf.stack(header)))
+        return tf.strings.join(payload)
+
+    return serialize
+
+
+def raw_deserializer(schema):
+    '''Prepares the deserialization from a string created by `raw_serializer` to the previous data format
+    A single numeric feature is decoded with one `tf.io.decode_raw` and a reshape
+
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :return: function (str -> input)
+    '''
+    singleton = not isinstance(schema, dict)
+    if singleton:
+        schema = {"data": schema}
+
+    order, header_count = _raw_layout(schema)
+    header_bytes = 4 * header_count
+
+    def decode_shape(feature_spec, header, header_index):
+        dims = []
+        for dim in feature_spec.shape:
+            if dim is None:
+                dims.append(header[header_index])
+                header_index += 1
+            else:
+                dims.append(dim)
+        return dims, header_index
+
+    def deserialize_single_numeric(x):
+        feature_spec = schema[order[0]]
+        values = tf.io.decode_raw(x, feature_spec.dtype)
+        if header_count == 0:
+            value = tf.reshape(values, feature_spec.shape)
+        else:
+            header = tf.io.decode_raw(tf.strings.substr(x, 0, header_bytes), tf.int32)
+            shape, _ = decode_shape(feature_spec, header, 0)
+            value = tf.reshape(values[header_bytes // feature_spec.dtype.size:], shape)
+        value.set_shape(feature_spec.shape)
+        return value
+
+    def deserialize(x):
+        header = tf.io.decode_raw(tf.strings.substr(x, 0, header_bytes), tf.int32) if header_count > 0 else None
+        header_index = 0
+        offset = tf.constant(header_bytes, tf.int32)
+        example = {}
+        for feature_name in order:
+            feature_spec = schema[feature_name]
+            if feature_spec.dtype == tf.string:
+                byte_count = header[header_index]
+                header_index += 1
+                value = tf.strings.substr(x, offset, byte_count)
+                if feature_spec.shape.rank != 0:
+                    value = tf.io.parse_tensor(value, tf.string)
+            else:
+                shape, header_index = decode_shape(feature_spec, header, header_index)
+                byte_count = tf.reduce_prod(tf.stack(shape)) * feature_spec.dtype.size if shape else feature_spec.dtype.size
+                value = tf.reshape(tf.io.decode_raw(tf.strings.substr(x, offset, byte_count), feature_spec.dtype), shape)
+            value.set_shape(feature_spec.shape)
+            example[feature_name] = value
+            offset += byte_count
+
+        if singleton:
+            return example["data"]
+        else:
+            return example
+
+    if singleton and schema["data"].dtype != tf.string:
+        return deserialize_single_numeric
+    return deserialize
+
+
+_SERIALIZATION_FORMATS = {
+    "example": (serializer, deserializer)
+  , "tensor": (tensor_serializer, tensor_deserializer)
+  , "raw": (raw_serializer, raw_deserializer)
+}
+
+def serialization_formats():
+    '''Names of the record formats that can be used at the split position
+    * example - tf.train.Example with serialized tensors, built in a tf.py_function
+    * tensor  - nested `tf.io.serialize_tensor`, graph ops only
+    * raw     - small shape header followed by the contiguous raw tensor bytes, graph ops only
+
+    :return: list(str)
+    '''
+    return list(_SERIALIZATION_FORMATS.keys())
+
+
+_STORAGE_FORMATS = ["tfrecord", "fixed-length", "memmap"]
+
+def storage_formats():
+    '''Names of the file formats for the shards at the split position
+    * tfrecord     - `shard-N.tfrecord` files, optionally compressed
+    * fixed-length - `shard-N.bin` files of raw records without framing, read with `tf.data.FixedLengthRecordDataset`
+    * memmap       - same files as fixed-length, read as decoded samples from `np.memmap` arrays
+    Both fixed-length formats need the raw serialization format, no compression and a fully static schema at the split
+
+    :return: list(str)
+    '''
+    return list(_STORAGE_FORMATS)
+
+
+def mean_record_size_b(dataset
+                     , probe_count: int = 32):
+    '''Averages the size of the first records of a dataset of serialized records
+    :param dataset: tf.data.Dataset - scalar tf.string elements
+    :param probe_count: int (default = 32)
+    :return: float - 0 for an empty dataset
+    '''
+    sizes_b = [len(record) for record in dataset.take(probe_count).as_numpy_iterator()]
+    return float(np.mean(sizes_b)) if sizes_b != [] else 0.0
+
+
+def auto_shard_count(record_count: int
+                   , record_size_b: float
+                   , target_shard_size_b: float
+                   , reader_count: int):
+    '''Picks the shard count so that every shard has about the target size and all readers have the same number of shards
+    :param record_count: int
+    :param record_size_b: float - e.g. from `mean_record_size_b`
+    :param target_shard_size_b: float
+    :param reader_count: int - parallel reads of the online part
+    :return: int - multiple of `reader_count`, at least `reader_count`
+    '''
+    reader_count = max(reader_count, 1)
+    shard_count = int(np.ceil(record_count * record_size_b / target_shard_size_b))
+    return max(int(np.ceil(shard_count / reader_count)), 1) * reader_count
+
+
 def save_ds_parallel(dataset
                    , shard_count: int 
                    , shard_directory: str
-                   , compression_type: str):
+                   , compression_type: str
+                   , fixed_length: bool = False
+                   , records_per_shard: int = None
+                   , spill_directory: str = None
+                   , byte_budget: int = None
+                   , compression_level: int = None
+                   , balance_bytes: bool = False
+                   , indexed: bool = False):
     '''Saves the dataset into N shards at the according path. 
-    TODO: writers are buffered
-          if buffer write-back is synchronous, this is not really parallel
-          but there does not seem to be any other way using TF measures
+    Every shard is written by its own worker thread with its own `TFRecordWriter`. The calling thread only pulls
+    records from the dataset and hands them round-robin (record i goes to shard i % N) to bounded per-shard queues.
+    `TFRecordWriter.write` releases the GIL, so writing and compressing the shards runs in parallel and off the calling thread.
 
     :param dataset: tf.Dataset to be saved
     :param shard_count: int, amount of shards to split the dataset in
     :param shard_directory: str - filepath to the directory to save the shards in. If it already exists, an error is thrown
     :param compression_type: str - compression type for the intermediate representations. Possible parameters: ZLIB, GZIP, or "" for no compression
+    :param fixed_length: bool (default = False), write the records back to back without framing into `shard-N.bin` files and
+        a sidecar index (`FIXED_LENGTH_INDEX`) with the record size and counts. All records need the same size and are not compressed,
+        see `fixed_length_shards_dataset` and `memmap_shards_dataset`
+    :param records_per_shard: Optional[int] (default = None), fill the shards one after another with blocks of this many records
+        instead of round-robin. Every TFRecord shard is written as `.partial` file and renamed when its block is complete,
+        so that a reader can consume the sealed shards while later ones are still written (see `sealed_shards_dataset`)
+    :param spill_directory: str (default = None), directory for the records that exceed the byte budget of `shard_directory`,
+        e.g. if `shard_directory` is in `/dev/shm`. A shard that exceeds the budget is continued in a file of the same name in this directory
+    :param byte_budget: int (default = None), uncompressed record bytes of all shards that are written to `shard_directory` before spilling
+    :param compression_level: int (default = None), level of the ZLIB or GZIP compression, 0-9. The default of zlib if None
+    :param balance_bytes: bool (default = False), hand every record to the shard with the fewest bytes so far instead of round-robin,
+        so that records of variable size do not skew the shard sizes
+    :param indexed: bool (default = False), write the offset index `shard-N.index` of every TFRecord shard and the manifest
+        `TFRECORD_MANIFEST` of the directory, see `indexed_shards_dataset`
+    :return: float - seconds the busiest shard writer spent writing
     '''
+    if records_per_shard != None and fixed_length:
+        raise Exception("Sealed shards are only supported for TFRecord files")
+    if records_per_shard != None and balance_bytes:
+        raise Exception("Sealed shards are filled one after another and can not be balanced by bytes")
+    if spill_directory != None and (fixed_length or records_per_shard != None):
+        raise Exception("Spilling shards is only supported for TFRecord files that are not sealed")
+    shard_spec = {
+        "shard_count": shard_count,
+        "shard_directory": shard_directory,
+        "compression_type": compression_type,
+        "fixed_length": fixed_length,
+        "records_per_shard": records_per_shard,
+        "spill_directory": spill_directory,
+        "byte_budget": byte_budget,
+        "compression_level": compression_level,
+        "balance_bytes": balance_bytes,
+        "indexed": indexed
+    }
+    records = ((record,) for record in dataset.as_numpy_iterator())
+    return _save_records_parallel(records, [shard_spec])[0]
 
-    tf_writer = tf.io.TFRecordWriter
 
-    shard_directory_path = pathlib.Path(shard_directory)
-    shard_directory_path.mkdir(exist_ok = True, parents = True)
+def save_ds_multi_parallel(dataset
+                         , shard_specs):
+    '''Saves every component of the tuple elements of the dataset into its own shards, e.g. the records of several split positions
+    Works like `save_ds_parallel` with worker threads for all shards of all components
 
-    writers = [tf.io.TFRecordWriter(f"{shard_directory}/shard-{shard_number}.tfrecord", options=compression_type) for shard_number in range(shard_count)]
+    :param dataset: tf.Dataset of tuples of records
+    :param shard_specs: list(dict) - per tuple component the "shard_count", "shard_directory", "compression_type" and optionally "compression_level", "fixed_length", "records_per_shard", "spill_directory", "byte_budget", "balance_bytes" and "indexed"
+    :return: list(float) - per tuple component, seconds the busiest shard writer spent writing
+    '''
+    return _save_records_parallel(dataset.as_numpy_iterator(), shard_specs)
 
-    for i, record in dataset.enumerate():
-        writers[i % shard_count].write(record.numpy())
 
-    for writer in writers:
+def _save_records_parallel(records
+                         , shard_specs):
+    '''Writes component j of every tuple of records into the shards described by `shard_specs[j]`
+    :param records: iterator of tuple(bytes)
+    :param shard_specs: list(dict) - see `save_ds_multi_parallel`
+    :return: list(float) - per component, seconds the busiest shard writer spent writing
+    '''
+    for shard_spec in shard_specs:
+        pathlib.Path(shard_spec["shard_directory"]).mkdir(exist_ok = True, parents = True)
+        if shard_spec.get("spill_directory") != None:
+            pathlib.Path(shard_spec["spill_directory"]).mkdir(exist_ok = True, parents = True)
+    # shared by all shards of a component
+    byte_budgets = [_ByteBudget(shard_spec["byte_budget"]) if shard_spec.get("byte_budget") != None else None for shard_spec in shard_specs]
+
+    record_queues = [[_RecordQueue(maxsize=_WRITER_QUEUE_SIZE) for _ in range(shard_spec["shard_count"])]
+                     for shard_spec in shard_specs]
+    # bytes handed to every shard so far, to balance them
+    shard_bytes = [[0] * shard_spec["shard_count"] for shard_spec in shard_specs]
+    # set by a failed writer, so that the producer stops pulling records before the error is raised
+    writer_failed = threading.Event()
+
+    def write_shard(component, shard_number):
+        shard_spec = shard_specs[component]
+        record_queue = record_queues[component][shard_number]
+        try:
+            if shard_spec.get("fixed_length", False):
+                return _write_fixed_length_shard(record_queue, f"{shard_spec['shard_directory']}/shard-{shard_number}.bin")
+            spill_path = None
+            if shard_spec.get("spill_directory") != None:
+                spill_path = f"{shard_spec['spill_directory']}/shard-{shard_number}.tfrecord"
+            return _write_tfrecord_shard(record_queue
+                                       , f"{shard_spec['shard_directory']}/shard-{shard_number}.tfrecord"
+                                       , tf.io.TFRecordOptions(compression_type=shard_spec["compression_type"]
+                                                             , compression_level=shard_spec.get("compression_level"))
+                                       , sealed=shard_spec.get("records_per_shard") != None
+                                       , spill_path=spill_path
+                                       , byte_budget=byte_budgets[component]
+                                       , indexed=shard_spec.get("indexed", False))
+        except:
+            writer_failed.set()
+            # keep draining so that the producer never blocks on a full queue, unless the writer failed after
+            # the sentinel, e.g. while closing or renaming the file, and no records follow
+            while not record_queue.sentinel_taken:
+                record_queue.get()
+            raise
+
+    worker_count = sum(shard_spec["shard_count"] for shard_spec in shard_specs)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        writers = [[executor.submit(write_shard, component, shard_number) for shard_number in range(len(component_queues))]
+                   for component, component_queues in enumerate(record_queues)]
+        try:
+            for i, component_records in enumerate(records):
+                if writer_failed.is_set():
+                    break
+                for shard_spec, component_queues, component_bytes, record in zip(shard_specs, record_queues, shard_bytes, component_records):
+                    records_per_shard = shard_spec.get("records_per_shard")
+                    if shard_spec.get("balance_bytes", False):
+                        shard_number = component_bytes.index(min(component_bytes))
+                        component_bytes[shard_number] += len(record)
+                        component_queues[shard_number].put(record)
+                        continue
+                    if records_per_shard == None:
+                        component_queues[i % len(component_queues)].put(record)
+                        continue
+                    shard_number = min(i // records_per_shard, len(component_queues) - 1)
+                    component_queues[shard_number].put(record)
+                    # the block is complete, the writer can seal the shard
+                    if (i + 1) % records_per_shard == 0 and shard_number < len(component_queues) - 1:
+                        component_queues[shard_number].put(None)
+        finally:
+            for component_queues in record_queues:
+                for record_queue in component_queues:
+                    record_queue.put(None)
+        shard_infos = [[writer.result() for writer in component_writers] for component_writers in writers]
+
+    for shard_spec, component_infos in zip(shard_specs, shard_infos):
+        if shard_spec.get("fixed_length", False):
+            _write_fixed_length_index(shard_spec["shard_directory"], component_infos)
+            continue
+        if not shard_spec.get("indexed", False):
+            continue
+        _write_tfrecord_manifest(shard_spec["shard_directory"], shard_spec["compression_type"])
+        if shard_spec.get("spill_directory") != None:
+            _write_tfrecord_manifest(shard_spec["spill_directory"], shard_spec["compression_type"])
+
+    return [max([write_s for _, _, write_s in component_infos], default=0) for component_infos in shard_infos]
+
+
+class _RecordQueue(queue.Queue):
+    '''Bounded queue from the producer to one shard writer, remembers if the writer took the None sentinel
+    '''
+    def __init__(self, maxsize: int):
+        '''
+        :param maxsize: int
+        '''
+        super().__init__(maxsize=maxsize)
+        self.sentinel_taken = False
+
+    def get(self, *args, **kwargs):
+        record = super().get(*args, **kwargs)
+        if record is None:
+            self.sentinel_taken = True
+        return record
+
+
+class _ByteBudget:
+    '''Bytes that the writer threads of several shards take from until the budget is used up
+    '''
+    def __init__(self, budget_b: int):
+        '''
+        :param budget_b: int
+        '''
+        self._remaining_b = budget_b
+        self._lock = threading.Lock()
+
+    def take(self, size_b: int):
+        '''
+        :param size_b: int
+        :return: bool - False if the bytes do not fit into the rest of the budget
+        '''
+        with self._lock:
+            if size_b > self._remaining_b:
+                return False
+            self._remaining_b -= size_b
+            return True
+
+
+def _write_tfrecord_shard(record_queue
+                        , shard_path: str
+                        , options: tf.io.TFRecordOptions
+                        , sealed: bool = False
+                        , spill_path: str = None
+                        , byte_budget: _ByteBudget = None
+                        , indexed: bool = False):
+    '''Writes the records of the queue into one TFRecord file until the None sentinel arrives
+
+    :param record_queue: queue.Queue
+    :param shard_path: str
+    :param options: tf.io.TFRecordOptions - compression type and level
+    :param sealed: bool (default = False), write into `<shard_path>.partial` and rename it to `shard_path` when the file is closed
+    :param spill_path: str (default = None), the shard is continued in this file as soon as a record does not fit into the byte budget
+    :param byte_budget: _ByteBudget (default = None), shared with the other shards that write into the same directory
+    :param indexed: bool (default = False), write the offset and length of every record to `shard-N.index` next to the file (see `_write_tfrecord_index`)
+    :return: tuple(None, int, float) - no fixed record size, record count and seconds spent writing
+    '''
+    record_count = 0
+    write_s = 0
+    write_path = shard_path + ".partial" if sealed else shard_path
+    writer = tf.io.TFRecordWriter(write_path, options=options)
+    spilled = False
+    # (offset, length) of the records in the current file
+    record_offsets = []
+    offset = 0
+    try:
+        record = record_queue.get()
+        while record is not None:
+            if spill_path != None and not spilled and not byte_budget.take(len(record)):
+                writer.close()
+                if indexed:
+                    _write_tfrecord_index(shard_path, record_offsets)
+                writer = tf.io.TFRecordWriter(spill_path, options=options)
+                spilled = True
+                record_offsets = []
+                offset = 0
+            start = time.time()
+            writer.write(record)
+            write_s += time.time() - start
+            record_offsets.append((offset, len(record)))
+            offset += len(record) + _TFRECORD_FRAMING_B
+            record_count += 1
+            record = record_queue.get()
+    finally:
         writer.close()
-        
+    if indexed:
+        _write_tfrecord_index(spill_path if spilled else shard_path, record_offsets)
+    if sealed:
+        os.replace(write_path, shard_path)
+    return None, record_count, write_s
+
+
+def _tfrecord_index_path(shard_path: str):
+    '''
+    :param shard_path: str - `shard-N.tfrecord`
+    :return: str - `shard-N.index`
+    '''
+    return str(pathlib.Path(shard_path).with_suffix(".index"))
+
+
+def _write_tfrecord_index(shard_path: str
+                        , record_offsets):
+    '''Writes the offset index of a TFRecord file as little endian int64 pairs (offset of the framed record, length of the data)
+    The offsets are only valid for uncompressed files, the count of the pairs is the record count in any case
+
+    :param shard_path: str
+    :param record_offsets: list(tuple(int, int))
+    '''
+    np.asarray(record_offsets, dtype=_TFRECORD_INDEX_DTYPE).reshape(-1, 2).tofile(_tfrecord_index_path(shard_path))
+
+
+def _write_tfrecord_manifest(shard_directory: str
+                           , compression_type: str):
+    '''Writes the manifest of all TFRecord shards in the directory from their offset indices
+    :param shard_directory: str
+    :param compression_type: str
+    '''
+    index_paths = sorted(pathlib.Path(shard_directory).glob("shard-*.index"), key=lambda path: int(path.stem.split("-")[1]))
+    shards = [{"file": index_path.with_suffix(".tfrecord").name
+             , "index": index_path.name
+             , "record_count": index_path.stat().st_size // _TFRECORD_INDEX_ENTRY_B} for index_path in index_paths]
+    manifest = {
+        "compression_type": compression_type,
+        "record_count": sum(shard["record_count"] for shard in shards),
+        "shards": shards
+    }
+    with open(pathlib.Path(shard_directory) / TFRECORD_MANIFEST, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def _write_fixed_length_shard(record_queue
+                            , shard_path: str):
+    '''Writes the records of the queue back to back into one file until the None sentinel arrives
+    :param record_queue: queue.Queue
+    :param shard_path: str
+    :return: tuple(Optional[int], int, float) - record size in bytes, record count and seconds spent writing
+    '''
+    record_bytes = None
+    record_count = 0
+    write_s = 0
+    with open(shard_path, "wb") as shard_file:
+        record = record_queue.get()
+        while record is not None:
+            if record_bytes is None:
+                record_bytes = len(record)
+            elif len(record) != record_bytes:
+                raise Exception("Fixed-length shards need records of the same size, got {} and {} bytes".format(record_bytes, len(record)))
+            start = time.time()
+            shard_file.write(record)
+            write_s += time.time() - start
+            record_count += 1
+            record = record_queue.get()
+    return record_bytes, record_count, write_s
+
+
+def _write_fixed_length_index(shard_directory: str
+                            , shard_infos):
+    '''Writes the sidecar index of fixed-length shards
+    :param shard_directory: str
+    :param shard_infos: list(tuple) - per shard the record size, record count and write time
+    '''
+    record_sizes = set(record_bytes for record_bytes, record_count, _ in shard_infos if record_count > 0)
+    if len(record_sizes) > 1:
+        raise Exception("Fixed-length shards need records of the same size, got {} bytes".format(sorted(record_sizes)))
+    index = {
+        "record_bytes": record_sizes.pop() if record_sizes else 0,
+        "shards": [{"file": f"shard-{shard_number}.bin", "record_count": record_count}
+                   for shard_number, (_, record_count, _) in enumerate(shard_infos)]
+    }
+    with open(pathlib.Path(shard_directory) / FIXED_LENGTH_INDEX, "w") as index_file:
+        json.dump(index, index_file)
+
+
+def sealed_shards_dataset(shard_directory: str
+                        , shard_count: int
+                        , compression_type: str
+                        , writing_done
+                        , num_parallel_reads: int = 1
+                        , poll_interval_s: float = 0.01):
+    '''Reads the TFRecord shards of `save_ds_parallel(..., records_per_shard=n)` while they are written
+    Every shard is opened as soon as it is sealed, i.e. renamed from its `.partial` file. The shards are sealed in order,
+    the reads are not deterministic so that the records of sealed shards are returned while the next shards are awaited
+
+    :param shard_directory: str
+    :param shard_count: int, how many shards are expected
+    :param compression_type: str
+    :param writing_done: threading.Event - set when the writers are finished, shards that are still missing afterwards are an error
+    :param num_parallel_reads: int (default = 1), sealed shards that are read in parallel
+    :param poll_interval_s: float (default = 0.01), how often the directory is checked for sealed shards
+    :return: tf.data.Dataset of records
+    '''
+    def sealed_shard_paths():
+        for shard_number in range(shard_count):
+            shard_path = pathlib.Path(shard_directory) / f"shard-{shard_number}.tfrecord"
+            while not shard_path.exists():
+                # the event can be set between the two checks
+                if writing_done.is_set() and not shard_path.exists():
+                    raise Exception(f"Writing the shards is finished, but {shard_path} was never sealed")
+                time.sleep(poll_interval_s)
+            yield str(shard_path)
+
+    return tf.data.Dataset.from_generator(sealed_shard_paths, output_signature=tf.TensorSpec([], tf.string)).interleave(
+        lambda shard_path: tf.data.TFRecordDataset(shard_path, compression_type=compression_type)
+      , cycle_length=num_parallel_reads
+      , num_parallel_calls=num_parallel_reads
+      , deterministic=False)
+
+
+def load_fixed_length_index(shard_directory: str):
+    '''Loads the sidecar index of fixed-length shards
+    :param shard_directory: str
+    :return: dict - "record_bytes" and the "file" and "record_count" of all "shards"
+    '''
+    with open(pathlib.Path(shard_directory) / FIXED_LENGTH_INDEX) as index_file:
+        return json.load(index_file)
+
+
+def fixed_length_shards_dataset(shard_directory: str
+                              , num_parallel_reads=None):
+    '''Reads fixed-length shards with `tf.data.FixedLengthRecordDataset`, every element is one record without any framing or checksum
+    :param shard_directory: str
+    :param num_parallel_reads: Optional[int], shards that are read in parallel
+    :return: tf.data.Dataset of tf.string
+    '''
+    index = load_fixed_length_index(shard_directory)
+    filepaths = [str(pathlib.Path(shard_directory) / shard["file"]) for shard in index["shards"] if shard["record_count"] > 0]
+    return tf.data.FixedLengthRecordDataset(filepaths
+                                          , record_bytes=max(index["record_bytes"], 1)
+                                          , num_parallel_reads=num_parallel_reads)
+
+
+def fixed_record_dtype(schema):
+    '''Returns the numpy dtype of one raw record of a fully static numeric schema
+    The fields are sorted by name like in `raw_serializer`, which has no header for such schemas.
+
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec)
+    :return: np.dtype
+    '''
+    def field_dtype(feature_name, feature_spec):
+        if feature_spec.dtype == tf.string or not feature_spec.shape.is_fully_defined():
+            raise Exception("Fixed-length records need a static numeric schema, got {} for '{}'".format(feature_spec, feature_name))
+        return np.dtype(feature_spec.dtype.as_numpy_dtype).newbyteorder("<")
+
+    if not isinstance(schema, dict):
+        return np.dtype((field_dtype("sample", schema), tuple(schema.shape.as_list())))
+    return np.dtype([(feature_name, field_dtype(feature_name, schema[feature_name]), tuple(schema[feature_name].shape.as_list()))
+                     for feature_name in sorted(schema.keys())])
+
+
+def memmap_shards(shard_directory: str
+                , schema):
+    '''Maps the fixed-length shards into memory, indexing the arrays returns views into the page cache without copying or parsing
+    :param shard_directory: str
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec) - fully static schema of the records
+    :return: list(np.memmap) - one array per non-empty shard, a structured array for dict schemas
+    '''
+    index = load_fixed_length_index(shard_directory)
+    record_dtype = fixed_record_dtype(schema)
+    if index["record_bytes"] not in [0, record_dtype.itemsize]:
+        raise Exception("The shards have {} bytes per record, but the schema {} needs {}".format(index["record_bytes"], schema, record_dtype.itemsize))
+
+    return [np.memmap(pathlib.Path(shard_directory) / shard["file"], dtype=record_dtype, mode="r", shape=(shard["record_count"],))
+            for shard in index["shards"] if shard["record_count"] > 0]
+
+
+def memmap_shards_dataset(shard_directory: str
+                        , schema
+                        , num_parallel_reads=None):
+    '''Reads fixed-length shards via `memmap_shards`, the elements are already decoded samples of the schema
+    Every shard is handed over in slices of `_MEMMAP_SLICE_RECORDS` records that are unbatched inside of tf.data,
+    so python only runs once per slice and not per sample
+
+    :param shard_directory: str
+    :param schema: tf.TensorSpec or dict(tf.TensorSpec) - fully static schema of the records
+    :param num_parallel_reads: Optional[int], shards that are read in parallel
+    :return: tf.data.Dataset
+    '''
+    shard_count = len(load_fixed_length_index(shard_directory)["shards"])
+
+    def read_shard(shard_number):
+        # the shards are mapped when they are read, so that rewritten shards are picked up
+        shards = memmap_shards(shard_directory, schema)
+        if shard_number >= len(shards):
+            return
+        shard = shards[shard_number]
+        for start in range(0, len(shard), _MEMMAP_SLICE_RECORDS):
+            records = shard[start:start + _MEMMAP_SLICE_RECORDS]
+            if isinstance(schema, dict):
+                yield {feature_name: records[feature_name] for feature_name in schema.keys()}
+            else:
+                yield records
+
+    return tf.data.Dataset.range(shard_count).interleave(
+        lambda shard_number: tf.data.Dataset.from_generator(read_shard, args=(shard_number,), output_signature=_batched_schema(schema)).unbatch()
+      , cycle_length=max(shard_count, 1)
+      , num_parallel_calls=num_parallel_reads)
+
+
+def load_tfrecord_manifest(shard_directory: str):
+    '''Loads the manifest of the TFRecord shards in the directory
+    :param shard_directory: str
+    :return: dict - "compression_type", "record_count" and the "file", "index" and "record_count" of all "shards"
+    '''
+    with open(pathlib.Path(shard_directory) / TFRECORD_MANIFEST) as manifest_file:
+        return json.load(manifest_file)
+
+
+class _IndexPermutation:
+    '''Pseudo random permutation of [0, n) without a table: a keyed Feistel network on the next even power of two,
+    indices outside of [0, n) are encrypted again until they are inside (cycle walking)
+    '''
+    _ROUNDS = 4
+
+    def __init__(self
+               , n: int
+               , seed):
+        '''
+        :param n: int
+        :param seed: int or list(int), e.g. the shuffle seed and the epoch
+        '''
+        self._n = n
+        bits = max(int(np.ceil(np.log2(max(n, 2)))), 2)
+        self._half_bits = (bits + 1) // 2
+        self._mask = (1 << self._half_bits) - 1
+        self._keys = [int(key) for key in np.random.default_rng(seed).integers(0, 2**32, size=self._ROUNDS)]
+
+    def _encrypt(self, x: int):
+        left, right = x >> self._half_bits, x & self._mask
+        for key in self._keys:
+            mixed = ((right ^ key) * 0x9E3779B1) & 0xFFFFFFFF
+            left, right = right, left ^ ((mixed ^ (mixed >> 15)) & self._mask)
+        return (left << self._half_bits) | right
+
+    def __call__(self, i: int):
+        x = self._encrypt(i)
+        while x >= self._n:
+            x = self._encrypt(x)
+        return x
+
+
+def indexed_shards_dataset(shard_directories
+                         , shuffle_seed: int = None
+                         , worker_count: int = 1
+                         , worker_index: int = 0
+                         , num_parallel_reads=None):
+    '''Reads single records of uncompressed TFRecord shards via their offset index, see `load_tfrecord_manifest`
+    The records of all shards are numbered globally. With a seed, the numbers are permuted without a shuffle buffer or
+    table, which is a global shuffle in O(1) memory. Every iteration of the dataset is a new epoch, its permutation is
+    keyed by the seed and the epoch number. Every worker reads its own contiguous range of the (permuted) numbers of
+    the same epoch, and the dataset knows its exact cardinality.
+
+    :param shard_directories: list(str) - directories with a manifest, e.g. the memory tier and its spill directory
+    :param shuffle_seed: int (default = None), read the records in a pseudo random global order instead of shard by shard
+    :param worker_count: int (default = 1), parallel readers that split the records
+    :param worker_index: int (default = 0), range of the records this dataset reads
+    :param num_parallel_reads: Optional[int], records that are read in parallel, the order is kept
+    :return: tf.data.Dataset of records
+    '''
+    shard_paths = []
+    record_counts = []
+    for shard_directory in shard_directories:
+        manifest = load_tfrecord_manifest(shard_directory)
+        if manifest["compression_type"] != "":
+            raise Exception("Records can only be read by offset from uncompressed shards, {} uses {}".format(shard_directory, manifest["compression_type"]))
+        for shard in manifest["shards"]:
+            shard_paths.append((str(pathlib.Path(shard_directory) / shard["file"]), str(pathlib.Path(shard_directory) / shard["index"])))
+            record_counts.append(shard["record_count"])
+
+    record_count = sum(record_counts)
+    first_records = np.cumsum([0] + record_counts)
+    begin, end = record_count * worker_index // worker_count, record_count * (worker_index + 1) // worker_count
+    # per epoch, only the current and the next one are kept
+    permutations = {}
+    epochs_started = [0]
+    # mapped on first use, the indices and shards stay on disk
+    mapped_shards = {}
+
+    def start_epoch():
+        epoch = epochs_started[0]
+        epochs_started[0] += 1
+        if shuffle_seed != None:
+            permutations[epoch] = _IndexPermutation(record_count, [shuffle_seed, epoch])
+            permutations.pop(epoch - 2, None)
+        return epoch
+
+    def read_record(epoch, position):
+        record_number = int(position) if shuffle_seed == None else permutations[int(epoch)](int(position))
+        shard_number = int(np.searchsorted(first_records, record_number, side="right")) - 1
+        if shard_number not in mapped_shards:
+            shard_path, index_path = shard_paths[shard_number]
+            mapped_shards[shard_number] = (np.memmap(index_path, dtype=_TFRECORD_INDEX_DTYPE, mode="r").reshape(-1, 2)
+                                         , np.memmap(shard_path, dtype=np.uint8, mode="r"))
+        index, shard = mapped_shards[shard_number]
+        offset, length = index[record_number - first_records[shard_number]]
+        return shard[offset + _TFRECORD_HEADER_B:offset + _TFRECORD_HEADER_B + length].tobytes()
+
+    def read(epoch, position):
+        record = tf.py_function(read_record, [epoch, position], tf.string)
+        record.set_shape([])
+        return record
+
+    # the single element is computed again by every iteration
+    epochs = tf.data.Dataset.range(1).map(lambda _: tf.py_function(start_epoch, [], tf.int64))
+    return epochs.flat_map(lambda epoch: tf.data.Dataset.range(begin, end).map(lambda position: (epoch, position))) \
+                 .map(read, num_parallel_calls=num_parallel_reads, deterministic=None if num_parallel_reads == None else True) \
+                 .apply(tf.data.experimental.assert_cardinality(end - begin))
+
+
+_SINKS = ["python", "graph"]
+
+def sinks():
+    '''Names of the sinks that consume the online pipeline in `Strategy.execute_full_pipeline`
+    * python - Python for loop that reads the shape of every sample, includes the per-element overhead of the loop
+    * graph  - `graph_sink`, consumes the dataset inside the TF runtime and only counts the samples
+
+    :return: list(str)
+    '''
+    return list(_SINKS)
+
+
+def graph_sink(dataset
+             , batched: bool = False):
+    '''Consumes the dataset with `tf.data.Dataset.reduce`, so no element is handed over to Python
+    :param dataset: tf.data.Dataset
+    :param batched: bool (default = False), count the leading dimension of every element instead of the elements
+    :return: int - consumed samples
+    '''
+    def count(sample_count, *element):
+        if not batched:
+            return sample_count + 1
+        return sample_count + tf.shape(tf.nest.flatten(element)[0], out_type=tf.int64)[0]
+
+    return int(dataset.reduce(tf.constant(0, tf.int64), count))
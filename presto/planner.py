@@ -0,0 +1,277 @@
+import math
+import time
+import numpy as np
+import tensorflow as tf
+from typing import Optional
+
+from presto import pipeline as pipeline_helper
+
+# op types that call back into the python interpreter and hold the GIL
+_PY_FUNCTION_OP_TYPES = ["EagerPyFunc", "PyFunc", "PyFuncStateless"]
+
+def _relaxed_spec(value):
+    '''Returns a spec of the value where every dimension is unknown, so that a traced function does not retrace on new shapes
+    :param value: tf.Tensor or nested structure of tf.Tensor
+    :return: tf.TensorSpec or nested structure of tf.TensorSpec
+    '''
+    return tf.nest.map_structure(lambda t: tf.TensorSpec([None] * t.shape.rank, t.dtype), value)
+
+
+def _as_args(sample):
+    '''tf.data unpacks tuple elements into positional arguments of the mapped function
+    :param sample: dataset element
+    :return: tuple
+    '''
+    return sample if isinstance(sample, tuple) else (sample,)
+
+
+def _uses_py_function(concrete_function):
+    '''Checks the graph and all its library functions (e.g. bodies of tf.map_fn) for calls into python
+    :param concrete_function: tf.types.experimental.ConcreteFunction
+    :return: bool
+    '''
+    graph_def = concrete_function.graph.as_graph_def()
+    op_types = [node.op for node in graph_def.node]
+    for function in graph_def.library.function:
+        op_types += [node.op for node in function.node_def]
+    return any(op_type in _PY_FUNCTION_OP_TYPES for op_type in op_types)
+
+
+def profile_step_costs(pipeline_spec
+                     , sample_count: int = 32):
+    '''Profiles every "op" step of the pipeline on the first `sample_count` samples
+    Each op is traced once on the shapes it actually receives and then called once per sample.
+    Other step types are only applied to forward the samples to the next step.
+
+    :param pipeline_spec: list(dict)
+    :param sample_count: int (default = 32), how many samples are used for profiling
+    :return: list(Optional[dict]) - for every step either None (not an "op") or a dict with
+        * "cost_s": float - mean time per sample in seconds
+        * "py_function": bool - if the op calls into python via tf.py_function
+    '''
+    src, *rest = pipeline_spec
+    samples = list(src["op"].take(sample_count))
+
+    costs = [None]
+    for seg in rest:
+        if seg["type"] == "op" and len(samples) > 0:
+            args_spec = _relaxed_spec(_as_args(samples[0]))
+            traced_op = tf.function(lambda *args: seg["op"](*args), input_signature=args_spec)
+            concrete_op = traced_op.get_concrete_function()
+
+            # warm up, e.g. lazy initialization inside the op
+            outputs = [traced_op(*_as_args(samples[0]))]
+            start = time.time()
+            outputs = [traced_op(*_as_args(sample)) for sample in samples]
+            end = time.time()
+
+            costs.append({
+                "cost_s": (end - start) / len(samples),
+                "py_function": _uses_py_function(concrete_op)
+            })
+            # tf.data converts lists to tuples
+            samples = [tuple(output) if isinstance(output, list) else output for output in outputs]
+        else:
+            costs.append(None)
+            if len(samples) > 0:
+                samples_ds = tf.data.Dataset.from_generator(lambda: iter(samples)
+                                                          , output_signature=_relaxed_spec(samples[0]))
+                samples_ds = pipeline_helper.build_pipeline([{"name": "samples", "type": "source", "op": samples_ds}, seg]
+                                                          , compress_map=False)
+                samples = list(samples_ds.take(sample_count))
+
+    return costs
+
+
+def plan_fusion(pipeline_spec
+              , thread_count: int
+              , sample_count: int = 32
+              , cost_ratio: float = 4.0):
+    '''Plans which consecutive "op" steps are fused into one map stage and with how much parallelism each stage runs
+    Steps are not fused if
+    * one of them calls into python (tf.py_function) and the other does not, so graph ops do not wait on the GIL
+    * their profiled costs differ by more than `cost_ratio`, so cheap and expensive steps can get different parallelism
+    * they set different "parallelism" or "deterministic" keys, or the first one sets "prefetch"
+    The most expensive stage runs with `thread_count` parallel calls, all other stages get a share proportional to their cost.
+    A "parallelism" set in the steps has priority over the planned one
+
+    :param pipeline_spec: list(dict)
+    :param thread_count: int, parallelism of the most expensive stage
+    :param sample_count: int (default = 32), how many samples are used for profiling
+    :param cost_ratio: float (default = 4.0), maximum cost ratio between steps within one stage
+    :return: list(dict) - fusion plan for `build_pipeline(..., fusion_plan=plan)`, one dict per stage with
+        * "steps": list(int) - indices of the fused steps in `pipeline_spec`
+        * "name": str
+        * "cost_ms": float - profiled cost per sample of the stage
+        * "py_function": bool
+        * "parallelism": int
+    '''
+    costs = profile_step_costs(pipeline_spec, sample_count=sample_count)
+
+    groups = []
+    group = None
+    for i, cost in enumerate(costs):
+        if cost is None:
+            group = None
+            continue
+
+        if group is not None:
+            group_cost = np.mean([costs[j]["cost_s"] for j in group["steps"]])
+            step_ratio = max(cost["cost_s"], 1e-9) / max(group_cost, 1e-9)
+            last_step = pipeline_spec[group["steps"][-1]]
+            if group["py_function"] != cost["py_function"] or step_ratio > cost_ratio or step_ratio < 1 / cost_ratio \
+                or pipeline_helper.stage_settings(last_step) != pipeline_helper.stage_settings(pipeline_spec[i]) \
+                or "prefetch" in last_step:
+                group = None
+
+        if group is None:
+            group = {"steps": [], "py_function": cost["py_function"]}
+            groups.append(group)
+        group["steps"].append(i)
+
+    max_cost_s = max([sum(costs[j]["cost_s"] for j in group["steps"]) for group in groups], default=0)
+
+    plan = []
+    for group in groups:
+        cost_s = sum(costs[j]["cost_s"] for j in group["steps"])
+        parallelism = thread_count if max_cost_s == 0 else math.ceil(thread_count * cost_s / max_cost_s)
+        plan.append({
+            "steps": group["steps"],
+            "name": " > ".join([pipeline_spec[j]["name"] for j in group["steps"]]),
+            "cost_ms": cost_s * 1000,
+            "py_function": group["py_function"],
+            "parallelism": pipeline_spec[group["steps"][0]].get("parallelism", max(1, parallelism))
+        })
+
+    return plan
+
+
+def format_fusion_plan(plan):
+    '''Formats the fusion plan as single string for logging, e.g. next to the `Strategy.meta_info`
+    :param plan: list(dict) - see `plan_fusion`
+    :return: str
+    '''
+    if plan is None:
+        return None
+    return " | ".join([f"{group['name']} [parallelism={group['parallelism']}, {round(group['cost_ms'], 3)}ms{', py_function' if group['py_function'] else ''}]"
+                       for group in plan])
+
+
+def _sample_size_b(sample):
+    '''Returns the bytes of all tensors of a sample as computed, strings count with their length
+    :param sample: tf.Tensor or nested structure of tf.Tensor
+    :return: int
+    '''
+    size_b = 0
+    for tensor in tf.nest.flatten(sample):
+        if tensor.dtype == tf.string:
+            size_b += sum(len(value) for value in np.ravel(tensor.numpy()))
+        else:
+            size_b += tensor.numpy().nbytes
+    return size_b
+
+
+def profile_step_sizes(pipeline_spec
+                     , sample_count: int = 32):
+    '''Measures the mean size of a sample after every step of the pipeline on the first `sample_count` samples
+    :param pipeline_spec: list(dict)
+    :param sample_count: int (default = 32), how many samples are used for profiling
+    :return: list(float) - mean bytes per sample after every step, 0 for an empty dataset
+    '''
+    sizes_b = []
+    for i in range(len(pipeline_spec)):
+        samples = pipeline_helper.build_pipeline(pipeline_spec[:i + 1], compress_map=False).take(sample_count)
+        step_sizes_b = [_sample_size_b(sample) for sample in samples]
+        sizes_b.append(float(np.mean(step_sizes_b)) if step_sizes_b != [] else 0.0)
+    return sizes_b
+
+
+def _commutable_run(pipeline_spec
+                  , split_position: int):
+    '''Returns the bounds of the consecutive "commutable" ops next to the split position, "random" ops end the run
+    :param pipeline_spec: list(dict)
+    :param split_position: int
+    :return: tuple(int, int) - first and behind the last step of the run, empty if no run touches the split
+    '''
+    def commutable(i):
+        return 0 < i < len(pipeline_spec) \
+               and pipeline_spec[i]["type"] == "op" \
+               and pipeline_spec[i].get("commutable", False) \
+               and not pipeline_spec[i].get("random", False)
+
+    start, end = split_position, split_position
+    while commutable(start - 1):
+        start -= 1
+    while commutable(end):
+        end += 1
+    return start, end
+
+
+def reorder_for_split(pipeline_spec
+                    , split_position: int
+                    , sample_count: int = 32):
+    '''Reorders the steps marked as "commutable" around the split position, so that less data is stored at the split
+    Only the run of consecutive "commutable" ops that touches the split position is reordered. Its size-reducing ops are moved
+    before the split, its size-inflating ops behind it, e.g. a cast from uint8 to float32. Ops that keep the size stay on
+    their side of the split, the order within every group is kept. The schemas of the moved steps are traced again.
+    The sizes are profiled in the original order, the prediction assumes that every op scales the size by the same factor in any order
+
+    :param pipeline_spec: list(dict)
+    :param split_position: int, index of the step before which the split is inserted
+    :param sample_count: int (default = 32), how many samples are used for profiling
+    :return: dict with
+        * "pipeline": list(dict) - reordered copy of the specification
+        * "split_position": int - split position in the reordered pipeline
+        * "moved": list(str) - names of the steps that changed the side of the split
+        * "sample_size_b": float - profiled bytes per sample at the original split
+        * "predicted_sample_size_b": float - predicted bytes per sample at the new split
+    '''
+    start, end = _commutable_run(pipeline_spec, split_position)
+    sizes_b = profile_step_sizes(pipeline_spec[:end], sample_count=sample_count)
+
+    def ratio(i):
+        return sizes_b[i] / sizes_b[i - 1] if sizes_b[i - 1] > 0 else 1.0
+
+    run = range(start, end)
+    reducing = [i for i in run if ratio(i) < 1]
+    inflating = [i for i in run if ratio(i) > 1]
+    keeping = [i for i in run if ratio(i) == 1]
+    offline = reducing + [i for i in keeping if i < split_position]
+    order = offline + [i for i in keeping if i >= split_position] + inflating
+
+    reordered = list(pipeline_spec[:start])
+    for i in order:
+        step = dict(pipeline_spec[i])
+        step["input_schema"] = reordered[-1]["output_schema"]
+        step["output_schema"] = pipeline_helper.infer_output_schema(step, step["input_schema"])
+        reordered.append(step)
+    reordered += pipeline_spec[end:]
+
+    predicted_sample_size_b = sizes_b[start - 1] * np.prod([ratio(i) for i in offline])
+    return {
+        "pipeline": reordered,
+        "split_position": start + len(offline),
+        "moved": [pipeline_spec[i]["name"] for i in run if (i < split_position) != (i in offline)],
+        "sample_size_b": sizes_b[split_position - 1],
+        "predicted_sample_size_b": float(predicted_sample_size_b)
+    }
+
+
+def format_reordering(reordering
+                    , sample_count: Optional[int] = None):
+    '''Formats the reordered pipeline as single string for logging, "||" marks the split
+    :param reordering: dict - see `reorder_for_split`
+    :param sample_count: Optional[int] (default = None), also shows the predicted storage of this many samples at the split
+    :return: str
+    '''
+    if reordering is None:
+        return None
+    names = [step["name"] for step in reordering["pipeline"]]
+    split_position = reordering["split_position"]
+    description = " > ".join(names[:split_position]) + " || " + " > ".join(names[split_position:])
+    description += f" [{round(reordering['predicted_sample_size_b'], 1)}B/sample, was {round(reordering['sample_size_b'], 1)}B/sample"
+    if sample_count is not None:
+        description += f", {round(reordering['predicted_sample_size_b'] * sample_count / 1000**2, 3)}MB for {sample_count} samples"
+    if reordering["moved"] != []:
+        description += ", moved: " + ", ".join(reordering["moved"])
+    return description + "]"
@@ -0,0 +1,144 @@
+import pathlib
+import numpy as np
+from scipy import stats
+
+def geometric_sample_counts(min_sample_count: int
+                          , max_sample_count: int
+                          , count: int):
+    '''Returns `count` sample counts from `min_sample_count` to `max_sample_count` with a constant ratio, duplicates after rounding are dropped
+    :param min_sample_count: int
+    :param max_sample_count: int
+    :param count: int
+    :return: list(int)
+    '''
+    return sorted(set(int(round(sample_count)) for sample_count in np.geomspace(min_sample_count, max_sample_count, num=count)))
+
+
+def stratified_file_order(filepaths
+                        , strata_count: int = 10
+                        , seed: int = 42):
+    '''Orders the files so that every prefix is a stratified sample over the file sizes
+    The files are split into `strata_count` strata of equal count by size and shuffled within each stratum. The order takes
+    one file of every stratum per round (in random stratum order), so `.take(n)` of a source built from it has the size
+    distribution of the whole dataset for every sample count.
+
+    :param filepaths: list(str)
+    :param strata_count: int (default = 10)
+    :param seed: int (default = 42)
+    :return: list(str) - e.g. for `tf.data.Dataset.from_tensor_slices` as "source" op
+    '''
+    rng = np.random.default_rng(seed)
+    sizes_b = [pathlib.Path(filepath).stat().st_size for filepath in filepaths]
+    by_size = [filepaths[i] for i in np.argsort(sizes_b, kind="stable")]
+    strata = [list(stratum) for stratum in np.array_split(np.array(by_size, dtype=object), min(strata_count, max(len(by_size), 1)))]
+    for stratum in strata:
+        rng.shuffle(stratum)
+
+    ordered_filepaths = []
+    for i in range(max([len(stratum) for stratum in strata], default=0)):
+        for stratum_index in rng.permutation(len(strata)):
+            if i < len(strata[stratum_index]):
+                ordered_filepaths.append(strata[stratum_index][i])
+    return ordered_filepaths
+
+
+def profile_scaling(strategies
+                  , sample_counts
+                  , runs_total: int = 2
+                  , **profile_kwargs):
+    '''Profiles every strategy at every sample count, the logs are the input of `StrategyAnalysis.extrapolate_by_fit`
+    System caching is tested by default, so that the first run of every sample count reads cold shards and the following
+    runs read them from the page cache. Both are needed to fit the page cache term of `ScalingModel`.
+
+    :param strategies: list(Strategy)
+    :param sample_counts: list(int) - e.g. from `geometric_sample_counts`
+    :param runs_total: int (default = 2), runs per strategy and sample count
+    :param profile_kwargs: passed to `Strategy.profile_strategy`
+    '''
+    profile_kwargs = {"system_cache_enabled": True, **profile_kwargs}
+    for sample_count in sample_counts:
+        for strategy in strategies:
+            strategy.profile_strategy(sample_count = sample_count
+                                    , runs_total = runs_total
+                                    , **profile_kwargs)
+
+
+def throughput_prediction(sample_count: float
+                        , time_prediction):
+    '''Converts a predicted time with its interval into a throughput, a longer time is a lower throughput
+    The interval of the time is not bounded by 0, a bound at or below 0 s has no throughput and is NaN
+    :param sample_count: float
+    :param time_prediction: tuple(float, float, float) - prediction, lower and upper bound in seconds, see `ScalingModel.predict`
+    :return: tuple(float, float, float) - prediction, lower and upper bound in samples per second
+    '''
+    prediction, time_low, time_high = time_prediction
+    return tuple(sample_count / time_s if time_s > 0 else np.nan for time_s in [prediction, time_high, time_low])
+
+
+class ScalingModel:
+    '''Least squares fit of a metric over the sample count n with a page cache term
+        value = intercept + cold_slope * n * (1 - h) + cached_slope * n * h
+    where h is the fraction of the read data that was in the page cache. Without cached (or cold) observations the
+    respective slope is not fitted and the other one is used instead.
+    '''
+    def __init__(self
+               , sample_counts
+               , values
+               , cached_fractions = None):
+        '''
+        :param sample_counts: list(int)
+        :param values: list(float) - one observation per sample count
+        :param cached_fractions: Optional list(float) (default = None), h per observation, all cold if None
+        '''
+        sample_counts = np.asarray(sample_counts, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        cached_fractions = np.zeros_like(sample_counts) if cached_fractions is None else np.asarray(cached_fractions, dtype=np.float64)
+        if len(np.unique(sample_counts)) < 2:
+            raise Exception("Fitting the scaling needs at least two different sample counts, got {}".format(np.unique(sample_counts).tolist()))
+
+        design = self._design(sample_counts, cached_fractions)
+        # a slope without observations can not be fitted
+        self._fitted_columns = [column for column in range(design.shape[1]) if column == 0 or np.any(design[:, column] != 0)]
+        design = design[:, self._fitted_columns]
+
+        self._coefficients, _, _, _ = np.linalg.lstsq(design, values, rcond=None)
+        self._residual_dof = len(values) - design.shape[1]
+        residuals = values - design @ self._coefficients
+        variance = np.sum(residuals**2) / self._residual_dof if self._residual_dof > 0 else np.nan
+        self._covariance = variance * np.linalg.pinv(design.T @ design)
+
+    def _design(self
+              , sample_counts
+              , cached_fractions):
+        '''
+        :param sample_counts: np.ndarray
+        :param cached_fractions: np.ndarray
+        :return: np.ndarray - columns intercept, cold and cached sample counts
+        '''
+        return np.stack([np.ones_like(sample_counts)
+                       , sample_counts * (1 - cached_fractions)
+                       , sample_counts * cached_fractions], axis=1)
+
+    def predict(self
+              , sample_count: float
+              , cached_fraction: float = 0
+              , confidence: float = 0.95):
+        '''Predicts the metric with a confidence interval of the fitted mean
+        :param sample_count: float
+        :param cached_fraction: float (default = 0), h at the predicted sample count
+        :param confidence: float (default = 0.95)
+        :return: tuple(float, float, float) - prediction, lower and upper bound (NaN without residual degrees of freedom)
+        '''
+        row = self._design(np.array([float(sample_count)]), np.array([float(cached_fraction)]))[0]
+        # the missing slope is replaced by the fitted one
+        if 1 not in self._fitted_columns:
+            row[2] += row[1]
+        if 2 not in self._fitted_columns:
+            row[1] += row[2]
+        row = row[self._fitted_columns]
+
+        prediction = float(row @ self._coefficients)
+        if self._residual_dof <= 0:
+            return prediction, np.nan, np.nan
+        half_width = stats.t.ppf((1 + confidence) / 2, self._residual_dof) * np.sqrt(row @ self._covariance @ row)
+        return prediction, prediction - half_width, prediction + half_width
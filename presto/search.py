@@ -0,0 +1,155 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+from presto.strategy import Strategy
+
+def _profile_candidate(strategy: Strategy
+                     , sample_count: int
+                     , runs_total: int
+                     , system_cache_enabled: bool = False):
+    '''Runs the strategy `runs_total` times and returns the mean metrics of these runs
+    With system caching, only the first run processes the offline part and the others log 0s and 0MB, so the offline
+    time and storage are taken from the first run
+    :param strategy: Strategy
+    :param sample_count: int
+    :param runs_total: int
+    :param system_cache_enabled: bool (default = False), see `Strategy.execute_full_pipeline`
+    :return: dict - "preprocessing_time_s", "storage_consumption_mb" and "throughput_sps"
+    '''
+    for run_id in range(runs_total):
+        strategy.execute_full_pipeline(run_id, sample_count, runs_total, system_cache_enabled=system_cache_enabled)
+
+    offline_runs = slice(-runs_total, -runs_total + 1 if system_cache_enabled and runs_total > 1 else None)
+    return {
+        "preprocessing_time_s": np.mean(strategy.meta_info["offline_processing_and_save_time_s"][offline_runs])
+      , "storage_consumption_mb": np.mean(strategy.meta_info["shard_cum_size_MB"][offline_runs])
+      , "throughput_sps": np.mean(strategy.meta_info["throughput_sps"][-runs_total:])
+    }
+
+
+def _scores(round_df: pd.DataFrame
+          , weights: dict):
+    '''Normalizes the metrics of one round like `StrategyAnalysis.normalized_summary` (higher is better) and weights them
+    :param round_df: pd.DataFrame - one row per candidate
+    :param weights: dict - metric -> weight
+    :return: pd.Series
+    '''
+    def normalize(column):
+        value_range = column.max() - column.min()
+        return column * 0 + 1 if value_range == 0 else (column - column.min()) / value_range
+
+    score = 0
+    for metric, weight in weights.items():
+        normalized = normalize(round_df[metric])
+        # less time and storage is better
+        if metric != "throughput_sps":
+            normalized = 1 - normalized
+        score = score + weight * normalized
+    return score
+
+
+def _dominated(round_df: pd.DataFrame
+             , weights: dict):
+    '''Marks candidates where another candidate is at least as good in every weighted metric and better in one
+    :param round_df: pd.DataFrame - one row per candidate
+    :param weights: dict - metric -> weight
+    :return: list(bool)
+    '''
+    # higher is better for all columns
+    metrics = [metric for metric, weight in weights.items() if weight != 0]
+    values = np.array([round_df[metric] if metric == "throughput_sps" else -round_df[metric] for metric in metrics]).T
+
+    return [any(np.all(other >= candidate) and np.any(other > candidate) for other in values)
+            for candidate in values]
+
+
+def search_split_position(pipeline
+                        , split_positions
+                        , preprocessing_time_weight: float
+                        , storage_consumption_weight: float
+                        , throughput_weight: float
+                        , initial_sample_count: int = 100
+                        , max_sample_count: int = 10000
+                        , growth_factor: int = 4
+                        , keep_fraction: float = 0.5
+                        , runs_total: int = 1
+                        , sample_budget: Optional[int] = None
+                        , system_cache_enabled: bool = False
+                        , **strategy_kwargs):
+    '''Searches the best split position with successive halving instead of profiling every position with the full sample count
+    Every round profiles the remaining candidates with the same sample count, drops the candidates that are dominated
+    in all weighted metrics and keeps the best `keep_fraction` by score. The next round multiplies the sample count
+    by `growth_factor`. The search stops with one candidate, at `max_sample_count` or if the next round would exceed the sample budget.
+    The score uses the same normalization as `StrategyAnalysis.weighted_summary`, higher is better.
+
+    :param pipeline: list(dict)
+    :param split_positions: list(Optional[int]) - candidates, None is fully online
+    :param preprocessing_time_weight: float
+    :param storage_consumption_weight: float
+    :param throughput_weight: float
+    :param initial_sample_count: int (default = 100), samples per candidate in the first round
+    :param max_sample_count: int (default = 10000), samples per candidate in the last round
+    :param growth_factor: int (default = 4)
+    :param keep_fraction: float (default = 0.5), share of the non-dominated candidates that advance to the next round
+    :param runs_total: int (default = 1), runs per candidate and round
+    :param sample_budget: Optional[int] (default = None), maximum samples processed over all rounds and candidates
+    :param system_cache_enabled: bool (default = False), passed to `Strategy.execute_full_pipeline`. If False, every run of every candidate and round
+        drops the page cache with `profile.drop_io_cache`, which needs root. If True, the cache is only dropped before the first run of a candidate in every round
+    :param strategy_kwargs: passed to every `Strategy`, e.g. thread_count, shard_count, shard_directory_prefix
+    :return: tuple(Strategy, pd.DataFrame) - best strategy (its `meta_info` holds all its rounds) and one row per round and candidate
+    '''
+    weights = {
+        "preprocessing_time_s": preprocessing_time_weight
+      , "storage_consumption_mb": storage_consumption_weight
+      , "throughput_sps": throughput_weight
+    }
+    candidates = {split_position: Strategy(pipeline = pipeline
+                                         , split_position = split_position
+                                         , **strategy_kwargs)
+                  for split_position in split_positions}
+
+    rounds = []
+    sample_count = min(initial_sample_count, max_sample_count)
+    samples_processed = 0
+    round_number = 0
+    while True:
+        round_positions = list(candidates.keys())
+        round_rows = []
+        for split_position, strategy in candidates.items():
+            metrics = _profile_candidate(strategy, sample_count, runs_total, system_cache_enabled)
+            round_rows.append({"round": round_number
+                             , "sample_count": sample_count
+                             , "split_position": split_position
+                             , "strategy": strategy.meta_info["split_name"]
+                             , **metrics})
+        samples_processed += sample_count * runs_total * len(candidates)
+
+        round_df = pd.DataFrame(round_rows)
+        # pandas would turn the fully online candidate (None) into NaN
+        round_df["split_position"] = pd.Series(round_positions, dtype=object)
+        round_df["score"] = _scores(round_df, weights)
+        round_df["dominated"] = _dominated(round_df, weights)
+
+        # dominated candidates are dropped, the best share of the others advances
+        remaining_df = round_df[~round_df["dominated"]].sort_values(by="score", ascending=False)
+        next_sample_count = min(sample_count * growth_factor, max_sample_count)
+        last_round = len(remaining_df) <= 1 \
+                     or sample_count >= max_sample_count \
+                     or (sample_budget != None and samples_processed + next_sample_count * runs_total * math.ceil(len(remaining_df) * keep_fraction) > sample_budget)
+        advancing_count = 1 if last_round else max(1, math.ceil(len(remaining_df) * keep_fraction))
+        advancing = [round_positions[i] for i in remaining_df.index[:advancing_count]]
+
+        round_df["advanced"] = [split_position in advancing and not last_round for split_position in round_positions]
+        rounds.append(round_df)
+
+        if last_round:
+            best_split_position = advancing[0]
+            break
+
+        candidates = {split_position: candidates[split_position] for split_position in advancing}
+        sample_count = next_sample_count
+        round_number += 1
+
+    return candidates[best_split_position], pd.concat(rounds, ignore_index=True)
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import atexit
+import hashlib
+import select
+import struct
+import time
+import pathlib
+import importlib
+import subprocess
+import tensorflow as tf
+
+from presto import pipeline as pipeline_helper
+
+# every message of a worker is a length (uint64, little endian) followed by the payload, an empty message
+# signals that the worker is ready after the start and that a job is finished afterwards
+_LENGTH_FORMAT = "<Q"
+_LENGTH_B = struct.calcsize(_LENGTH_FORMAT)
+# source elements that are compared between the workers before they split the source without a split position
+_SOURCE_CHECK_COUNT = 64
+
+
+def _encode_sample(sample):
+    '''Serializes all tensors of a sample into one string with graph ops
+    :param sample: tf.Tensor or nested structure of tf.Tensor
+    :return: tf.Tensor - scalar tf.string
+    '''
+    return tf.io.serialize_tensor(tf.stack([tf.io.serialize_tensor(component) for component in tf.nest.flatten(sample)]))
+
+
+def _sample_decoder(element_spec):
+    '''Prepares the inverse of `_encode_sample`
+    :param element_spec: tf.TensorSpec or nested structure of tf.TensorSpec
+    :return: function (str -> sample)
+    '''
+    specs = tf.nest.flatten(element_spec)
+
+    def decode(x):
+        parts = tf.io.parse_tensor(x, tf.string)
+        components = []
+        for i, spec in enumerate(specs):
+            component = tf.io.parse_tensor(parts[i], spec.dtype)
+            component.set_shape(spec.shape)
+            components.append(component)
+        return tf.nest.pack_sequence_as(element_spec, components)
+
+    return decode
+
+
+def _source_fingerprint(config: dict):
+    '''Hashes the first elements of the source, the workers can only split the source if they all see the same order
+    :param config: dict - see `LocalWorkerPool`
+    :return: bytes - hex digest
+    '''
+    module_name, function_name, kwargs = config["pipeline_factory"]
+    source = getattr(importlib.import_module(module_name), function_name)(**kwargs)[0]["op"]
+    hasher = hashlib.sha256()
+    for record in source.take(_SOURCE_CHECK_COUNT).map(_encode_sample).as_numpy_iterator():
+        hasher.update(record)
+    return hasher.hexdigest().encode()
+
+
+def _online_pipeline(config: dict
+                   , job: dict):
+    '''Recreates the pipeline from its factory and returns the online part for the share of this worker
+    :param config: dict - see `LocalWorkerPool`
+    :param job: dict - "shard_files" of this worker or None without split, "sample_count" of all workers or None
+    :return: list(dict)
+    '''
+    module_name, function_name, kwargs = config["pipeline_factory"]
+    # the factory is called for every job, like the strategy builds the source again for every run. The start of the
+    # pool checks that the workers see the source in the same order, otherwise the shards would overlap
+    pipeline = getattr(importlib.import_module(module_name), function_name)(**kwargs)
+    if config["schema_inference"]:
+        pipeline = pipeline_helper.refine_schemas(pipeline)
+
+    if config["split_position"] == None:
+        source = pipeline[0]["op"]
+        if job["sample_count"] != None:
+            source = source.take(job["sample_count"])
+        return [{**pipeline[0], "op": source.shard(config["worker_count"], config["worker_index"])}] + pipeline[1:]
+
+    split_options = dict(config["split_options"])
+    if split_options.get("storage_range") != None:
+        split_options["storage_range"] = tuple(split_options["storage_range"])
+    _, online_pipeline = pipeline_helper.serialized_split(pipeline, config["split_position"], **split_options)
+    online_pipeline.insert(0, {
+        "name": "load TFRecord shards",
+        "type": "op",
+        "op": tf.data.TFRecordDataset(job["shard_files"]
+                                    , num_parallel_reads=config["read_parallelism"]
+                                    , compression_type=config["compression_type"]),
+        "output_schema": online_pipeline[0]["input_schema"]
+    })
+    return online_pipeline
+
+
+def run_worker(config: dict):
+    '''Runs the jobs that arrive as JSON lines on stdin until stdin is closed, started via `python -m presto.service <config>`
+    Every job builds the online pipeline in this process, so py_function stages run under the GIL of the worker.
+    The samples are written to stdout, see `_encode_sample`
+
+    :param config: dict - see `LocalWorkerPool`
+    '''
+    output = sys.stdout.buffer
+    # nothing else may write into the sample stream
+    sys.stdout = sys.stderr
+
+    def write_message(payload: bytes):
+        output.write(struct.pack(_LENGTH_FORMAT, len(payload)))
+        output.write(payload)
+
+    # TF and the factory are imported before the worker is ready, without split the ready message is the source fingerprint
+    importlib.import_module(config["pipeline_factory"][0])
+    write_message(b"" if config["split_position"] != None else _source_fingerprint(config))
+    output.flush()
+    for line in sys.stdin:
+        job = json.loads(line)
+        dataset = pipeline_helper.build_pipeline(_online_pipeline(config, job)
+                                               , compressed_parallelism=config["thread_count"]
+                                               , vectorized_batch_size=config["vectorized_batch_size"])
+        for record in dataset.map(_encode_sample, num_parallel_calls=config["thread_count"]).as_numpy_iterator():
+            write_message(record)
+        write_message(b"")
+        output.flush()
+
+
+class LocalWorkerPool:
+    '''`worker_count` worker processes on the same machine that run the online part of a pipeline
+    The workers are separate Python processes, so the online pipeline, including its py_function stages, is not limited
+    by the GIL of the client. Every worker recreates the pipeline from its factory, splits it like the strategy and reads
+    its own share of the shards, or its own share of the source without split. The latter needs a source that returns
+    its elements in the same order in every process, i.e. without unseeded `list_files` or shuffles.
+    '''
+    def __init__(self
+               , worker_count: int
+               , config: dict
+               , startup_timeout_s: float = 120):
+        '''
+        :param worker_count: int, how many worker processes are started
+        :param config: dict - JSON serializable, with the keys
+            * "pipeline_factory": (module name, function name, kwargs) - returns the pipeline specification, the module has to be importable from the working directory
+            * "split_position": Optional[int]
+            * "split_options": dict - keyword arguments of `pipeline.serialized_split`
+            * "schema_inference": bool - refine the schemas before splitting
+            * "thread_count": int - parallelism of the map stages in every worker
+            * "read_parallelism": int - parallel reads of the shards in every worker
+            * "vectorized_batch_size": Optional[int]
+            * "compression_type": str - of the TFRecord files
+        :param startup_timeout_s: float (default = 120), how long to wait until all workers imported TF and the pipeline factory
+        :raise Exception: without split position, if the workers see the first elements of the source in different orders
+        '''
+        self._worker_count = worker_count
+        # forking a process with a running TF runtime is not safe and spawning with multiprocessing would
+        # import the main module again, so the workers are fresh interpreters that only import this module and the factory
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([str(pathlib.Path(__file__).resolve().parents[1]), os.getcwd()] + ([env["PYTHONPATH"]] if "PYTHONPATH" in env else []))
+        self._workers = [subprocess.Popen([sys.executable, "-m", "presto.service", json.dumps({**config, "worker_count": worker_count, "worker_index": i})]
+                                        , stdin=subprocess.PIPE
+                                        , stdout=subprocess.PIPE
+                                        , env=env)
+                         for i in range(worker_count)]
+        atexit.register(self.stop)
+
+        # the workers import TF first, this should not end up in the measured online time
+        deadline = time.time() + startup_timeout_s
+        source_fingerprints = set()
+        for i, worker in enumerate(self._workers):
+            ready, _, _ = select.select([worker.stdout], [], [], max(0, deadline - time.time()))
+            source_fingerprint = self._read_message(worker) if ready != [] else None
+            if source_fingerprint == None:
+                self.stop()
+                raise Exception(f"Only {i} of {worker_count} online workers started within {startup_timeout_s}s")
+            source_fingerprints.add(source_fingerprint)
+        if len(source_fingerprints) > 1:
+            self.stop()
+            raise Exception("The online workers see the source in different orders and can not split it, seed its list_files and shuffles")
+
+    def _read_message(self, worker):
+        '''
+        :param worker: subprocess.Popen
+        :return: bytes, None if the worker exited
+        '''
+        header = worker.stdout.read(_LENGTH_B)
+        if len(header) < _LENGTH_B:
+            return None
+        return worker.stdout.read(struct.unpack(_LENGTH_FORMAT, header)[0])
+
+    def dataset(self
+              , element_spec
+              , shard_files = None
+              , sample_count = None):
+        '''Returns the samples of all workers, in the order they deliver them. Every iteration starts a job in every worker
+        :param element_spec: tf.TensorSpec or nested structure of tf.TensorSpec - of the online pipeline, e.g. from a local build of it
+        :param shard_files: Optional[list(str)], the shards are handed round-robin to the workers. None without split
+        :param sample_count: Optional[int], without split the workers share the first `sample_count` samples of the source
+        :return: tf.data.Dataset
+        '''
+        def read_worker(worker_index):
+            worker_index = int(worker_index)
+            worker = self._workers[worker_index]
+            job = {"shard_files": None if shard_files == None else sorted(shard_files)[worker_index::self._worker_count]
+                 , "sample_count": sample_count}
+            worker.stdin.write((json.dumps(job) + "\n").encode())
+            worker.stdin.flush()
+            # a job is always read to its end, also if the consumer stops early, so that the next job starts clean
+            done = False
+            try:
+                while True:
+                    record = self._read_message(worker)
+                    if record == None:
+                        raise Exception(f"Online worker {worker_index} exited with {worker.wait()}")
+                    if record == b"":
+                        done = True
+                        return
+                    yield record
+            finally:
+                while not done:
+                    record = self._read_message(worker)
+                    done = record == None or record == b""
+
+        records = tf.data.Dataset.range(self._worker_count).interleave(
+            lambda worker_index: tf.data.Dataset.from_generator(read_worker, args=(worker_index,), output_signature=tf.TensorSpec([], tf.string))
+          , cycle_length=self._worker_count
+          , num_parallel_calls=self._worker_count
+          , deterministic=False)
+        return records.map(_sample_decoder(element_spec), num_parallel_calls=tf.data.AUTOTUNE)
+
+    def stop(self):
+        '''Stops the worker processes, can be called more than once
+        '''
+        for worker in self._workers:
+            worker.stdin.close()
+        for worker in self._workers:
+            try:
+                worker.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.terminate()
+                worker.wait()
+        self._workers = []
+
+
+if __name__ == "__main__":
+    run_worker(json.loads(sys.argv[1]))
@@ -6,6 +6,8 @@ import uuid
 import copy
 import glob
 import pathlib
+import threading
+import concurrent.futures
 import numpy as np
 import pandas as pd
 import tensorflow as tf
@@ -14,6 +16,10 @@ from typing import Optional
 from datetime import datetime
 
 from presto import pipeline as pipeline_helper
+from presto import planner
+from presto import codecs
+from presto.cache import MaterializationCache, pipeline_fingerprint
+from presto.service import LocalWorkerPool
 from presto.profile import run_profiled, drop_io_cache
  
 class Strategy:
@@ -34,22 +40,117 @@ class Strategy:
                , thread_count: int = 1
                , shard_directory_prefix: str = "./shards"
                , compression_type: str = "none"
-               , storage_type: str = "local-ssd"):
+               , storage_type: str = "local-ssd"
+               , serialization_format: str = "example"
+               , samples_per_record: int = 1
+               , fusion_planning: bool = False
+               , read_parallelism: Optional[int] = None
+               , vectorized_batch_size: Optional[int] = None
+               , pipeline_cache_enabled: bool = False
+               , schema_inference: bool = False
+               , storage_format: str = "tfrecord"
+               , materialization_cache: Optional[MaterializationCache] = None
+               , online_worker_count: Optional[int] = None
+               , pipeline_factory: Optional[tuple] = None
+               , streaming_materialization: bool = False
+               , materialization_ratio: float = 1.0
+               , memory_tier_directory: Optional[str] = None
+               , memory_budget_MB: Optional[float] = None
+               , compression_level: Optional[int] = None
+               , target_shard_size_MB: Optional[float] = None
+               , byte_balanced_shards: bool = False
+               , indexed_shards: bool = False
+               , global_shuffle_seed: Optional[int] = None
+               , storage_dtype: str = "none"
+               , storage_range: Optional[tuple] = None
+               , split_reordering: bool = False):
         '''
         :param pipeline: dict of a pipeline see imagenet_pipeline.py in the `/examples`
         :param split_position: Optional[int], index of position BEFORE the split will be inserted. If not provided, no split is made and it defaults to preprocess everything **online**
         :param shard_count: int, how many files does this **offline** parts has to be saved in 
         :param thread_count: int, how many threads operate on all the tf.Dataset ops
         :param shard_directory_prefix: str (default = "./shards"), directory where to save the temporary shards
-        :param compression_type: str (default = ""), compression type for the intermediate representations (offline only). Possible parameters: ZLIB, GZIP, or "" for no compression
+        :param compression_type: str (default = "none"), compression type for the intermediate representations (offline only). GZIP and ZLIB compress the TFRecord files, the codecs DEFLATE, LZ4, ZSTD and SNAPPY compress every record as part of the serialization (see `codecs.compression_types()`)
         :param storage_type: str (default = "local-ssd"), just using this parameter to add it to the dataframes for future parsing. Makes no difference in the execution
+        :param serialization_format: str (default = "example"), record format at the split position. Possible parameters: example, tensor (graph ops only, no tf.py_function), raw (header + raw tensor bytes, decoded with `tf.io.decode_raw`)
+        :param samples_per_record: int (default = 1), how many samples are packed into one record at the split position. Only works if all samples at the split have the same shape
+        :param fusion_planning: bool (default = False), profile the ops on a few samples and let `planner.plan_fusion` decide which ops are fused and how many threads each map stage gets, instead of fusing all ops into one stage with `thread_count` threads
+        :param read_parallelism: Optional[int] (default = None), parallel reads of the shards in the **online** part, can be tf.data.AUTOTUNE. Defaults to `thread_count`. The parallelism of single steps is set with the "parallelism" key in the pipeline
+        :param vectorized_batch_size: Optional[int] (default = None), if set, runs of steps marked as "vectorized" are executed on batches of this size (see `pipeline.vectorize_pipeline`)
+        :param pipeline_cache_enabled: bool (default = False), reuse built datasets and traced map stages across runs and strategies with the same steps (see `pipeline.build_pipeline(..., cache=True)`) and list the shards only once. The build time is logged separately in any case
+        :param schema_inference: bool (default = False), trace the ops to check the declared schemas and refine them with the inferred static shapes before splitting (see `pipeline.refine_schemas`). Static shapes at the split let the serialization skip shape information
+        :param storage_format: str (default = "tfrecord"), file format of the shards. Possible parameters: tfrecord, fixed-length (flat files of equally sized raw records), memmap (same files, read via `np.memmap`). Both fixed-length formats need serialization_format="raw", no compression and a static schema at the split (see `pipeline.storage_formats`)
+        :param materialization_cache: Optional[MaterializationCache] (default = None), reuse the shards of an identical offline part from previous runs and strategies instead of processing it again. A hit logs 0s offline time
+        :param online_worker_count: Optional[int] (default = None), run the online part in this many local worker processes, each with `thread_count` threads (see `service.LocalWorkerPool`). Every worker recreates the pipeline with `pipeline_factory` and reads its share of the shards, or of the source without split, which has to return its elements in the same order in every process. So py_function stages are not limited by the GIL of this process. Needs TFRecord shards that are all materialized, and does neither work with fusion planning nor split reordering. The workers are started before the first run and stopped with `stop_online_workers`
+        :param pipeline_factory: Optional[tuple] (default = None), (module name, function name, kwargs) that returns `pipeline` in the worker processes, e.g. ("cream_pipeline", "pipeline_definition", {"source_path": path}). Needed by online_worker_count
+        :param streaming_materialization: bool (default = False), run the offline part concurrently with the online part, which reads every shard as soon as it is sealed (see `pipeline.sealed_shards_dataset`). The shards are filled one after another instead of round-robin. Needs the tfrecord storage format and does neither work with fusion planning nor online workers. The materialization cache is not used and the streamed shards are read while they are still in the page cache
+        :param materialization_ratio: float (default = 1.0), share of the source elements that is materialized at the split position. The elements are selected by their hash, so a source that reorders its elements selects the same ones. The others are processed by the whole pipeline online and both streams are merged at random (see `pipeline.select_materialized`)
+        :param memory_tier_directory: Optional[str] (default = None), memory backed directory for the shards, e.g. "/dev/shm". Other processes on the same node can read them from there and dropping the page cache does not evict them. Needs the tfrecord storage format and neither works with streaming nor the materialization cache. The logged storage_type is "shm" or "shm+<storage_type>" if shards are spilled
+        :param memory_budget_MB: Optional[float] (default = None), how many MB of records are written to `memory_tier_directory`, the rest of every shard is spilled to `shard_directory_prefix`. Unlimited if None
+        :param compression_level: Optional[int] (default = None), level of the compression_type, the default of its codec if None (see `codecs.level_range`)
+        :param target_shard_size_MB: Optional[float] (default = None), replaces `shard_count` with a count per run so that the shards have about this size and every online reader gets the same number of shards (see `pipeline.auto_shard_count`). The record size is probed once on a few samples, outside of the measured time
+        :param byte_balanced_shards: bool (default = False), hand every record to the shard with the fewest bytes instead of round-robin, so that records of variable size do not skew the shard sizes
+        :param indexed_shards: bool (default = False), the online part reads single records by their offset in the shard index instead of streaming whole shards, and knows the exact cardinality (see `pipeline.indexed_shards_dataset`). Needs uncompressed TFRecord files, record codecs work
+        :param global_shuffle_seed: Optional[int] (default = None), read the indexed records in a pseudo random global order, without a shuffle buffer. Every epoch has its own order derived from the seed. Needs indexed_shards
+        :param storage_dtype: str (default = "none"), stores the floating point features at the split position with a smaller dtype and restores them after deserialization (see `pipeline.storage_dtypes()`). The maximum error is probed once on a few samples, outside of the measured time, and logged as storage_max_abs_error
+        :param storage_range: Optional[tuple] (default = None), (lowest, highest) value of the floating point features at the split, needed by the integer storage dtypes uint8 and int16
+        :param split_reordering: bool (default = False), reorder the "commutable" ops around the split, so that size-inflating ops run online and size-reducing ops offline (see `planner.reorder_for_split`). The sizes are profiled once on a few samples before the first offline part, outside of the measured time. The reordered pipeline and its predicted storage are logged as split_reordering
         '''
 
-        self._validated_compression_or_exit(compression_type)
+        self._validated_compression_or_exit(compression_type, compression_level)
+        self._validated_shard_sizing_or_exit(target_shard_size_MB, byte_balanced_shards, streaming_materialization)
+        self._validated_indexed_shards_or_exit(indexed_shards, global_shuffle_seed, storage_format, compression_type, streaming_materialization)
+        self._validated_serialization_format_or_exit(serialization_format)
+        self._validated_storage_format_or_exit(storage_format, serialization_format, compression_type)
+        self._validated_streaming_or_exit(streaming_materialization, storage_format, fusion_planning, online_worker_count)
+        self._validated_materialization_ratio_or_exit(materialization_ratio)
+        self._validated_online_workers_or_exit(online_worker_count, pipeline_factory, storage_format, indexed_shards, materialization_ratio, fusion_planning, split_reordering)
+        self._validated_storage_dtype_or_exit(storage_dtype, storage_range)
+        self._validated_memory_tier_or_exit(memory_tier_directory, memory_budget_MB, storage_format, streaming_materialization, materialization_cache)
 
+        self._serialization_format = serialization_format
+        # compresses the records at the split position instead of the shard files
+        self._record_codec = compression_type if codecs.is_record_codec(compression_type) else None
+        self._compression_level = compression_level
+        self._storage_dtype = storage_dtype
+        self._storage_range = storage_range
+        self._storage_format = storage_format
+        self._materialization_cache = materialization_cache
+        self._online_worker_count = online_worker_count
+        self._pipeline_factory = pipeline_factory
+        self._online_workers = None
+        self._streaming_materialization = streaming_materialization
+        # set while the shards of a streaming run are written
+        self._streaming_writes = None
+        self._materialization_ratio = materialization_ratio
+        self._memory_budget_MB = memory_budget_MB
+        self._samples_per_record = samples_per_record
+        self._fusion_planning = fusion_planning
+        self._read_parallelism = thread_count if read_parallelism == None else read_parallelism
+        self._vectorized_batch_size = vectorized_batch_size
+        self._pipeline_cache_enabled = pipeline_cache_enabled
+        self._online_pipeline_spec = None
+        self._offline_fusion_plan = None
+        self._online_fusion_plan = None
+        self._schema_inference = schema_inference
+        if schema_inference:
+            pipeline = pipeline_helper.refine_schemas(pipeline)
+        # profiled before the first offline part, see `_apply_split_reordering`
+        self._split_reordering_enabled = split_reordering and split_position != None
+        self._split_reordering = None
+        self._pipeline = pipeline
         self._split_pipeline(pipeline, split_position)
+        if split_position != None and storage_format != "tfrecord":
+            # fails early if the records at the split can not have a fixed size
+            pipeline_helper.fixed_record_dtype(self._online_pipeline[0]["output_schema"])
         self._split_position = split_position
         self._shard_count = shard_count
+        self._target_shard_size_MB = target_shard_size_MB
+        self._byte_balanced_shards = byte_balanced_shards
+        self._indexed_shards = indexed_shards
+        self._global_shuffle_seed = global_shuffle_seed
+        # mean size of a record at the split, probed for the automatic shard count
+        self._probed_record_size_b = None
         self._thread_count = thread_count
         self._ueid = self._get_ueid()
         self._creation_timestamp = self._get_timestamp()
@@ -61,25 +162,69 @@ class Strategy:
                                 self._get_shard_infix() + "_" + \
                                 self._get_thread_count_infix() + "_" + \
                                 self._ueid + "/"
+        # the shards of the memory tier, the spilled part of them stays in `self._shard_directory`
+        self._memory_directory = None
+        if memory_tier_directory != None:
+            self._memory_directory = memory_tier_directory.rstrip("/") + "/" + pathlib.Path(self._shard_directory).name + "/"
+            self._storage_type = "shm" if memory_budget_MB == None else "shm+" + storage_type
+        # where the online part reads the shards from, an entry of the materialization cache on a hit
+        self._materialized_directory = self._shard_directory
+        # offline metrics of the last `execute_offline_pipelines` pass
+        self._materialized_offline_run = None
         self.meta_info = {
             "offline_processing_and_save_time_s": []
           , "shard_count": self._shard_count
           , "thread_count": self._thread_count
+          , "read_parallelism": self._read_parallelism
           , "shard_cum_size_MB": []
+          , "shard_memory_MB": []
+          , "shard_sizes_MB": []
+          , "offline_build_time_s": []
+          , "offline_save_time_s": []
+          , "shared_offline_time_s": []
+          , "materialization_cache_hit": []
           , "sample_count": []
+          , "online_build_time_s": []
           , "online_processing_time_s": []
           , "throughput_sps": []
+          , "time_to_first_sample_s": []
+          , "first_epoch_time_s": []
+          , "epochs": []
+          , "epoch_times_s": []
+          , "steady_epoch_time_s": []
           , "runs_count": []
           , "runs_total": 0
           , "ueid": self._ueid
           , "split_name": self._get_last_strategy_step_name()
           , "creation_timestamp": self._creation_timestamp
           , "compression_type": self._get_compression_type_for_dataframe()
+          , "compression_level": self._compression_level
           , "storage_type": self._storage_type
+          , "serialization_format": self._serialization_format
+          , "storage_format": self._storage_format
+          , "samples_per_record": self._samples_per_record
+          , "vectorized_batch_size": self._vectorized_batch_size
+          , "pipeline_cache_enabled": self._pipeline_cache_enabled
+          , "schema_inference": self._schema_inference
+          , "online_worker_count": self._online_worker_count
+          , "streaming_materialization": self._streaming_materialization
+          , "materialization_ratio": self._materialization_ratio
+          , "memory_budget_MB": self._memory_budget_MB
+          , "target_shard_size_MB": self._target_shard_size_MB
+          , "byte_balanced_shards": self._byte_balanced_shards
+          , "indexed_shards": self._indexed_shards
+          , "global_shuffle_seed": self._global_shuffle_seed
+          , "storage_dtype": self._storage_dtype
+          , "storage_range": self._get_storage_range_for_dataframe()
+          , "storage_max_abs_error": None
+          , "split_reordering": planner.format_reordering(self._split_reordering)
+          , "offline_fusion_plan": None
+          , "online_fusion_plan": None
           , "application_cache_enabled": False
           , "system_cache_enabled": False
           , "batch_count": None
           , "prefetch_count": None
+          , "sink": "python"
         }
 
     def _set_application_cache_flag(self, value):
@@ -102,18 +247,180 @@ class Strategy:
         '''
         self.meta_info["prefetch_count"] = value
 
-    def _validated_compression_or_exit(self, compression_type):
-        '''Checks for 
+    def _set_sink_flag(self, value):
+        '''Sets the flag in the meta dict for export
+        '''
+        self.meta_info["sink"] = value
+
+    def _validated_epochs_or_exit(self, epochs):
+        '''Checks for at least one epoch
+        :param epochs: int
+        '''
+        if epochs < 1:
+            print(f"epochs has to be at least 1, got {epochs}")
+            sys.exit(0)
+
+    def _validated_compression_or_exit(self, compression_type, compression_level):
+        '''Checks for a compression known by `codecs.compression_types()`, its optional package and level
         :param compression_type: str
+        :param compression_level: Optional[int]
         '''
-        if not compression_type in ["none","GZIP","ZLIB"]:
-            print("compression_type is not known, please pick one of the following: 'none', 'GZIP', 'ZLIB'")
+        if not compression_type in codecs.compression_types():
+            print(f"compression_type is not known, please pick one of the following: {codecs.compression_types()}")
+            sys.exit(0)
+        if codecs.missing_module(compression_type) != None:
+            print(f"compression_type '{compression_type}' needs the package '{codecs.missing_module(compression_type)}'")
+            sys.exit(0)
+        level_range = codecs.level_range(compression_type)
+        if compression_level != None and (level_range == None or not level_range[0] <= compression_level <= level_range[1]):
+            print(f"compression_level {compression_level} is not supported by compression_type '{compression_type}', levels: {level_range}")
+            sys.exit(0)
+
+    def _validated_serialization_format_or_exit(self, serialization_format):
+        '''Checks for a record format known by `pipeline.serialization_formats()`
+        :param serialization_format: str
+        '''
+        if not serialization_format in pipeline_helper.serialization_formats():
+            print(f"serialization_format is not known, please pick one of the following: {pipeline_helper.serialization_formats()}")
             sys.exit(0)
     
+    def _validated_sink_or_exit(self, sink):
+        '''Checks for a sink known by `pipeline.sinks()`
+        :param sink: str
+        '''
+        if not sink in pipeline_helper.sinks():
+            print(f"sink is not known, please pick one of the following: {pipeline_helper.sinks()}")
+            sys.exit(0)
+
+    def _validated_storage_format_or_exit(self, storage_format, serialization_format, compression_type):
+        '''Checks for a file format known by `pipeline.storage_formats()` and its requirements
+        :param storage_format: str
+        :param serialization_format: str
+        :param compression_type: str
+        '''
+        if not storage_format in pipeline_helper.storage_formats():
+            print(f"storage_format is not known, please pick one of the following: {pipeline_helper.storage_formats()}")
+            sys.exit(0)
+        if storage_format != "tfrecord" and (serialization_format != "raw" or compression_type != "none"):
+            print(f"storage_format '{storage_format}' needs serialization_format 'raw' and compression_type 'none'")
+            sys.exit(0)
+
+    def _validated_streaming_or_exit(self, streaming_materialization, storage_format, fusion_planning, online_worker_count):
+        '''Checks that the options work with shards that are read while they are written
+        :param streaming_materialization: bool
+        :param storage_format: str
+        :param fusion_planning: bool
+        :param online_worker_count: Optional[int]
+        '''
+        if streaming_materialization and storage_format != "tfrecord":
+            print("streaming_materialization needs storage_format 'tfrecord'")
+            sys.exit(0)
+        # the online plan is profiled on complete shards and the sealed shards are listed in a generator, which can not run in a worker process
+        if streaming_materialization and (fusion_planning or online_worker_count != None):
+            print("streaming_materialization does not work with fusion_planning or online_worker_count")
+            sys.exit(0)
+
+    def _validated_online_workers_or_exit(self, online_worker_count, pipeline_factory, storage_format, indexed_shards, materialization_ratio, fusion_planning, split_reordering):
+        '''Checks that the worker processes can recreate and read the online part on their own
+        :param online_worker_count: Optional[int]
+        :param pipeline_factory: Optional[tuple]
+        :param storage_format: str
+        :param indexed_shards: bool
+        :param materialization_ratio: float
+        :param fusion_planning: bool
+        :param split_reordering: bool
+        '''
+        if online_worker_count == None:
+            return
+        if pipeline_factory == None or len(pipeline_factory) != 3:
+            print("online_worker_count needs a pipeline_factory (module name, function name, kwargs)")
+            sys.exit(0)
+        if storage_format != "tfrecord" or indexed_shards or materialization_ratio != 1:
+            print("online_worker_count needs storage_format 'tfrecord', no indexed_shards and materialization_ratio 1")
+            sys.exit(0)
+        # the workers build their pipeline without profiling
+        if fusion_planning or split_reordering:
+            print("online_worker_count does not work with fusion_planning or split_reordering")
+            sys.exit(0)
+
+    def _validated_materialization_ratio_or_exit(self, materialization_ratio):
+        '''Checks for a ratio between 0 and 1
+        :param materialization_ratio: float
+        '''
+        if not 0 <= materialization_ratio <= 1:
+            print(f"materialization_ratio has to be between 0 and 1, got {materialization_ratio}")
+            sys.exit(0)
+
+    def _validated_shard_sizing_or_exit(self, target_shard_size_MB, byte_balanced_shards, streaming_materialization):
+        '''Checks that the shards can be sized and balanced
+        :param target_shard_size_MB: Optional[float]
+        :param byte_balanced_shards: bool
+        :param streaming_materialization: bool
+        '''
+        if target_shard_size_MB != None and target_shard_size_MB <= 0:
+            print(f"target_shard_size_MB has to be positive, got {target_shard_size_MB}")
+            sys.exit(0)
+        # streamed shards are filled one after another and the reader needs the shard count before they are written
+        if streaming_materialization and (target_shard_size_MB != None or byte_balanced_shards):
+            print("streaming_materialization does not work with target_shard_size_MB or byte_balanced_shards")
+            sys.exit(0)
+
+    def _validated_indexed_shards_or_exit(self, indexed_shards, global_shuffle_seed, storage_format, compression_type, streaming_materialization):
+        '''Checks that the records of the shards can be read by their offset
+        :param indexed_shards: bool
+        :param global_shuffle_seed: Optional[int]
+        :param storage_format: str
+        :param compression_type: str
+        :param streaming_materialization: bool
+        '''
+        if global_shuffle_seed != None and not indexed_shards:
+            print("global_shuffle_seed needs indexed_shards")
+            sys.exit(0)
+        if indexed_shards and (storage_format != "tfrecord" or compression_type in codecs.FILE_CODECS):
+            print(f"indexed_shards needs storage_format 'tfrecord' without file compression, got '{storage_format}' and '{compression_type}'")
+            sys.exit(0)
+        # the indices are complete when the last shard is written
+        if indexed_shards and streaming_materialization:
+            print("indexed_shards does not work with streaming_materialization")
+            sys.exit(0)
+
+    def _validated_memory_tier_or_exit(self, memory_tier_directory, memory_budget_MB, storage_format, streaming_materialization, materialization_cache):
+        '''Checks that the options work with shards that are split between the memory tier and the disk
+        :param memory_tier_directory: Optional[str]
+        :param memory_budget_MB: Optional[float]
+        :param storage_format: str
+        :param streaming_materialization: bool
+        :param materialization_cache: Optional[MaterializationCache]
+        '''
+        if memory_tier_directory == None and memory_budget_MB != None:
+            print("memory_budget_MB needs a memory_tier_directory")
+            sys.exit(0)
+        if memory_tier_directory != None and storage_format != "tfrecord":
+            print("memory_tier_directory needs storage_format 'tfrecord'")
+            sys.exit(0)
+        # both read and copy the shards of a single directory
+        if memory_tier_directory != None and (streaming_materialization or materialization_cache != None):
+            print("memory_tier_directory does not work with streaming_materialization or a materialization_cache")
+            sys.exit(0)
+
+    def _validated_storage_dtype_or_exit(self, storage_dtype, storage_range):
+        '''Checks for a dtype known by `pipeline.storage_dtypes()` and the range of the integer dtypes
+        :param storage_dtype: str
+        :param storage_range: Optional[tuple]
+        '''
+        if not storage_dtype in pipeline_helper.storage_dtypes():
+            print(f"storage_dtype is not known, please pick one of the following: {pipeline_helper.storage_dtypes()}")
+            sys.exit(0)
+        if storage_dtype in ["uint8", "int16"] and (storage_range == None or len(storage_range) != 2 or not storage_range[0] < storage_range[1]):
+            print(f"storage_dtype '{storage_dtype}' needs a storage_range (lowest, highest), got {storage_range}")
+            sys.exit(0)
+
     def _get_compression_type_for_dataframe(self):
         '''Changing the empty string, which stands for no compression in tensorflow.data to "none"
-        :return: str (none, ZLIB, GZIP)
+        :return: str (none, ZLIB, GZIP or a record codec)
         '''
+        if self._record_codec != None:
+            return self._record_codec
         if self._compression_type == "":
             return "none"
         else:
@@ -131,7 +438,14 @@ class Strategy:
             self._offline_pipeline = []
             self._online_pipeline  = pipeline
         else:
-            offline_pipeline, online_pipeline = pipeline_helper.serialized_split(pipeline, split_position)
+            offline_pipeline, online_pipeline = pipeline_helper.serialized_split(pipeline
+                                                                               , split_position
+                                                                               , serialization_format=self._serialization_format
+                                                                               , samples_per_record=self._samples_per_record
+                                                                               , record_codec=self._record_codec
+                                                                               , codec_level=self._compression_level
+                                                                               , storage_dtype=self._storage_dtype
+                                                                               , storage_range=self._storage_range)
             self._offline_pipeline = offline_pipeline
             self._online_pipeline  = online_pipeline
     
@@ -159,14 +473,16 @@ class Strategy:
         if self._split_position == None:
             return "0-fully-online"
         else:
-            # get last step before serialization
-            last_materialized_step_name = str(self._split_position) + "-" + self._offline_pipeline[-2]["name"]
+            # get last step before serialization (and packing)
+            last_materialized_step_name = str(self._split_position) + "-" + self._offline_pipeline[self._split_position - 1]["name"]
             return last_materialized_step_name.replace(' ', '-').lower()
 
     def _get_shard_infix(self):
         '''Returns the shard infix for the shard directory
         :return: str
         '''
+        if self._target_shard_size_MB != None:
+            return "shards-auto"
         return "shards-" + str(self._shard_count)
 
     def _get_thread_count_infix(self):
@@ -176,11 +492,16 @@ class Strategy:
         return "threads-" + str(self._thread_count)
 
     def _delete_temp_files(self):
-        '''Deletes the temporary files in the `self._shard_directory` which are matching "*.tfrecord"
+        '''Deletes the temporary files in the `self._shard_directory` which are matching "shard-*" (shards and their index)
+        The memory tier is removed completely, it would take RAM until the next reboot otherwise
         '''
-        temp_files = [pathlib.Path(filepath) for filepath in glob.glob(self._shard_directory + "*.tfrecord")]
+        temp_files = [pathlib.Path(filepath) for filepath in glob.glob(self._shard_directory + "shard-*")]
+        if self._memory_directory != None:
+            temp_files += [pathlib.Path(filepath) for filepath in glob.glob(self._memory_directory + "shard-*")]
         for file in temp_files:
             file.unlink()
+        if self._memory_directory != None and pathlib.Path(self._memory_directory).exists():
+            pathlib.Path(self._memory_directory).rmdir()
 
     def _increment_run_counter(self):
         '''Increments the run counter in the meta_info dict in a way so that the resulting pandas dataframe works correctly
@@ -194,58 +515,401 @@ class Strategy:
 
         self.meta_info["runs_total"] = len(self.meta_info["runs_count"])
 
+    def _apply_split_reordering(self):
+        '''Reorders the "commutable" ops around the split once and splits the pipeline again, profiling the sizes runs the pipeline on a few samples
+        '''
+        if not self._split_reordering_enabled or self._split_reordering != None:
+            return
+        self._split_reordering = planner.reorder_for_split(self._pipeline, self._split_position)
+        self._pipeline, self._split_position = self._split_reordering["pipeline"], self._split_reordering["split_position"]
+        self._split_pipeline(self._pipeline, self._split_position)
+        self._online_pipeline_spec = None
+        if self._storage_format != "tfrecord":
+            pipeline_helper.fixed_record_dtype(self._online_pipeline[0]["output_schema"])
+        self.meta_info["split_name"] = self._get_last_strategy_step_name()
+        self.meta_info["split_reordering"] = planner.format_reordering(self._split_reordering)
+
     def execute_offline_pipeline(self
-                               , sample_count: int):
-        '''Runs the offline part of the pipeline and saves it as as `.tfrecord` files
+                               , sample_count: int
+                               , streaming: bool = False):
+        '''Runs the offline part of the pipeline and saves it as as `.tfrecord` or fixed-length `.bin` files
         
         :param sample_count (int): datasamples count
+        :param streaming (bool): fill and seal the shards one after another for a concurrent reader, without the materialization cache
         '''
 
+        self._apply_split_reordering()
+
+        # only a share of the samples is materialized, the others are computed online
+        sample_count = int(np.ceil(sample_count * self._materialization_ratio))
+        if self._target_shard_size_MB != None:
+            self._update_auto_shard_count(sample_count)
+        if self._storage_dtype != "none" and self.meta_info["storage_max_abs_error"] == None:
+            self._probe_storage_error()
+
+        if self._materialization_cache != None and not streaming:
+            cache_key = self._materialization_cache.entry_key(self._offline_pipeline
+                                                            , sample_count=sample_count
+                                                            , shard_count=self._shard_count
+                                                            , compression_type=self._compression_type
+                                                            , compression_level=self._compression_level
+                                                            , storage_format=self._storage_format
+                                                            , materialization_ratio=self._materialization_ratio
+                                                            , indexed_shards=self._indexed_shards)
+            entry_directory = self._materialization_cache.lookup(cache_key)
+            if entry_directory != None:
+                # create directory as the shard creating part of the offline pipeline wont for the logs
+                pathlib.Path(self._shard_directory).mkdir(exist_ok = True, parents = True)
+                self._set_materialized_directory(entry_directory)
+                self.meta_info["offline_processing_and_save_time_s"].append(0)
+                self.meta_info["offline_build_time_s"].append(0)
+                self.meta_info["offline_save_time_s"].append(0)
+                self.meta_info["shared_offline_time_s"].append(0)
+                self.meta_info["materialization_cache_hit"].append(True)
+                self.meta_info["shard_cum_size_MB"].append(self._get_shard_cum_size_MB(entry_directory))
+                self.meta_info["shard_memory_MB"].append(0)
+                self.meta_info["shard_sizes_MB"].append(self._get_shard_sizes_MB(entry_directory))
+                return
+
+        offline_pipeline = copy.copy(self._offline_pipeline)
+        if self._samples_per_record > 1:
+            # samples have to be taken before they are packed into records
+            offline_pipeline.insert(self._split_position, {
+                "name": "take samples",
+                "type": "ds_transform",
+                "op": lambda ds: ds.take(sample_count),
+                "cache_key": ("take", sample_count)
+            })
+        if self._materialization_ratio < 1:
+            offline_pipeline = pipeline_helper.select_materialized(offline_pipeline, self._materialization_ratio, materialized=True)
+        if self._vectorized_batch_size != None:
+            offline_pipeline = pipeline_helper.vectorize_pipeline(offline_pipeline, self._vectorized_batch_size)
+
+        # planning is done once and not part of the measured time
+        if self._fusion_planning and self._offline_fusion_plan == None:
+            self._offline_fusion_plan = planner.plan_fusion(offline_pipeline, thread_count=self._thread_count)
+            self.meta_info["offline_fusion_plan"] = planner.format_fusion_plan(self._offline_fusion_plan)
+
         start = time.time()
-        offline_dataset = pipeline_helper.build_pipeline(self._offline_pipeline, compressed_parallelism=self._thread_count) \
-                                         .take(sample_count)
-                                         # .apply(tf.data.experimental.ignore_errors()) \
+        offline_dataset = pipeline_helper.build_pipeline(offline_pipeline
+                                                       , compressed_parallelism=self._thread_count
+                                                       , fusion_plan=self._offline_fusion_plan
+                                                       , cache=self._pipeline_cache_enabled)
+        self.meta_info["offline_build_time_s"].append(time.time() - start)
+        if self._samples_per_record == 1:
+            offline_dataset = offline_dataset.take(sample_count)
+
+        records_per_shard = None
+        if streaming:
+            record_count = int(np.ceil(sample_count / self._samples_per_record))
+            records_per_shard = int(np.ceil(record_count / self._shard_count))
 
-        pipeline_helper.save_ds_parallel(
+        # the memory tier spills to the shard directory
+        shard_directory = self._shard_directory
+        spill_directory = None
+        byte_budget = None
+        if self._memory_directory != None:
+            shard_directory = self._memory_directory
+            if self._memory_budget_MB != None:
+                spill_directory = self._shard_directory
+                byte_budget = int(self._memory_budget_MB * 1000**2)
+
+        save_time_s = pipeline_helper.save_ds_parallel(
             dataset=offline_dataset
           , shard_count=self._shard_count
-          , shard_directory=self._shard_directory
-          , compression_type=self._compression_type)
+          , shard_directory=shard_directory
+          , compression_type=self._compression_type
+          , fixed_length=self._storage_format != "tfrecord"
+          , records_per_shard=records_per_shard
+          , spill_directory=spill_directory
+          , byte_budget=byte_budget
+          , compression_level=self._get_file_compression_level()
+          , balance_bytes=self._byte_balanced_shards
+          , indexed=self._indexed_shards)
         end = time.time()
+        shard_memory_MB = 0 if self._memory_directory == None else self._get_shard_cum_size_MB(self._memory_directory)
         self.meta_info["offline_processing_and_save_time_s"].append(end - start)
-        
-        shard_sizes_b = [pathlib.Path(fp).stat().st_size for fp in glob.glob(self._shard_directory + "*.tfrecord")]
-        self.meta_info["shard_cum_size_MB"].append(np.sum(shard_sizes_b) / 1000**2)
+        self.meta_info["offline_save_time_s"].append(save_time_s)
+        self.meta_info["shared_offline_time_s"].append(0)
+        self.meta_info["materialization_cache_hit"].append(False)
+        self.meta_info["shard_cum_size_MB"].append(self._get_shard_cum_size_MB(self._shard_directory) + shard_memory_MB)
+        self.meta_info["shard_memory_MB"].append(shard_memory_MB)
+        self.meta_info["shard_sizes_MB"].append(self._get_shard_sizes_MB(self._shard_directory))
+        self._set_materialized_directory(self._shard_directory)
 
+        # copying the shards into the cache is not part of the measured time
+        if self._materialization_cache != None and not streaming:
+            self._materialization_cache.insert(cache_key, self._shard_directory)
 
-    def create_online_pipeline(self):
-        '''Creates the online part of the pipeline that returns a tf.Dataset
-        Datasat is lazily created, you need to `.take(n)` from it when using the data for training
+    def _update_auto_shard_count(self, sample_count: int):
+        '''Sets the shard count for the materialized samples from the target shard size and the online readers
+        :param sample_count: int - materialized samples
+        '''
+        # probing the record size is not part of the measured time
+        if self._probed_record_size_b == None:
+            probe_dataset = pipeline_helper.build_pipeline(self._offline_pipeline, compressed_parallelism=self._thread_count)
+            self._probed_record_size_b = pipeline_helper.mean_record_size_b(probe_dataset)
+        record_count = int(np.ceil(sample_count / self._samples_per_record))
+        # tf.data.AUTOTUNE is negative
+        reader_count = self._read_parallelism if self._read_parallelism > 0 else self._thread_count
+        shard_count = pipeline_helper.auto_shard_count(record_count
+                                                     , self._probed_record_size_b
+                                                     , self._target_shard_size_MB * 1000**2
+                                                     , reader_count)
+        # a kept online specification lists the shards of the previous count
+        if shard_count != self._shard_count:
+            self._online_pipeline_spec = None
+        self._shard_count = shard_count
+        self.meta_info["shard_count"] = shard_count
 
-        :param parallel_reads: (int) amount of thread_count given to tf.data.TFRecordDataset
-        :return: tf.Dataset
+    def _probe_storage_error(self):
+        '''Logs the maximum absolute error of the storage dtype on the first samples at the split, not part of the measured time
+        '''
+        probe_dataset = pipeline_helper.build_pipeline(self._pipeline[:self._split_position], compressed_parallelism=self._thread_count)
+        self.meta_info["storage_max_abs_error"] = pipeline_helper.max_abs_error(probe_dataset
+                                                                               , self._storage_dtype
+                                                                               , self._storage_range)
+
+    def _get_storage_range_for_dataframe(self):
+        '''The range tuple would be expanded into rows by pandas
+        :return: Optional[str]
+        '''
+        if self._storage_range == None:
+            return None
+        return str(tuple(self._storage_range))
+
+    def _get_file_compression_level(self):
+        '''Returns the level of the TFRecord file compression, a level of a record codec is applied in the serialization
+        :return: Optional[int]
         '''
+        return self._compression_level if self._record_codec == None else None
+
+    def _get_shard_cum_size_MB(self, directory: str):
+        '''Returns the size of all shards in the directory, without their indices and manifests
+        :param directory: str
+        :return: float
+        '''
+        shard_sizes_b = [pathlib.Path(fp).stat().st_size for fp in glob.glob(directory + "shard-*")
+                         if re.match(r"shard-\d+\.(tfrecord|bin)$", pathlib.Path(fp).name) != None]
+        return np.sum(shard_sizes_b) / 1000**2
+
+    def _get_shard_directories(self):
+        '''Returns the directories the online part reads the shards from
+        :return: list(str) - the memory tier and its spill directory, or the materialized directory
+        '''
+        if self._memory_directory == None:
+            return [self._materialized_directory]
+        return [self._memory_directory] + ([self._shard_directory] if self._memory_budget_MB != None else [])
+
+    def _get_shard_sizes_MB(self, directory: str):
+        '''Returns the size of every shard in the directory ordered by shard number, including its part in the memory tier
+        :param directory: str
+        :return: list(float)
+        '''
+        directories = [directory]
+        if self._memory_directory != None and directory == self._shard_directory:
+            directories.append(self._memory_directory)
+        shard_sizes_b = {}
+        for shard_directory in directories:
+            for filepath in glob.glob(shard_directory + "shard-*"):
+                shard_number = re.match(r"shard-(\d+)\.(tfrecord|bin)$", pathlib.Path(filepath).name)
+                # skips the indices and manifests
+                if shard_number != None:
+                    shard_sizes_b[int(shard_number.group(1))] = shard_sizes_b.get(int(shard_number.group(1)), 0) + pathlib.Path(filepath).stat().st_size
+        return [shard_sizes_b[shard_number] / 1000**2 for shard_number in sorted(shard_sizes_b)]
+
+    def _set_materialized_directory(self, directory: str):
+        '''Sets the directory the online part reads the shards from, a kept online specification is only valid for the same directory
+        :param directory: str
+        '''
+        if directory != self._materialized_directory:
+            self._online_pipeline_spec = None
+        self._materialized_directory = directory
+
+
+    def _get_online_pipeline_spec(self):
+        '''Returns the online part of the pipeline specification, including the loading of the shards if the pipeline is split
+        :return: list(dict)
+        '''
+        streaming = self._streaming_writes != None
+        # listing the shards again is only necessary if the shards can change, the manifests of indexed shards are always read again
+        if self._pipeline_cache_enabled and self._online_pipeline_spec != None and not streaming and not self._indexed_shards:
+            return self._online_pipeline_spec
 
         online_pipeline = copy.copy(self._online_pipeline)
 
+        # shards that are still written are read as soon as they are sealed
+        if self._split_position != None and streaming:
+            online_pipeline.insert(0, {
+                "name": "load sealed TFRecord shards",
+                "type": "op",
+                "op": pipeline_helper.sealed_shards_dataset(self._shard_directory
+                                                          , self._shard_count
+                                                          , self._compression_type
+                                                          , self._streaming_writes
+                                                          , num_parallel_reads=self._read_parallelism),
+                # only valid for this run
+                "cache_key": ("load sealed TFRecord shards", self._ueid, self.meta_info["runs_count"][-1]),
+                "output_schema": online_pipeline[0]["input_schema"]
+            })
         # if the pipeline is split, insert the loading of tfrecords step
-        if self._split_position != None:
+        elif self._split_position != None and self._storage_format == "fixed-length":
+            online_pipeline.insert(0, {
+                "name": "load fixed-length shards",
+                "type": "op",
+                "op": pipeline_helper.fixed_length_shards_dataset(self._materialized_directory
+                                                                , num_parallel_reads=self._read_parallelism),
+                "cache_key": ("load fixed-length shards", self._materialized_directory, self._read_parallelism),
+                "output_schema": online_pipeline[0]["input_schema"]
+            })
+        # samples from memory mapped shards are already decoded and replace the deserialization
+        elif self._split_position != None and self._storage_format == "memmap":
+            online_pipeline[0] = {
+                "name": "load memmap shards",
+                "type": "op",
+                "op": pipeline_helper.memmap_shards_dataset(self._materialized_directory
+                                                          , online_pipeline[0]["output_schema"]
+                                                          , num_parallel_reads=self._read_parallelism),
+                "cache_key": ("load memmap shards", self._materialized_directory, self._read_parallelism),
+                "output_schema": online_pipeline[0]["output_schema"]
+            }
+        # single records are read by their offset
+        elif self._split_position != None and self._indexed_shards:
+            online_pipeline.insert(0, {
+                "name": "load indexed TFRecord shards",
+                "type": "op",
+                "op": pipeline_helper.indexed_shards_dataset(self._get_shard_directories()
+                                                           , shuffle_seed=self._global_shuffle_seed
+                                                           , num_parallel_reads=self._read_parallelism),
+                # the shards of another sample count are written into the same directories
+                "cache_key": ("load indexed TFRecord shards"
+                            , tuple(self._get_shard_directories())
+                            , repr([pipeline_helper.load_tfrecord_manifest(directory) for directory in self._get_shard_directories()])
+                            , self._global_shuffle_seed
+                            , self._read_parallelism),
+                "output_schema": online_pipeline[0]["input_schema"]
+            })
+        elif self._split_position != None:
+            shard_patterns = [self._materialized_directory + "*.tfrecord"]
+            if self._memory_directory != None:
+                # without spilled shards, the pattern of the shard directory matches nothing
+                shard_patterns = [self._memory_directory + "*.tfrecord"] + \
+                                 ([] if glob.glob(shard_patterns[0]) == [] else shard_patterns)
             online_pipeline.insert(0, {
                 "name": "load TFRecord shards",
                 "type": "op",
                 "op": tf.data.TFRecordDataset(
-                    tf.data.Dataset.list_files(self._shard_directory + "*.tfrecord"
+                    tf.data.Dataset.list_files(shard_patterns
                                              , seed = 42)
-                  , num_parallel_reads=self._thread_count
+                  , num_parallel_reads=self._read_parallelism
                   , compression_type=self._compression_type
                 ),
+                "cache_key": ("load TFRecord shards", self._materialized_directory, self._read_parallelism, self._compression_type),
                 "output_schema": online_pipeline[0]["input_schema"]
             })
 
-        online_dataset = pipeline_helper.build_pipeline(online_pipeline, compressed_parallelism=self._thread_count)
+        if self._vectorized_batch_size != None:
+            online_pipeline = pipeline_helper.vectorize_pipeline(online_pipeline, self._vectorized_batch_size)
+
+        if self._pipeline_cache_enabled and not streaming:
+            self._online_pipeline_spec = online_pipeline
+        return online_pipeline
+
+    def _plan_online_fusion(self):
+        '''Plans the map fusion of the online part once, needs the shards to be written already
+        '''
+        if self._fusion_planning and self._online_fusion_plan == None:
+            self._online_fusion_plan = planner.plan_fusion(self._get_online_pipeline_spec(), thread_count=self._thread_count)
+            self.meta_info["online_fusion_plan"] = planner.format_fusion_plan(self._online_fusion_plan)
+
+    def create_online_pipeline(self, sample_count: Optional[int] = None):
+        '''Creates the online part of the pipeline that returns a tf.Dataset
+        Datasat is lazily created, you need to `.take(n)` from it when using the data for training
+
+        :param sample_count: Optional[int] (default = None), with online workers and without split, the workers share the first `sample_count` samples of the source
+        :return: tf.Dataset
+        '''
+
+        online_dataset = pipeline_helper.build_pipeline(self._get_online_pipeline_spec()
+                                                      , compressed_parallelism=self._thread_count
+                                                      , fusion_plan=self._online_fusion_plan
+                                                      , cache=self._pipeline_cache_enabled)
+
+        # the samples that are not materialized run through the whole pipeline
+        if self._split_position != None and self._materialization_ratio < 1:
+            computed_dataset = pipeline_helper.build_pipeline(pipeline_helper.select_materialized(self._pipeline, self._materialization_ratio, materialized=False)
+                                                            , compressed_parallelism=self._thread_count
+                                                            , vectorized_batch_size=self._vectorized_batch_size
+                                                            , cache=self._pipeline_cache_enabled)
+            online_dataset = pipeline_helper.merge_materialized(online_dataset, computed_dataset, self._materialization_ratio)
+
+        # the local build only provides the element spec, the workers build the online part themselves
+        if self._online_workers != None:
+            shard_files = None
+            if self._split_position != None:
+                shard_patterns = [self._materialized_directory + "*.tfrecord"] + ([] if self._memory_directory == None else [self._memory_directory + "*.tfrecord"])
+                shard_files = sorted(set(filepath for pattern in shard_patterns for filepath in glob.glob(pattern)))
+            online_dataset = self._online_workers.dataset(online_dataset.element_spec, shard_files=shard_files, sample_count=sample_count)
 
         return online_dataset
 
+    def _online_worker_config(self):
+        '''Returns the configuration the online worker processes recreate and split the pipeline with
+        :return: dict - see `service.LocalWorkerPool`
+        '''
+        return {
+            "pipeline_factory": list(self._pipeline_factory)
+          , "split_position": self._split_position
+          , "split_options": {"serialization_format": self._serialization_format
+                            , "samples_per_record": self._samples_per_record
+                            , "record_codec": self._record_codec
+                            , "codec_level": self._compression_level
+                            , "storage_dtype": self._storage_dtype
+                            , "storage_range": None if self._storage_range == None else list(self._storage_range)}
+          , "schema_inference": self._schema_inference
+          , "thread_count": self._thread_count
+          , "read_parallelism": self._read_parallelism
+          , "vectorized_batch_size": self._vectorized_batch_size
+          , "compression_type": self._compression_type
+        }
+
+    def stop_online_workers(self):
+        '''Stops the worker processes of the online part if they were started
+        '''
+        if self._online_workers != None:
+            self._online_workers.stop()
+            self._online_workers = None
+
+
+    def _append_skipped_offline_run(self):
+        '''Logs a run without offline processing, so that all per-run lists in the meta_info dict have the same length
+        '''
+        self.meta_info["offline_processing_and_save_time_s"].append(0)
+        self.meta_info["offline_build_time_s"].append(0)
+        self.meta_info["offline_save_time_s"].append(0)
+        self.meta_info["shared_offline_time_s"].append(0)
+        self.meta_info["materialization_cache_hit"].append(False)
+        self.meta_info["shard_cum_size_MB"].append(0)
+        self.meta_info["shard_memory_MB"].append(0)
+        self.meta_info["shard_sizes_MB"].append([])
+
+    def _append_materialized_offline_run(self):
+        '''Logs the offline metrics of the last `execute_offline_pipelines` pass as the offline part of this run
+        '''
+        for key, value in self._materialized_offline_run.items():
+            self.meta_info[key].append(value)
+
+    def _execute_streaming_offline_pipeline(self
+                                          , sample_count: int
+                                          , writing_done: threading.Event):
+        '''Runs the offline part with sealed shards and signals the concurrent reader when all shards are written
+        :param sample_count: int
+        :param writing_done: threading.Event
+        '''
+        try:
+            self.execute_offline_pipeline(sample_count, streaming=True)
+        finally:
+            writing_done.set()
 
     def execute_full_pipeline(self
                             , run_id: int
@@ -254,8 +918,13 @@ class Strategy:
                             , batch_count: int = None
                             , prefetch_count: int = None
                             , system_cache_enabled: bool = False
-                            , application_cache_enabled: bool = False):
-        '''Executes both pipelines and simulates the "processing" by a sink with a for loop that checks the shape of each sample
+                            , application_cache_enabled: bool = False
+                            , offline_materialized: bool = False
+                            , sink: str = "python"
+                            , epochs: int = 1):
+        '''Executes both pipelines and simulates the "processing" by a sink, either a for loop that checks the shape of each sample or a reduce inside the TF runtime
+        With several epochs, the online dataset is built once and consumed `epochs` times, like in training. The first epoch
+        includes the build and cold reads, the following (steady) epochs show what every further epoch costs
 
         :param run_id: (int)
         :param sample_count: (int)
@@ -263,13 +932,37 @@ class Strategy:
         :param batch_count: (int) - if none, no custom loop to iterate over batches
         :param prefetch_count: (int) - how many batches to prefetch
         :param application_cache_enabled: (bool) - run twice and only count the application cache time? 
+        :param offline_materialized: (bool) - the shards were already written by `execute_offline_pipelines`, its metrics are logged for the first run and the shards are kept until the last run
+        :param sink: (str) - "python" iterates the samples in Python, "graph" consumes them with `pipeline.graph_sink` to measure the pipeline without the loop overhead
+        :param epochs: (int) - how often the online dataset is consumed, the time of every epoch is logged in "epoch_times_s"
         :returns: tf.data.Dataset - already evaluated with `.take(sample_count)`
         '''
 
+        self._validated_sink_or_exit(sink)
+        self._validated_epochs_or_exit(epochs)
+        self._set_sink_flag(value=sink)
         self._increment_run_counter()
+        # before the streamed offline part, which runs concurrently with building the online part
+        self._apply_split_reordering()
 
+        # only runs that write shards can stream them
+        streaming = self._streaming_materialization \
+                    and self._split_position != None \
+                    and not offline_materialized \
+                    and (not system_cache_enabled or run_id < 1)
+
+        offline_start = time.time()
+        # shards from a single pass over several strategies?
+        if offline_materialized:
+            if run_id < 1:
+                self._append_materialized_offline_run()
+            else:
+                self._append_skipped_offline_run()
+        # the offline part is started concurrently with the online part below
+        elif streaming:
+            pathlib.Path(self._shard_directory).mkdir(exist_ok = True, parents = True)
         # do we want to test system cache?
-        if system_cache_enabled:
+        elif system_cache_enabled:
             # if we run for the first time, we need to create the dataset
             if run_id < 1:
                 # if we have offline steps
@@ -279,12 +972,10 @@ class Strategy:
                 else:
                     # create directory as the shard creating part of the offline pipeline wont for the logs
                     pathlib.Path(self._shard_directory).mkdir(exist_ok = True, parents = True)
-                    self.meta_info["offline_processing_and_save_time_s"].append(0)
-                    self.meta_info["shard_cum_size_MB"].append(0)
+                    self._append_skipped_offline_run()
             # for runs=1+, we only read the files from memory, no need for preprocessing
             else:
-                self.meta_info["offline_processing_and_save_time_s"].append(0)
-                self.meta_info["shard_cum_size_MB"].append(0)
+                self._append_skipped_offline_run()
         # no system caching test? run normally each run
         else:
             # do we have offline steps?
@@ -294,8 +985,12 @@ class Strategy:
             else:
                 # create directory as the shard creating part of the offline pipeline wont for the logs
                 pathlib.Path(self._shard_directory).mkdir(exist_ok = True, parents = True)
-                self.meta_info["offline_processing_and_save_time_s"].append(0)
-                self.meta_info["shard_cum_size_MB"].append(0)
+                self._append_skipped_offline_run()
+        # includes the probes and cache lookups that the logged offline time leaves out
+        offline_time_s = time.time() - offline_start
+
+        # profiling the online ops reads a few shards, so it has to happen before the cache is dropped
+        self._plan_online_fusion()
 
         # testing system level caching?
         if system_cache_enabled:
@@ -308,8 +1003,20 @@ class Strategy:
             # its necessary to drop the cache here to simulate that the offline processing was done "offline", and we *need* to read from disk
             drop_io_cache(page_cache=True, dentries_and_inodes=True)
 
+        # starting the worker processes is not part of the measured online time
+        if self._online_worker_count != None and self._online_workers == None:
+            self._online_workers = LocalWorkerPool(self._online_worker_count, self._online_worker_config())
+
+        if streaming:
+            self._streaming_writes = threading.Event()
+            offline_start = time.time()
+            offline_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            offline_writer = offline_executor.submit(self._execute_streaming_offline_pipeline, sample_count, self._streaming_writes)
+
         start = time.time()
-        ds = self.create_online_pipeline().take(sample_count)
+        online_start = start
+        ds = self.create_online_pipeline(sample_count).take(sample_count)
+        self.meta_info["online_build_time_s"].append(time.time() - start)
         if batch_count != None and prefetch_count != None:
             ds = ds.batch(batch_count).prefetch(prefetch_count)
         elif batch_count != None and prefetch_count == None:
@@ -322,11 +1029,21 @@ class Strategy:
             ds = ds.cache()
 
         def evaluate_loop():
+            '''
+            :return: Optional[float] - when the first sample arrived, None with the graph sink
+            '''
+            # the reduce runs inside the TF runtime, no sample reaches Python
+            if sink == "graph":
+                pipeline_helper.graph_sink(ds, batched = batch_count != None)
+                return None
+            first_sample_time = None
             # forced evaluation by checking the shape
             x_dimension = 0
             # if batch iteration, need to iterate over the internal batches
             if batch_count != None:
                 for i, batch in enumerate(ds):
+                    if first_sample_time == None:
+                        first_sample_time = time.time()
                     for j, sample in enumerate(batch):
                         if isinstance(sample, tuple):
                             x_dimension += sample[0].shape[0]
@@ -335,26 +1052,61 @@ class Strategy:
             # if no batch interation, counting samples is enough
             else:
                 for j, sample in enumerate(ds):
+                    if first_sample_time == None:
+                        first_sample_time = time.time()
                     if isinstance(sample, tuple):
                         x_dimension += sample[0].shape[0]
                     else:
                         x_dimension += sample.shape[0]
+            return first_sample_time
 
         # consume the dataset once
-        evaluate_loop()
+        try:
+            first_sample_time = evaluate_loop()
+            first_epoch_end = time.time()
+        finally:
+            if streaming:
+                # waits until the offline part is finished
+                offline_executor.shutdown()
+                self._streaming_writes = None
+        if streaming:
+            # raises the errors of the offline part
+            offline_writer.result()
+        # the following epochs read the same dataset again
+        epoch_times_s = [first_epoch_end - online_start]
+        for _ in range(epochs - 1):
+            epoch_start = time.time()
+            evaluate_loop()
+            epoch_times_s.append(time.time() - epoch_start)
+        consumed_sample_count = sample_count * epochs
         # if we test application cache, we restart the timer and consume the dataset again
         if application_cache_enabled:
             start = time.time()
             evaluate_loop()
+            consumed_sample_count = sample_count
 
         end = time.time()
         self.meta_info["sample_count"].append(sample_count)
         online_processing_time_s = end - start
         self.meta_info["online_processing_time_s"].append(online_processing_time_s)
-        self.meta_info["throughput_sps"].append(sample_count / online_processing_time_s)
+        self.meta_info["throughput_sps"].append(consumed_sample_count / online_processing_time_s)
+        self.meta_info["epochs"].append(epochs)
+        self.meta_info["epoch_times_s"].append(epoch_times_s)
+        self.meta_info["steady_epoch_time_s"].append(np.mean(epoch_times_s[1:]) if epochs > 1 else np.nan)
 
-        # testing system level caching?
-        if system_cache_enabled:
+        # from the start of the offline part, which runs before the online part unless it is streamed. Dropping the cache and
+        # starting the workers in between is not counted. Shards of a single pass were written by the whole pass before this run
+        if streaming:
+            run_start = offline_start
+        elif offline_materialized:
+            run_start = online_start - self.meta_info["shared_offline_time_s"][-1]
+        else:
+            run_start = online_start - offline_time_s
+        self.meta_info["time_to_first_sample_s"].append(np.nan if first_sample_time == None else first_sample_time - run_start)
+        self.meta_info["first_epoch_time_s"].append(first_epoch_end - run_start)
+
+        # testing system level caching or reading shards of a single pass?
+        if system_cache_enabled or offline_materialized:
             # is it the last run? delete files, otherwise not
             if (run_id + 1) == runs_total:
                 self._delete_temp_files()
@@ -371,13 +1123,18 @@ class Strategy:
                        , enable_tracing: bool = False
                        , prefetch_count: int = None
                        , system_cache_enabled: bool = False
-                       , application_cache_enabled: bool = False):
+                       , application_cache_enabled: bool = False
+                       , offline_materialized: bool = False
+                       , sink: str = "python"
+                       , epochs: int = 1):
         '''Runs the strategy multiple times and populates the meta info about the runs in private members
         In parallel at least `dstat` is running and also writes the data to disk. 
 
         :param sample_count: (int) how many samples are used from the dataset
         :param runs_total: (int) how often is each experiment reproduced
         :param batch_count: (int) how big is the batch size
+        :param sink: (str) "python" or "graph", see `execute_full_pipeline`
+        :param epochs: (int) epochs per run, see `execute_full_pipeline`
         '''
 
         self._set_application_cache_flag(value=application_cache_enabled)
@@ -392,16 +1149,16 @@ class Strategy:
             , system_cache_enabled = system_cache_enabled
             , enable_tracing = enable_tracing
             , function = self.execute_full_pipeline
-            , args = [sample_count, runs_total, batch_count, prefetch_count, system_cache_enabled, application_cache_enabled])
+            , args = [sample_count, runs_total, batch_count, prefetch_count, system_cache_enabled, application_cache_enabled, offline_materialized, sink, epochs])
 
     def print_stats(self):
         '''Simple stdout logger to check the self.meta_info dict
         '''
         print(f"Strategy {self._shard_directory}", flush=True)
         for k,v in self.meta_info.items():
-            if k in ["ueid", "creation_timestamp", "split_name", "compression_type", "storage_type", "system_cache_enabled", "application_cache_enabled", "batch_count", "prefetch_count"]:
+            if k in ["ueid", "creation_timestamp", "split_name", "compression_type", "compression_level", "storage_type", "serialization_format", "storage_format", "read_parallelism", "samples_per_record", "vectorized_batch_size", "pipeline_cache_enabled", "schema_inference", "online_worker_count", "streaming_materialization", "materialization_ratio", "memory_budget_MB", "target_shard_size_MB", "byte_balanced_shards", "indexed_shards", "global_shuffle_seed", "storage_dtype", "storage_range", "storage_max_abs_error", "split_reordering", "offline_fusion_plan", "online_fusion_plan", "system_cache_enabled", "application_cache_enabled", "batch_count", "prefetch_count", "sink"]:
                 print(f"  - {k} = {v}", flush=True)
-            elif k in ["runs_count", "runs_total"]:
+            elif k in ["runs_count", "runs_total", "shard_sizes_MB", "epoch_times_s"]:
                 print(f"  - {k} = {v}", flush=True)
             else:
                 if v == []:
@@ -495,11 +1252,27 @@ class Strategy:
            ,"filelocks_read": []
            ,"filelocks_write": []
            ,"compression_type": self._get_compression_type_for_dataframe()
+           ,"compression_level": self._compression_level
            ,"storage_type": self._storage_type
+           ,"serialization_format": self._serialization_format
+           ,"storage_format": self._storage_format
+           ,"online_worker_count": self._online_worker_count
+           ,"streaming_materialization": self._streaming_materialization
+           ,"materialization_ratio": self._materialization_ratio
+           ,"memory_budget_MB": self._memory_budget_MB
+           ,"target_shard_size_MB": self._target_shard_size_MB
+           ,"byte_balanced_shards": self._byte_balanced_shards
+           ,"indexed_shards": self._indexed_shards
+           ,"global_shuffle_seed": self._global_shuffle_seed
+           ,"storage_dtype": self._storage_dtype
+           ,"storage_range": self._get_storage_range_for_dataframe()
+           ,"storage_max_abs_error": self.meta_info["storage_max_abs_error"]
+           ,"samples_per_record": self._samples_per_record
            ,"application_cache_enabled": self.meta_info["application_cache_enabled"]
            ,"system_cache_enabled": self.meta_info["system_cache_enabled"]
            ,"batch_count": self.meta_info["batch_count"]
            ,"prefetch_count": self.meta_info["prefetch_count"]
+           ,"sink": self.meta_info["sink"]
           }
 
         for dstat_fp in dstat_filepaths:
@@ -565,3 +1338,65 @@ class Strategy:
                 dstat_dict["filelocks_write"].append(filelocks_write)
                 
         return pd.DataFrame(dstat_dict)
+
+
+def execute_offline_pipelines(strategies
+                            , sample_count: int):
+    '''Runs the offline parts of several strategies in a single pass over the pipeline they share
+    The samples are processed once and serialized at every split position, each strategy gets its own shards with its
+    own serialization, shard count and compression. Profile the strategies afterwards with `offline_materialized=True`.
+    All strategies need a split position, `samples_per_record=1`, `materialization_ratio=1`, no memory tier and only "op" steps between their split positions.
+    Vectorization, fusion planning and the materialization cache are not supported. The pass runs with the highest thread count of all strategies.
+    The time of the whole pass is logged as offline_processing_and_save_time_s and shared_offline_time_s of every strategy, its offline_save_time_s only contains the writes of its own shards.
+
+    :param strategies: list(Strategy) - created from the same pipeline
+    :param sample_count: int
+    '''
+    for strategy in strategies:
+        strategy._apply_split_reordering()
+    pipeline = strategies[0]._pipeline
+    # every strategy has its own copy with schema inference or reordering
+    fingerprint = pipeline_fingerprint(pipeline)
+    if any(pipeline_fingerprint(strategy._pipeline) != fingerprint for strategy in strategies[1:]):
+        raise Exception("All strategies of a single pass need to be created from the same pipeline")
+    if any(strategy._vectorized_batch_size != None or strategy._fusion_planning or strategy._materialization_cache != None for strategy in strategies):
+        raise Exception("The single pass does not support vectorized_batch_size, fusion_planning or the materialization_cache")
+    if any(strategy._split_position == None or strategy._samples_per_record != 1 or strategy._materialization_ratio != 1 or strategy._memory_directory != None for strategy in strategies):
+        raise Exception("All strategies of a single pass need a split position, samples_per_record=1, materialization_ratio=1 and no memory tier")
+
+    for strategy in strategies:
+        if strategy._target_shard_size_MB != None:
+            strategy._update_auto_shard_count(sample_count)
+        if strategy._storage_dtype != "none" and strategy.meta_info["storage_max_abs_error"] == None:
+            strategy._probe_storage_error()
+
+    offline_pipeline = pipeline_helper.multi_split_offline_pipeline(pipeline
+                                                                  , [strategy._split_position for strategy in strategies]
+                                                                  , [strategy._offline_pipeline[-1] for strategy in strategies])
+    start = time.time()
+    offline_dataset = pipeline_helper.build_pipeline(offline_pipeline
+                                                   , compressed_parallelism=max(strategy._thread_count for strategy in strategies))
+    build_time_s = time.time() - start
+    save_times_s = pipeline_helper.save_ds_multi_parallel(offline_dataset.take(sample_count), [{
+        "shard_count": strategy._shard_count,
+        "shard_directory": strategy._shard_directory,
+        "compression_type": strategy._compression_type,
+        "compression_level": strategy._get_file_compression_level(),
+        "fixed_length": strategy._storage_format != "tfrecord",
+        "balance_bytes": strategy._byte_balanced_shards,
+        "indexed": strategy._indexed_shards
+    } for strategy in strategies])
+    end = time.time()
+
+    for strategy, save_time_s in zip(strategies, save_times_s):
+        strategy._set_materialized_directory(strategy._shard_directory)
+        strategy._materialized_offline_run = {
+            "offline_processing_and_save_time_s": end - start
+          , "offline_build_time_s": build_time_s
+          , "offline_save_time_s": save_time_s
+          , "shared_offline_time_s": end - start
+          , "materialization_cache_hit": False
+          , "shard_cum_size_MB": strategy._get_shard_cum_size_MB(strategy._shard_directory)
+          , "shard_memory_MB": 0
+          , "shard_sizes_MB": strategy._get_shard_sizes_MB(strategy._shard_directory)
+        }
@@ -41,6 +41,8 @@ else: # data_type == "float32"
         log_path = "/logs/float32/parallelism"
     elif pipeline_mod == "tf-computation":
         log_path = "/logs/float32/tensorflow"
+    elif pipeline_mod == "tf-vectorized-computation":
+        log_path = "/logs/float32/tensorflow-vectorized"
     elif pipeline_mod == "np-computation":
         log_path = "/logs/float32/numpy"
     else:
@@ -59,7 +61,7 @@ if pipeline_mod == "read-experiment" or pipeline_mod == "sys-caching-read" \
     type_pipeline_steps = list(range(len(type_pipeline)))
     # del type_pipeline_steps[1] # no need to profile creating the dataset
     del type_pipeline_steps[0] # no need to profile fully-online with a generated dataset from memory
-else: # pipeline_mod == 'tf-computation' or pipeline_mod == 'np-computation'
+else: # pipeline_mod == 'tf-computation', 'tf-vectorized-computation' or 'np-computation'
     from synthetic_pipeline_processing import pipeline_definition
     type_pipeline = pipeline_definition(shape=sample_shape
                                       , sample_count=sample_count
@@ -80,7 +82,8 @@ strategies = [ Strategy(
                 , thread_count = thread_count
                 , shard_directory_prefix = f"{target_path}/synthetic-split"
                 , compression_type = compression_type
-                , storage_type = storage_type)
+                , storage_type = storage_type
+                , vectorized_batch_size = 64 if pipeline_mod == "tf-vectorized-computation" else None)
              for thread_count, shard_count in thread_shard_counts
                  for step in type_pipeline_steps]
 
@@ -25,9 +25,14 @@ def pipeline_definition(shape, sample_count, data_type, computation_type):
         comp_fn = lambda signal: rms_tensorflow_fn_wrapped()(signal=signal, period_length=transform_period)
     elif computation_type == "tensorflow-for-loop-fn-wrapped":
         comp_fn = lambda signal: rms_tensorflow_for_loop_fn_wrapped()(signal=signal, period_length=transform_period)
+    elif computation_type == "tf-vectorized-computation":
+        comp_fn = lambda signal: rms_tensorflow_vectorized(signal=signal, period_length=transform_period)
     else: # computation_type == "tf-computation"
         comp_fn = lambda signal: rms_tensorflow(signal=signal, period_length=transform_period)
 
+    # the batch-aware computation and the identity can run on batches, see presto.pipeline.vectorize_pipeline
+    vectorized = computation_type == "tf-vectorized-computation"
+
     return [
         {
             "name": f"create-dataset-{computation_type}",
@@ -40,16 +45,18 @@ def pipeline_definition(shape, sample_count, data_type, computation_type):
             "name": f"apply-rms-{computation_type}",
             "type": "op",
             "op": comp_fn,
+            "vectorized": vectorized,
             "input_schema": tf.TensorSpec([None, shape[1]], dtype),
-            "output_schema": tf.TensorSpec([None, int((shape[0] * shape[1]) / 500)], dtype)
+            "output_schema": tf.TensorSpec([int((shape[0] * shape[1]) / 500)], tf.float32)
         },
 
         {
             "name": "identity",
             "type": "op",
             "op": tf.identity,
-            "input_schema": tf.TensorSpec([None, int((shape[0] * shape[1]) / 500)], dtype),
-            "output_schema": tf.TensorSpec([None, int((shape[0] * shape[1]) / 500)], dtype)
+            "vectorized": vectorized,
+            "input_schema": tf.TensorSpec([int((shape[0] * shape[1]) / 500)], tf.float32),
+            "output_schema": tf.TensorSpec([int((shape[0] * shape[1]) / 500)], tf.float32)
         },
     ]
 
@@ -102,6 +109,18 @@ def rms_tensorflow(signal, period_length):
     result = tf.map_fn(fn=rms_fn, elems=split_signal, fn_output_signature=tf.float32)
     return result
 
+def rms_tensorflow_vectorized(signal, period_length):
+    '''Same result as `rms_tensorflow`, but also works on a batch of signals
+    :param signal: tf.Tensor - [rows, columns] or [batch, rows, columns]
+    :param period_length: int
+    :return: flattened tensor per signal
+    '''
+    batch_shape = tf.shape(signal)[:-2]
+    # split every flattened signal into phase chunks, same as tf.split in rms_tensorflow
+    split_signal = tf.reshape(signal, tf.concat([batch_shape, [period_length, -1]], axis=0))
+    # rms over the chunks, tf.map_fn in rms_tensorflow unstacks the list of chunks element-wise
+    return tf.sqrt(tf.cast(tf.reduce_mean(tf.math.square(split_signal), axis=-2), dtype=tf.float32))
+
 def rms_tensorflow_fn_wrapped():
     '''
     :param signal: tf.Tensor
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import unittest
+
+from presto.analysis import StrategyAnalysis
+
+class AnalysisTest(unittest.TestCase):
+
+    def _analysis(self, rows):
+        cum_df = pd.DataFrame(rows)
+        cum_df["creation_timestamp"] = "2021-01-01-00:00:00"
+        return StrategyAnalysis(strategy_dataframes = []
+                              , dstat_dataframes = []
+                              , cum_df = cum_df
+                              , cum_dstat_df = pd.DataFrame())
+
+    def test_samples_per_record_summary(self):
+        analysis = self._analysis({
+            "split_name": ["2-a", "2-a", "2-a", "2-a"]
+          , "thread_count": [4, 4, 4, 4]
+          , "sample_count": [100, 100, 100, 100]
+          , "samples_per_record": [1, 1, 8, 8]
+          , "throughput_sps": [100.0, 120.0, 330.0, 330.0]
+          , "shard_cum_size_MB": [10.0, 10.0, 9.0, 9.0]
+        })
+
+        summary = analysis.samples_per_record_summary().set_index("samples_per_record")
+
+        self.assertAlmostEqual(summary.loc[1, "throughput_speedup"], 1.0)
+        self.assertAlmostEqual(summary.loc[8, "throughput_speedup"], 3.0)
+        self.assertAlmostEqual(summary.loc[8, "storage_savings"], 0.1)
+
+    def test_compression_summary(self):
+        analysis = self._analysis({
+            "split_name": ["2-a", "2-a", "2-a"]
+          , "thread_count": [4, 4, 4]
+          , "sample_count": [100, 100, 100]
+          , "compression_type": ["none", "ZSTD", "ZSTD"]
+          , "compression_level": [np.nan, np.nan, 19]
+          , "throughput_sps": [100.0, 80.0, 50.0]
+          , "shard_cum_size_MB": [10.0, 4.0, 2.0]
+        })
+
+        summary = analysis.compression_summary()
+        default_level = summary[(summary["compression_type"] == "ZSTD") & summary["compression_level"].isna()].iloc[0]
+        high_level = summary[summary["compression_level"] == 19].iloc[0]
+
+        self.assertEqual(len(summary), 3)
+        self.assertAlmostEqual(default_level["throughput_speedup"], 0.8)
+        self.assertAlmostEqual(default_level["storage_savings"], 0.6)
+        self.assertAlmostEqual(high_level["storage_savings"], 0.8)
+
+    def test_epoch_summary(self):
+        analysis = self._analysis({
+            "split_name": ["0-fully-online", "2-a", "3-b", "4-c"]
+          , "thread_count": [4, 4, 4, 4]
+          , "sample_count": [100, 100, 100, 100]
+          , "first_epoch_time_s": [10.0, 20.0, 8.0, 30.0]
+          , "steady_epoch_time_s": [10.0, 5.0, 9.0, 12.0]
+        })
+
+        summary = analysis.epoch_summary().set_index("strategy")
+
+        self.assertEqual(summary.loc["0-fully-online", "break_even_epochs"], 1)
+        # 20 + 5 * (n - 1) <= 10 + 10 * (n - 1) from n = 3
+        self.assertEqual(summary.loc["2-a", "break_even_epochs"], 3)
+        self.assertEqual(summary.loc["3-b", "break_even_epochs"], 1)
+        self.assertEqual(summary.loc["4-c", "break_even_epochs"], np.inf)
+
+    def test_precision_summary(self):
+        analysis = self._analysis({
+            "split_name": ["2-a", "2-a", "2-a"]
+          , "thread_count": [4, 4, 4]
+          , "sample_count": [100, 100, 100]
+          , "storage_dtype": ["none", "float16", "uint8"]
+          , "storage_range": [np.nan, np.nan, "(0.0, 1.0)"]
+          , "storage_max_abs_error": [np.nan, 0.001, 0.002]
+          , "throughput_sps": [100.0, 110.0, 120.0]
+          , "shard_cum_size_MB": [40.0, 20.0, 10.0]
+        })
+
+        summary = analysis.precision_summary().set_index("storage_dtype")
+
+        self.assertAlmostEqual(summary.loc["float16", "storage_savings"], 0.5)
+        self.assertAlmostEqual(summary.loc["uint8", "storage_savings"], 0.75)
+        self.assertAlmostEqual(summary.loc["uint8", "throughput_speedup"], 1.2)
+        self.assertAlmostEqual(summary.loc["uint8", "max_abs_error"], 0.002)
+        self.assertTrue(np.isnan(summary.loc["none", "max_abs_error"]))
+
+    def test_extrapolate_by_fit(self):
+        sample_counts = np.array([100, 100, 400, 400, 1600, 1600])
+        # the second run of every sample count reads from the page cache and skips the offline part
+        cold = np.array([True, False, True, False, True, False])
+        noise = np.array([0.1, -0.1, -0.1, 0.1, 0.1, -0.1])
+        analysis = self._analysis({
+            "split_name": ["1-a"] * 6
+          , "thread_count": [1] * 6
+          , "ueid": ["a"] * 6
+          , "runs_count": list(range(6))
+          , "system_cache_enabled": [True] * 6
+          , "sample_count": sample_counts
+          , "offline_processing_and_save_time_s": np.where(cold, 2 + 0.02 * sample_counts + noise, 0)
+          , "shard_cum_size_MB": np.where(cold, 0.1 * sample_counts, 0)
+          , "online_processing_time_s": np.where(cold, 1 + 0.01 * sample_counts, 1 + 0.005 * sample_counts) + noise
+        })
+
+        # 100000 samples with 10000MB of shards, half of them fit into the RAM
+        extrapolated = analysis.extrapolate_by_fit(total_dataset_size_GB = 10
+                                                 , average_sample_size_KB = 100
+                                                 , ram_GB = 5).set_index("metric")
+
+        self.assertAlmostEqual(extrapolated.loc["preprocessing_time_s", "prediction"], 2002, delta=10)
+        self.assertAlmostEqual(extrapolated.loc["storage_consumption_mb", "prediction"], 10000, delta=1)
+        self.assertAlmostEqual(extrapolated.loc["first_epoch_online_time_s", "prediction"], 1001, delta=5)
+        self.assertAlmostEqual(extrapolated.loc["epoch_online_time_s", "cached_fraction"], 0.5, delta=0.01)
+        self.assertAlmostEqual(extrapolated.loc["epoch_online_time_s", "prediction"], 751, delta=5)
+        throughput = extrapolated.loc["throughput_sps"]
+        self.assertTrue(throughput["ci_low"] < throughput["prediction"] < throughput["ci_high"])
+
+
+if __name__ == "__main__":
+    unittest.main()
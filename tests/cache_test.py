@@ -0,0 +1,81 @@
+import pathlib
+import tempfile
+import numpy as np
+import tensorflow as tf
+import unittest
+
+from presto.cache import MaterializationCache, pipeline_fingerprint
+
+def _offset(x):
+    return x + 1
+
+class CacheTest(unittest.TestCase):
+
+    def _spec(self, factor):
+        schema = tf.TensorSpec([], tf.int64)
+        return [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(10), "output_schema": schema},
+            {"name": "scale", "type": "op", "op": lambda x: x * factor, "input_schema": schema, "output_schema": schema},
+        ]
+
+    def _write_shards(self, directory, size_b):
+        pathlib.Path(directory).mkdir(exist_ok = True, parents = True)
+        with open(pathlib.Path(directory) / "shard-0.tfrecord", "wb") as shard_file:
+            shard_file.write(b"x" * size_b)
+        return directory
+
+    def test_pipeline_fingerprint(self):
+        spec = self._spec(2)
+        self.assertEqual(pipeline_fingerprint(spec), pipeline_fingerprint(list(spec)))
+        # same code and closure
+        self.assertEqual(pipeline_fingerprint(spec), pipeline_fingerprint([spec[0], self._spec(2)[1]]))
+        # other closure
+        self.assertNotEqual(pipeline_fingerprint(spec), pipeline_fingerprint([spec[0], self._spec(3)[1]]))
+        # other source
+        self.assertNotEqual(pipeline_fingerprint(spec), pipeline_fingerprint([{**spec[0], "op": tf.data.Dataset.range(11)}, spec[1]]))
+
+    def test_pipeline_fingerprint_globals_and_arrays(self):
+        step = {"name": "offset", "type": "op", "op": lambda x: _offset(x)}
+        fingerprint = pipeline_fingerprint([step])
+        # the helper that the op calls changes
+        self.addCleanup(globals().__setitem__, "_offset", _offset)
+        globals()["_offset"] = lambda x: x + 2
+        self.assertNotEqual(pipeline_fingerprint([step]), fingerprint)
+
+        # `repr` of both arrays is the same
+        def weighted(weights):
+            return {"name": "weighted", "type": "op", "op": lambda x: x * weights}
+        weights = np.zeros(10000)
+        other_weights = weights.copy()
+        other_weights[5000] = 1
+        self.assertEqual(repr(weights), repr(other_weights))
+        self.assertNotEqual(pipeline_fingerprint([weighted(weights)]), pipeline_fingerprint([weighted(other_weights)]))
+        self.assertEqual(pipeline_fingerprint([weighted(weights)]), pipeline_fingerprint([weighted(weights.copy())]))
+
+    def test_lookup_and_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = MaterializationCache(directory + "/cache", byte_budget=250)
+            keys = [cache.entry_key(self._spec(2), sample_count=sample_count) for sample_count in [10, 20, 30]]
+            self.assertEqual(len(set(keys)), 3)
+            self.assertIsNone(cache.lookup(keys[0]))
+
+            entry_directory = cache.insert(keys[0], self._write_shards(directory + "/a/", 100))
+            self.assertEqual(cache.lookup(keys[0]), entry_directory)
+            self.assertTrue((pathlib.Path(entry_directory) / "shard-0.tfrecord").exists())
+
+            cache.insert(keys[1], self._write_shards(directory + "/b/", 100))
+            # the first entry is used more recently than the second one
+            cache.lookup(keys[0])
+            cache.insert(keys[2], self._write_shards(directory + "/c/", 100))
+
+            self.assertIsNotNone(cache.lookup(keys[0]))
+            self.assertIsNone(cache.lookup(keys[1]))
+            self.assertIsNotNone(cache.lookup(keys[2]))
+            self.assertEqual(cache.size_b(), 200)
+
+            # bigger than the whole budget
+            self.assertIsNone(cache.insert("too-big", self._write_shards(directory + "/d/", 300)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import zlib
+import unittest
+import tensorflow as tf
+
+from presto import codecs
+
+class CodecsTest(unittest.TestCase):
+
+    def test_record_codec_roundtrip(self):
+        record = tf.constant(b"presto" * 100)
+        compressed = codecs.record_compressor("DEFLATE", 9)(record)
+
+        self.assertEqual(compressed.shape, tf.TensorShape([]))
+        self.assertLess(len(compressed.numpy()), len(record.numpy()))
+        self.assertEqual(zlib.decompress(compressed.numpy()), record.numpy())
+        self.assertEqual(codecs.record_decompressor("DEFLATE")(compressed).numpy(), record.numpy())
+
+    def test_compression_types(self):
+        self.assertListEqual(codecs.compression_types()[:3], ["none", "GZIP", "ZLIB"])
+        self.assertTrue(codecs.is_record_codec("ZSTD"))
+        self.assertFalse(codecs.is_record_codec("GZIP"))
+        self.assertEqual(codecs.level_range("GZIP"), (0, 9))
+        self.assertEqual(codecs.level_range("SNAPPY"), None)
+        self.assertEqual(codecs.missing_module("DEFLATE"), None)
+
+    def test_register_codec(self):
+        codecs.register_codec("REVERSE", lambda data, level: data[::-1], lambda data: data[::-1], module="presto_missing_module")
+        self.addCleanup(codecs._RECORD_CODECS.pop, "REVERSE")
+        self.assertIn("REVERSE", codecs.compression_types())
+        self.assertEqual(codecs.missing_module("REVERSE"), "presto_missing_module")
+        self.assertEqual(codecs.record_compressor("REVERSE")(tf.constant(b"abc")).numpy(), b"cba")
+        with self.assertRaises(Exception):
+            codecs.register_codec("GZIP", lambda data, level: data, lambda data: data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,10 @@
+import glob
+import tempfile
+import threading
 import numpy as np
 import tensorflow as tf
 import unittest
+import unittest.mock
 
 from presto import pipeline
 
@@ -80,6 +84,561 @@ class PipelineTest(unittest.TestCase):
         for i in ds:
             print(i)
 
+    def test_tensor_singleton(self):
+        data = tf.random.uniform((3, 3), dtype=tf.int32, maxval=10)
+        schema = tf.TensorSpec([3, 3], tf.int32)
+
+        serialized = pipeline.tensor_serializer(schema)(data)
+        deserialized = pipeline.tensor_deserializer(schema)(serialized)
+
+        np.testing.assert_allclose(data, deserialized)
+
+    def test_tensor_singleton_string(self):
+        data = tf.constant(b"deadbeef")
+        schema = tf.TensorSpec((), tf.string)
+
+        serialized = pipeline.tensor_serializer(schema)(data)
+        deserialized = pipeline.tensor_deserializer(schema)(serialized)
+
+        self.assertEqual(data, deserialized)
+
+    def test_tensor_structured(self):
+        data = dict(
+            d1=tf.random.uniform((3, 3), dtype=tf.int32, maxval=10),
+            d2=tf.random.uniform((4,), dtype=tf.float32),
+            d3=tf.constant(b"deadbeef", dtype=tf.string)
+        )
+        schema = dict(
+            d1=tf.TensorSpec((3, 3), dtype=tf.int32),
+            d2=tf.TensorSpec((4,), dtype=tf.float32),
+            d3=tf.TensorSpec((), dtype=tf.string)
+        )
+
+        serialized = pipeline.tensor_serializer(schema)(data)
+        deserialized = pipeline.tensor_deserializer(schema)(serialized)
+
+        self.assertSetEqual(set(data.keys()), set(deserialized.keys()))
+        np.testing.assert_array_almost_equal(data["d1"], deserialized["d1"])
+        np.testing.assert_array_almost_equal(data["d2"], deserialized["d2"])
+        self.assertEqual(data["d3"], deserialized["d3"])
+
+    def test_tensor_ds_without_py_function(self):
+        schema = {
+            "a": tf.TensorSpec((2, 2), tf.int32),
+            "b": tf.TensorSpec((None, 3), tf.float32),
+            "c": tf.TensorSpec((), tf.string)
+        }
+
+        graph = tf.function(pipeline.tensor_serializer(schema)).get_concrete_function(schema).graph
+        op_types = [op.type for op in graph.get_operations()]
+        self.assertNotIn("EagerPyFunc", op_types)
+
+        ds = tf.data.Dataset.range(3).map(lambda i: dict(
+            a=tf.eye(2, dtype=tf.int32) * tf.cast(i, tf.int32),
+            b=tf.ones((i + 1, 3), tf.float32),
+            c=tf.constant(b"deadbeef")))
+        ds = ds.map(pipeline.tensor_serializer(schema), num_parallel_calls=2)
+        ds = ds.map(pipeline.tensor_deserializer(schema))
+
+        self.assertEqual(ds.element_spec["b"].shape.as_list(), [None, 3])
+        for i, sample in enumerate(ds):
+            np.testing.assert_array_equal(sample["a"], np.eye(2) * i)
+            self.assertEqual(sample["b"].shape, (i + 1, 3))
+            self.assertEqual(sample["c"], b"deadbeef")
+
+    def test_raw_singleton(self):
+        data = tf.random.uniform((224, 224, 3), dtype=tf.float32)
+        schema = tf.TensorSpec([224, 224, 3], tf.float32)
+
+        serialized = pipeline.raw_serializer(schema)(data)
+        deserialized = pipeline.raw_deserializer(schema)(serialized)
+
+        # no header for fully static schemas
+        self.assertEqual(len(serialized.numpy()), 224 * 224 * 3 * 4)
+        np.testing.assert_array_equal(data, deserialized)
+
+    def test_raw_dynamic_shape(self):
+        data = tf.random.uniform((7, 80), dtype=tf.float64)
+        schema = tf.TensorSpec([None, 80], tf.float64)
+
+        serialized = pipeline.raw_serializer(schema)(data)
+        deserialized = pipeline.raw_deserializer(schema)(serialized)
+
+        np.testing.assert_array_equal(data, deserialized)
+
+    def test_raw_singleton_string(self):
+        data = tf.constant(b"deadbeef")
+        schema = tf.TensorSpec((), tf.string)
+
+        serialized = pipeline.raw_serializer(schema)(data)
+        deserialized = pipeline.raw_deserializer(schema)(serialized)
+
+        self.assertEqual(data, deserialized)
+
+    def test_raw_structured(self):
+        data = dict(
+            d1=tf.random.uniform((3, 3), dtype=tf.int32, maxval=10),
+            d2=tf.random.uniform((5,), dtype=tf.float32),
+            d3=tf.constant(b"deadbeef", dtype=tf.string),
+            d4=tf.constant([b"a", b"bc"], dtype=tf.string),
+            d5=tf.constant(3, dtype=tf.int64)
+        )
+        schema = dict(
+            d1=tf.TensorSpec((3, 3), dtype=tf.int32),
+            d2=tf.TensorSpec((None,), dtype=tf.float32),
+            d3=tf.TensorSpec((), dtype=tf.string),
+            d4=tf.TensorSpec((None,), dtype=tf.string),
+            d5=tf.TensorSpec((), dtype=tf.int64)
+        )
+
+        serialized = pipeline.raw_serializer(schema)(data)
+        deserialized = pipeline.raw_deserializer(schema)(serialized)
+
+        self.assertSetEqual(set(data.keys()), set(deserialized.keys()))
+        for key in ["d1", "d2", "d4", "d5"]:
+            np.testing.assert_array_equal(data[key], deserialized[key])
+        self.assertEqual(data["d3"], deserialized["d3"])
+
+    def test_raw_ds(self):
+        schema = tf.TensorSpec((None, 3), tf.uint8)
+
+        ds = tf.data.Dataset.range(1, 4).map(lambda i: tf.ones((i, 3), tf.uint8) * tf.cast(i, tf.uint8))
+        ds = ds.map(pipeline.raw_serializer(schema))
+        ds = ds.map(pipeline.raw_deserializer(schema))
+
+        self.assertEqual(ds.element_spec.shape.as_list(), [None, 3])
+        for i, sample in enumerate(ds, start=1):
+            np.testing.assert_array_equal(sample, np.ones((i, 3)) * i)
+
+    def test_serialized_split_format(self):
+        spec = [
+            {
+                "name": "source",
+                "type": "source",
+                "op": tf.data.Dataset.range(4),
+                "output_schema": tf.TensorSpec([], tf.int64)
+            },
+            {
+                "name": "square",
+                "type": "op",
+                "op": lambda x: x * x,
+                "input_schema": tf.TensorSpec([], tf.int64),
+                "output_schema": tf.TensorSpec([], tf.int64)
+            },
+        ]
+        offline, online = pipeline.serialized_split(spec, 2, serialization_format="tensor")
+        serialized = pipeline.build_pipeline(offline)
+        online.insert(0, {"name": "load", "type": "source", "op": serialized})
+        restored = pipeline.build_pipeline(online)
+
+        self.assertListEqual([int(x) for x in restored], [0, 1, 4, 9])
+        with self.assertRaises(Exception):
+            pipeline.serialized_split(spec, 2, serialization_format="unknown")
+
+        offline, online = pipeline.serialized_split(spec, 2, serialization_format="tensor", record_codec="DEFLATE", codec_level=1)
+        serialized = pipeline.build_pipeline(offline)
+        online.insert(0, {"name": "load", "type": "source", "op": serialized})
+        self.assertListEqual([int(x) for x in pipeline.build_pipeline(online)], [0, 1, 4, 9])
+        with self.assertRaises(Exception):
+            pipeline.serialized_split(spec, 2, record_codec="GZIP")
+
+    def test_serialized_split_samples_per_record(self):
+        spec = [
+            {
+                "name": "source",
+                "type": "source",
+                "op": tf.data.Dataset.range(7),
+                "output_schema": tf.TensorSpec([], tf.int64)
+            },
+            {
+                "name": "to vector",
+                "type": "op",
+                "op": lambda x: tf.fill([3], x),
+                "input_schema": tf.TensorSpec([], tf.int64),
+                "output_schema": tf.TensorSpec([3], tf.int64)
+            },
+        ]
+        for serialization_format in pipeline.serialization_formats():
+            offline, online = pipeline.serialized_split(spec, 2
+                                                      , serialization_format=serialization_format
+                                                      , samples_per_record=3)
+            records = list(pipeline.build_pipeline(offline))
+            self.assertEqual(len(records), 3)
+
+            online.insert(0, {"name": "load", "type": "source", "op": tf.data.Dataset.from_tensor_slices(records)})
+            restored = pipeline.build_pipeline(online)
+
+            np.testing.assert_array_equal(np.stack(list(restored)), np.repeat(np.arange(7), 3).reshape(7, 3))
+
+    def test_serialized_split_storage_dtype(self):
+        spec = [
+            {
+                "name": "source",
+                "type": "source",
+                "op": tf.data.Dataset.range(6),
+                "output_schema": tf.TensorSpec([], tf.int64)
+            },
+            {
+                "name": "features",
+                "type": "op",
+                "op": lambda x: {"pixels": tf.fill([4], tf.cast(x, tf.float32) / 4), "label": x},
+                "input_schema": tf.TensorSpec([], tf.int64),
+                "output_schema": {"pixels": tf.TensorSpec([4], tf.float32), "label": tf.TensorSpec([], tf.int64)}
+            },
+        ]
+        for serialization_format in pipeline.serialization_formats():
+            offline, online = pipeline.serialized_split(spec, 2
+                                                      , serialization_format=serialization_format
+                                                      , storage_dtype="uint8"
+                                                      , storage_range=(0.0, 1.0))
+            online.insert(0, {"name": "load", "type": "source", "op": pipeline.build_pipeline(offline)})
+            restored = list(pipeline.build_pipeline(online))
+
+            self.assertEqual(restored[0]["pixels"].dtype, tf.float32)
+            self.assertListEqual([int(x["label"]) for x in restored], [0, 1, 2, 3, 4, 5])
+            # the value 1.25 is clipped to the range
+            np.testing.assert_allclose(np.stack([x["pixels"] for x in restored]), np.minimum(np.repeat(np.arange(6) / 4, 4).reshape(6, 4), 1.0), atol=1 / 255)
+
+        samples = pipeline.build_pipeline(spec)
+        self.assertLessEqual(pipeline.max_abs_error(samples.take(4), "float16"), 1e-3)
+        self.assertAlmostEqual(pipeline.max_abs_error(samples, "uint8", (0.0, 1.0)), 0.25, places=5)
+        self.assertEqual(pipeline.stored_schema(spec[1]["output_schema"], "bfloat16")["pixels"].dtype, tf.bfloat16)
+        with self.assertRaises(Exception):
+            pipeline.serialized_split(spec, 2, storage_dtype="int16")
+
+    def _dataset_op_types(self, ds):
+        graph_def = tf.compat.v1.GraphDef()
+        graph_def.ParseFromString(ds._as_serialized_graph().numpy())
+        return [node.op for node in graph_def.node]
+
+    def test_build_pipeline_step_settings(self):
+        schema = tf.TensorSpec([], tf.int64)
+        spec = [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(10), "output_schema": schema},
+            {"name": "read", "type": "op", "op": lambda x: x + 1, "input_schema": schema, "output_schema": schema
+           , "parallelism": tf.data.AUTOTUNE, "prefetch": 4},
+            {"name": "decode", "type": "op", "op": lambda x: x * 2, "input_schema": schema, "output_schema": schema
+           , "parallelism": 2, "deterministic": True},
+            {"name": "scale", "type": "op", "op": lambda x: x - 1, "input_schema": schema, "output_schema": schema
+           , "parallelism": 2, "deterministic": True},
+        ]
+
+        ds = pipeline.build_pipeline(spec, compressed_parallelism=8)
+        op_types = self._dataset_op_types(ds)
+
+        # "read" is not fused with "decode > scale"
+        self.assertEqual(op_types.count("ParallelMapDatasetV2"), 2)
+        self.assertEqual(op_types.count("PrefetchDataset"), 1)
+        self.assertListEqual([int(x) for x in ds], [(i + 1) * 2 - 1 for i in range(10)])
+
+    def test_vectorize_pipeline(self):
+        schema = tf.TensorSpec([4], tf.float32)
+        source = tf.data.Dataset.range(10).map(lambda x: tf.cast(tf.range(x, x + 4), tf.float32))
+        spec = [
+            {"name": "source", "type": "source", "op": source, "output_schema": schema},
+            {"name": "square", "type": "op", "op": tf.math.square, "input_schema": schema, "output_schema": schema
+           , "vectorized": True},
+            {"name": "sqrt", "type": "op", "op": tf.math.sqrt, "input_schema": schema, "output_schema": schema
+           , "vectorized": True},
+            {"name": "sum", "type": "op", "op": tf.reduce_sum, "input_schema": schema, "output_schema": tf.TensorSpec([], tf.float32)},
+        ]
+
+        vectorized = pipeline.vectorize_pipeline(spec, 3)
+        self.assertListEqual([step["type"] for step in vectorized], ["source", "ds_transform", "op+unbatch", "op"])
+
+        expected = [float(x) for x in pipeline.build_pipeline(spec)]
+        # 10 samples in batches of 3, the last batch is smaller
+        results = [float(x) for x in pipeline.build_pipeline(spec, vectorized_batch_size=3)]
+        self.assertListEqual(results, expected)
+
+    def test_build_pipeline_cache(self):
+        schema = tf.TensorSpec([], tf.int64)
+        spec = [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(10), "output_schema": schema},
+            {"name": "increment", "type": "op", "op": lambda x: x + 1, "input_schema": schema, "output_schema": schema},
+            {"name": "double", "type": "op", "op": lambda x: x * 2, "input_schema": schema, "output_schema": schema},
+        ]
+        pipeline.clear_pipeline_cache()
+
+        ds = pipeline.build_pipeline(spec, compressed_parallelism=2, cache=True)
+        self.assertIs(pipeline.build_pipeline(list(spec), compressed_parallelism=2, cache=True), ds)
+        self.assertIsNot(pipeline.build_pipeline(spec, compressed_parallelism=2), ds)
+
+        # other options build a new dataset, but reuse the traced map stage
+        other_ds = pipeline.build_pipeline(spec, compressed_parallelism=1, cache=True)
+        self.assertIsNot(other_ds, ds)
+        self.assertEqual(len(pipeline._TRACED_MAPPERS), 1)
+        self.assertListEqual([int(x) for x in other_ds], [(i + 1) * 2 for i in range(10)])
+
+        # recreated ops are identified by their "cache_key"
+        recreated = [spec[0], {**spec[1], "op": lambda x: x + 1, "cache_key": "increment"}, spec[2]]
+        recreated_ds = pipeline.build_pipeline(recreated, compressed_parallelism=2, cache=True)
+        self.assertIsNot(recreated_ds, ds)
+        recreated[1] = {**recreated[1], "op": lambda x: x + 1}
+        self.assertIs(pipeline.build_pipeline(recreated, compressed_parallelism=2, cache=True), recreated_ds)
+
+        pipeline.clear_pipeline_cache()
+        self.assertIsNot(pipeline.build_pipeline(spec, compressed_parallelism=2, cache=True), ds)
+
+        # the least recently used datasets are dropped
+        first_ds = pipeline.build_pipeline(spec, compressed_parallelism=1, cache=True)
+        for parallelism in range(2, pipeline._PIPELINE_CACHE_SIZE + 2):
+            pipeline.build_pipeline(spec, compressed_parallelism=parallelism, cache=True)
+        self.assertEqual(len(pipeline._BUILT_PIPELINES), pipeline._PIPELINE_CACHE_SIZE)
+        self.assertIsNot(pipeline.build_pipeline(spec, compressed_parallelism=1, cache=True), first_ds)
+        pipeline.clear_pipeline_cache()
+
+    def test_refine_schemas(self):
+        spec = [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(4).map(lambda i: tf.fill([i + 1, 8, 3], tf.cast(i, tf.uint8)))
+           , "output_schema": tf.TensorSpec([None, 8, 3], tf.uint8)},
+            {"name": "greyscale", "type": "op", "op": tf.image.rgb_to_grayscale
+           , "input_schema": tf.TensorSpec([None, 8, 3], tf.uint8), "output_schema": tf.TensorSpec([None, None, 1], tf.uint8)},
+            {"name": "first row", "type": "op", "op": lambda x: x[0]
+           , "input_schema": tf.TensorSpec([None, None, 1], tf.uint8), "output_schema": tf.TensorSpec([None, 1], tf.uint8)},
+        ]
+
+        refined = pipeline.refine_schemas(spec)
+        self.assertEqual(refined[1]["output_schema"], tf.TensorSpec([None, 8, 1], tf.uint8))
+        self.assertEqual(refined[2]["input_schema"], tf.TensorSpec([None, 8, 1], tf.uint8))
+        self.assertEqual(refined[2]["output_schema"], tf.TensorSpec([8, 1], tf.uint8))
+        # the declared schemas are not changed
+        self.assertEqual(spec[2]["output_schema"], tf.TensorSpec([None, 1], tf.uint8))
+
+        # static shapes at the split need no header in the raw format
+        offline, _ = pipeline.serialized_split(refined, 3, serialization_format="raw")
+        record = next(iter(pipeline.build_pipeline(offline)))
+        self.assertEqual(len(record.numpy()), 8)
+
+    def test_verify_pipeline_inferred_schemas(self):
+        spec = [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(4).map(lambda i: tf.zeros([4, 4, 3], tf.uint8))
+           , "output_schema": tf.TensorSpec([4, 4, 3], tf.uint8)},
+            {"name": "center", "type": "op", "op": lambda x: tf.cast(x, tf.float32) / 127.5 - 1.0
+           , "input_schema": tf.TensorSpec([4, 4, 3], tf.uint8), "output_schema": tf.TensorSpec([4, 4, 3], tf.uint8)},
+        ]
+
+        # the declared schemas match each other, but not the op
+        pipeline.verify_pipeline(spec)
+        with self.assertRaisesRegex(Exception, "output of center"):
+            pipeline.verify_pipeline(spec, infer_schemas=True)
+
+    def test_save_ds_parallel(self):
+        ds = tf.data.Dataset.range(10).map(lambda x: tf.strings.as_string(x))
+
+        with tempfile.TemporaryDirectory() as shard_directory:
+            pipeline.save_ds_parallel(ds, 3, shard_directory, "GZIP")
+
+            shards = sorted(glob.glob(shard_directory + "/*.tfrecord"))
+            self.assertEqual(len(shards), 3)
+            # round-robin assignment, record i is in shard i % 3
+            first_shard = [int(r) for r in tf.data.TFRecordDataset(shards[0], compression_type="GZIP")]
+            self.assertListEqual(first_shard, [0, 3, 6, 9])
+            records = [int(r) for r in tf.data.TFRecordDataset(shards, compression_type="GZIP")]
+            self.assertListEqual(sorted(records), list(range(10)))
+
+    def test_save_ds_parallel_stops_after_writer_failure(self):
+        pulled = []
+        def records():
+            for i in range(10000):
+                pulled.append(i)
+                # the second record has another size than the first one
+                yield (b"x" * (1 + min(i, 1)),)
+
+        with tempfile.TemporaryDirectory() as shard_directory:
+            with self.assertRaises(Exception):
+                pipeline._save_records_parallel(records(), [{"shard_count": 1, "shard_directory": shard_directory, "compression_type": "", "fixed_length": True}])
+        self.assertLess(len(pulled), 10000)
+
+    def test_save_ds_parallel_writer_failure_after_last_record(self):
+        ds = tf.data.Dataset.range(10).map(lambda x: tf.strings.as_string(x))
+
+        # sealing fails after the writers took their sentinels, the error has to be raised instead of waiting for more records
+        with tempfile.TemporaryDirectory() as shard_directory, \
+             unittest.mock.patch.object(pipeline.os, "replace", side_effect=OSError("no space left on device")):
+            with self.assertRaises(OSError):
+                pipeline.save_ds_parallel(ds, 3, shard_directory, "", records_per_shard=4)
+
+    def test_balance_bytes(self):
+        # one big record followed by small ones
+        ds = tf.data.Dataset.from_tensor_slices([b"x" * 100] + [b"y" * 10] * 20)
+
+        with tempfile.TemporaryDirectory() as shard_directory:
+            pipeline.save_ds_parallel(ds, 2, shard_directory, "", balance_bytes=True)
+
+            shard_sizes_b = [sum(len(r) for r in tf.data.TFRecordDataset(shard_directory + f"/shard-{i}.tfrecord").as_numpy_iterator())
+                             for i in range(2)]
+            self.assertListEqual(shard_sizes_b, [150, 150])
+        with self.assertRaises(Exception):
+            pipeline.save_ds_parallel(ds, 2, shard_directory, "", records_per_shard=4, balance_bytes=True)
+
+    def test_auto_shard_count(self):
+        ds = tf.data.Dataset.from_tensor_slices([b"x" * 10, b"x" * 30])
+
+        self.assertEqual(pipeline.mean_record_size_b(ds), 20)
+        # 1000 records of 20B are 4 shards of 5KB, rounded up to a multiple of the 3 readers
+        self.assertEqual(pipeline.auto_shard_count(1000, 20, 5000, 3), 6)
+        self.assertEqual(pipeline.auto_shard_count(10, 20, 5000, 3), 3)
+
+    def test_sealed_shards(self):
+        ds = tf.data.Dataset.range(10).map(lambda x: tf.strings.as_string(x))
+
+        with tempfile.TemporaryDirectory() as shard_directory:
+            writing_done = threading.Event()
+            def write_shards():
+                try:
+                    pipeline.save_ds_parallel(ds, 3, shard_directory, "", records_per_shard=4)
+                finally:
+                    writing_done.set()
+            writer = threading.Thread(target=write_shards)
+            writer.start()
+            # reads the shards while they are written
+            records = [int(r) for r in pipeline.sealed_shards_dataset(shard_directory, 3, "", writing_done)]
+            writer.join()
+
+            self.assertListEqual(records, list(range(10)))
+            parallel_records = [int(r) for r in pipeline.sealed_shards_dataset(shard_directory, 3, "", writing_done, num_parallel_reads=2)]
+            self.assertListEqual(sorted(parallel_records), list(range(10)))
+            # blocks of records, the last shard takes the rest
+            last_shard = [int(r) for r in tf.data.TFRecordDataset(shard_directory + "/shard-2.tfrecord")]
+            self.assertListEqual(last_shard, [8, 9])
+            self.assertListEqual(glob.glob(shard_directory + "/*.partial"), [])
+
+    def test_spill_shards(self):
+        # one byte per record
+        ds = tf.data.Dataset.range(10).map(lambda x: tf.strings.as_string(x))
+
+        with tempfile.TemporaryDirectory() as memory_directory, tempfile.TemporaryDirectory() as spill_directory:
+            pipeline.save_ds_parallel(ds, 2, memory_directory, "", spill_directory=spill_directory, byte_budget=4)
+
+            def read(directory):
+                return [int(r) for r in tf.data.TFRecordDataset(sorted(glob.glob(directory + "/*.tfrecord")))]
+            # the budget is shared by both shards
+            self.assertEqual(len(read(memory_directory)), 4)
+            self.assertEqual(len(read(spill_directory)), 6)
+            self.assertListEqual(sorted(read(memory_directory) + read(spill_directory)), list(range(10)))
+            # the offset indices are only written for indexed shards
+            self.assertListEqual(glob.glob(memory_directory + "/*.index"), [])
+
+    def test_indexed_shards(self):
+        # trailing null bytes have to survive the read by offset
+        ds = tf.data.Dataset.range(30).map(lambda x: tf.strings.as_string(x) + "\x00")
+
+        with tempfile.TemporaryDirectory() as memory_directory, tempfile.TemporaryDirectory() as spill_directory:
+            pipeline.save_ds_parallel(ds, 3, memory_directory, "", spill_directory=spill_directory, byte_budget=40, indexed=True)
+            manifests = [pipeline.load_tfrecord_manifest(directory) for directory in [memory_directory, spill_directory]]
+            self.assertEqual(sum(manifest["record_count"] for manifest in manifests), 30)
+
+            def read(**kwargs):
+                return [int(r[:-1]) for r in pipeline.indexed_shards_dataset([memory_directory, spill_directory], **kwargs).as_numpy_iterator()]
+            self.assertListEqual(sorted(read()), list(range(30)))
+            shuffled = read(shuffle_seed=7)
+            self.assertListEqual(sorted(shuffled), list(range(30)))
+            self.assertNotEqual(shuffled, read(shuffle_seed=8))
+            # the workers split the same global order
+            worker_records = [read(shuffle_seed=7, worker_count=4, worker_index=i, num_parallel_reads=2) for i in range(4)]
+            self.assertListEqual(sum(worker_records, []), shuffled)
+            # every epoch has its own order
+            dataset = pipeline.indexed_shards_dataset([memory_directory, spill_directory], shuffle_seed=7)
+            epochs = [[int(r[:-1]) for r in dataset.as_numpy_iterator()] for _ in range(2)]
+            self.assertListEqual(epochs[0], shuffled)
+            self.assertListEqual(sorted(epochs[1]), list(range(30)))
+            self.assertNotEqual(epochs[1], shuffled)
+
+            dataset = pipeline.indexed_shards_dataset([memory_directory], worker_count=2, worker_index=1)
+            self.assertEqual(int(dataset.cardinality()), manifests[0]["record_count"] - manifests[0]["record_count"] // 2)
+
+    def test_select_materialized(self):
+        schema = tf.TensorSpec([], tf.string)
+        source = tf.data.Dataset.range(1000).map(lambda x: tf.strings.as_string(x))
+        spec = [
+            {"name": "source", "type": "source", "op": source, "output_schema": schema},
+            {"name": "append", "type": "op", "op": lambda x: x + "!", "input_schema": schema, "output_schema": schema},
+        ]
+
+        materialized = pipeline.build_pipeline(pipeline.select_materialized(spec, 0.25, materialized=True))
+        computed = pipeline.build_pipeline(pipeline.select_materialized(spec, 0.25, materialized=False))
+        materialized_samples = set(materialized.as_numpy_iterator())
+        computed_samples = set(computed.as_numpy_iterator())
+        self.assertSetEqual(materialized_samples & computed_samples, set())
+        self.assertEqual(len(materialized_samples | computed_samples), 1000)
+        self.assertAlmostEqual(len(materialized_samples), 250, delta=50)
+
+        # the selection does not depend on the order of the source
+        shuffled_spec = [{**spec[0], "op": source.shuffle(1000, seed=1)}] + spec[1:]
+        shuffled = pipeline.build_pipeline(pipeline.select_materialized(shuffled_spec, 0.25, materialized=True))
+        self.assertSetEqual(set(shuffled.as_numpy_iterator()), materialized_samples)
+
+        merged = list(pipeline.merge_materialized(materialized, computed, 0.25).as_numpy_iterator())
+        self.assertListEqual(sorted(merged), sorted(materialized_samples | computed_samples))
+
+    def test_multi_split_offline_pipeline(self):
+        schema = tf.TensorSpec([], tf.int64)
+        spec = [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(10), "output_schema": schema},
+            {"name": "increment", "type": "op", "op": lambda x: x + 1, "input_schema": schema, "output_schema": schema},
+            {"name": "double", "type": "op", "op": lambda x: x * 2, "input_schema": schema, "output_schema": schema},
+        ]
+        positions = [1, 3, 2]
+        splits = [pipeline.serialized_split(spec, position, serialization_format=serialization_format)
+                  for position, serialization_format in zip(positions, ["example", "raw", "tensor"])]
+
+        offline_pipeline = pipeline.multi_split_offline_pipeline(spec, positions, [offline[-1] for offline, _ in splits])
+        self.assertListEqual([step["name"] for step in offline_pipeline], ["source", "serialize at 1, 3, 2"])
+
+        with tempfile.TemporaryDirectory() as shard_directory:
+            shard_specs = [{"shard_count": shard_count, "shard_directory": f"{shard_directory}/{position}", "compression_type": ""}
+                           for position, shard_count in zip(positions, [1, 2, 3])]
+            save_times_s = pipeline.save_ds_multi_parallel(pipeline.build_pipeline(offline_pipeline), shard_specs)
+            self.assertEqual(len(save_times_s), 3)
+
+            # every online part finishes the pipeline from its own shards
+            for shard_spec, (_, online) in zip(shard_specs, splits):
+                shards = sorted(glob.glob(shard_spec["shard_directory"] + "/*.tfrecord"))
+                self.assertEqual(len(shards), shard_spec["shard_count"])
+                source = {"name": "load", "type": "source", "op": tf.data.TFRecordDataset(shards)}
+                samples = [int(x) for x in pipeline.build_pipeline([source] + online)]
+                self.assertListEqual(sorted(samples), [(i + 1) * 2 for i in range(10)])
+
+    def test_fixed_length_shards(self):
+        schema = {"a": tf.TensorSpec([2, 3], tf.float64), "b": tf.TensorSpec([], tf.int32)}
+        ds = tf.data.Dataset.range(10).map(lambda i: {"a": tf.fill([2, 3], tf.cast(i, tf.float64)), "b": tf.cast(i, tf.int32)})
+
+        with tempfile.TemporaryDirectory() as shard_directory:
+            pipeline.save_ds_parallel(ds.map(pipeline.raw_serializer(schema)), 3, shard_directory, "", fixed_length=True)
+
+            index = pipeline.load_fixed_length_index(shard_directory)
+            self.assertEqual(index["record_bytes"], 2 * 3 * 8 + 4)
+            self.assertListEqual([shard["record_count"] for shard in index["shards"]], [4, 3, 3])
+            self.assertEqual(pipeline.fixed_record_dtype(schema).itemsize, index["record_bytes"])
+
+            records = pipeline.fixed_length_shards_dataset(shard_directory, num_parallel_reads=2)
+            samples = list(records.map(pipeline.raw_deserializer(schema)))
+            self.assertListEqual(sorted(int(sample["b"]) for sample in samples), list(range(10)))
+
+            samples = list(pipeline.memmap_shards_dataset(shard_directory, schema, num_parallel_reads=2))
+            self.assertListEqual(sorted(int(sample["b"]) for sample in samples), list(range(10)))
+            for sample in samples:
+                np.testing.assert_array_equal(sample["a"], np.full([2, 3], int(sample["b"])))
+
+            # shards of several slices
+            with unittest.mock.patch.object(pipeline, "_MEMMAP_SLICE_RECORDS", 2):
+                samples = list(pipeline.memmap_shards_dataset(shard_directory, schema))
+            self.assertListEqual(sorted(int(sample["b"]) for sample in samples), list(range(10)))
+
+            # the first shard holds the records 0, 3, 6 and 9
+            first_shard = pipeline.memmap_shards(shard_directory, schema)[0]
+            np.testing.assert_array_equal(first_shard["b"], [0, 3, 6, 9])
+
+    def test_fixed_length_shards_need_static_schema(self):
+        with self.assertRaises(Exception):
+            pipeline.fixed_record_dtype(tf.TensorSpec([None, 3], tf.float32))
+
+    def test_graph_sink(self):
+        ds = tf.data.Dataset.range(10).map(lambda x: {"a": x, "b": (x, x)})
+        self.assertEqual(pipeline.graph_sink(ds), 10)
+        self.assertEqual(pipeline.graph_sink(ds.batch(3), batched=True), 10)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,128 @@
+import numpy as np
+import tensorflow as tf
+import unittest
+
+from presto import pipeline
+from presto import planner
+
+def _expensive(x):
+    for _ in range(200):
+        x = tf.sqrt(x * x + 1.0)
+    return x
+
+def _python_identity(x):
+    y = tf.py_function(lambda t: t, [x], Tout=tf.float32)
+    y.set_shape(x.shape)
+    return y
+
+class PlannerTest(unittest.TestCase):
+
+    def _spec(self):
+        return [
+            {
+                "name": "source",
+                "type": "source",
+                "op": tf.data.Dataset.range(16).map(lambda x: tf.fill([64, 64], tf.cast(x, tf.float32))),
+                "output_schema": tf.TensorSpec([64, 64], tf.float32)
+            },
+            {
+                "name": "cheap",
+                "type": "op",
+                "op": tf.identity,
+                "input_schema": tf.TensorSpec([64, 64], tf.float32),
+                "output_schema": tf.TensorSpec([64, 64], tf.float32)
+            },
+            {
+                "name": "python",
+                "type": "op",
+                "op": _python_identity,
+                "input_schema": tf.TensorSpec([64, 64], tf.float32),
+                "output_schema": tf.TensorSpec([64, 64], tf.float32)
+            },
+            {
+                "name": "expensive",
+                "type": "op",
+                "op": _expensive,
+                "input_schema": tf.TensorSpec([64, 64], tf.float32),
+                "output_schema": tf.TensorSpec([64, 64], tf.float32)
+            },
+        ]
+
+    def test_profile_step_costs(self):
+        costs = planner.profile_step_costs(self._spec(), sample_count=8)
+
+        self.assertIsNone(costs[0])
+        self.assertListEqual([cost["py_function"] for cost in costs[1:]], [False, True, False])
+        self.assertGreater(costs[3]["cost_s"], costs[1]["cost_s"])
+
+    def test_plan_fusion(self):
+        spec = self._spec()
+        plan = planner.plan_fusion(spec, thread_count=8, sample_count=8)
+
+        # the python op is never fused with graph ops
+        self.assertIn([2], [group["steps"] for group in plan])
+        self.assertListEqual(sorted(i for group in plan for i in group["steps"]), [1, 2, 3])
+        self.assertEqual(max(group["parallelism"] for group in plan), 8)
+        self.assertIn("python", planner.format_fusion_plan(plan))
+
+        planned = list(pipeline.build_pipeline(spec, fusion_plan=plan))
+        fused = list(pipeline.build_pipeline(spec))
+        np.testing.assert_allclose(np.stack(planned), np.stack(fused))
+
+
+    def test_reorder_for_split(self):
+        spec = [
+            {
+                "name": "source",
+                "type": "source",
+                "op": tf.data.Dataset.range(4).map(lambda x: tf.fill([8, 8], tf.cast(x, tf.uint8))),
+                "output_schema": tf.TensorSpec([8, 8], tf.uint8)
+            },
+            {
+                "name": "to float",
+                "type": "op",
+                "op": lambda x: tf.cast(x, tf.float32),
+                "input_schema": tf.TensorSpec([8, 8], tf.uint8),
+                "output_schema": tf.TensorSpec([8, 8], tf.float32),
+                "commutable": True
+            },
+            {
+                "name": "crop",
+                "type": "op",
+                "op": lambda x: x[:4, :4],
+                "input_schema": tf.TensorSpec([8, 8], tf.float32),
+                "output_schema": tf.TensorSpec([4, 4], tf.float32),
+                "commutable": True
+            },
+            {
+                "name": "double",
+                "type": "op",
+                "op": lambda x: x * 2,
+                "input_schema": tf.TensorSpec([4, 4], tf.float32),
+                "output_schema": tf.TensorSpec([4, 4], tf.float32)
+            },
+        ]
+        self.assertListEqual(planner.profile_step_sizes(spec, sample_count=2), [64.0, 256.0, 64.0, 64.0])
+
+        reordering = planner.reorder_for_split(spec, 2, sample_count=2)
+        reordered = reordering["pipeline"]
+
+        self.assertListEqual([step["name"] for step in reordered], ["source", "crop", "to float", "double"])
+        self.assertEqual(reordering["split_position"], 2)
+        self.assertListEqual(reordering["moved"], ["to float", "crop"])
+        self.assertEqual(reordering["sample_size_b"], 256.0)
+        self.assertEqual(reordering["predicted_sample_size_b"], 16.0)
+        self.assertEqual(reordered[1]["output_schema"], tf.TensorSpec([4, 4], tf.uint8))
+        pipeline.verify_pipeline(reordered)
+        np.testing.assert_array_equal(np.stack(list(pipeline.build_pipeline(reordered))), np.stack(list(pipeline.build_pipeline(spec))))
+        self.assertIn("source > crop || to float > double", planner.format_reordering(reordering, sample_count=1000))
+
+        # the non-commutable step after the split is not moved
+        self.assertListEqual([step["name"] for step in planner.reorder_for_split(spec, 3, sample_count=2)["pipeline"]], ["source", "crop", "to float", "double"])
+        # a random op is never moved
+        random_spec = spec[:2] + [{**spec[2], "random": True}] + spec[3:]
+        self.assertListEqual([step["name"] for step in planner.reorder_for_split(random_spec, 2, sample_count=2)["pipeline"]], ["source", "to float", "crop", "double"])
+
+
+if __name__ == "__main__":
+    unittest.main()
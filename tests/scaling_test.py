@@ -0,0 +1,56 @@
+import pathlib
+import tempfile
+import numpy as np
+import unittest
+
+from presto.scaling import ScalingModel, geometric_sample_counts, stratified_file_order, throughput_prediction
+
+class ScalingTest(unittest.TestCase):
+
+    def test_geometric_sample_counts(self):
+        self.assertListEqual(geometric_sample_counts(100, 10000, 3), [100, 1000, 10000])
+        self.assertListEqual(geometric_sample_counts(1, 2, 5), [1, 2])
+
+    def test_stratified_file_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filepaths = []
+            for size_b in range(1, 41):
+                filepath = pathlib.Path(directory) / f"{size_b}.bin"
+                filepath.write_bytes(b"x" * size_b)
+                filepaths.append(str(filepath))
+
+            ordered_filepaths = stratified_file_order(filepaths, strata_count=4)
+            self.assertListEqual(sorted(ordered_filepaths), sorted(filepaths))
+            # every round takes one file of every size quartile
+            first_round = sorted(int(pathlib.Path(filepath).stem) for filepath in ordered_filepaths[:4])
+            self.assertListEqual([(size_b - 1) // 10 for size_b in first_round], [0, 1, 2, 3])
+
+    def test_scaling_model(self):
+        sample_counts = np.array([100, 100, 400, 400, 1600, 1600])
+        cached_fractions = np.array([0, 1, 0, 1, 0, 1])
+        noise = np.array([0.1, -0.1, -0.1, 0.1, 0.1, -0.1])
+        values = 1 + 0.01 * sample_counts * (1 - cached_fractions) + 0.005 * sample_counts * cached_fractions + noise
+
+        model = ScalingModel(sample_counts, values, cached_fractions)
+        prediction, ci_low, ci_high = model.predict(100000, cached_fraction=0.5)
+        self.assertAlmostEqual(prediction, 751, delta=5)
+        self.assertLess(ci_low, prediction)
+        self.assertGreater(ci_high, prediction)
+
+        # without cached runs, the cold slope is used for the cached part
+        cold_model = ScalingModel(sample_counts[::2], values[::2])
+        self.assertAlmostEqual(cold_model.predict(100000, cached_fraction=0.5)[0], 1001, delta=5)
+
+        with self.assertRaises(Exception):
+            ScalingModel([100, 100], [1.0, 1.1])
+
+    def test_throughput_prediction(self):
+        self.assertEqual(throughput_prediction(100, (10, 5, 20)), (10, 5, 20))
+        # an interval of the time that reaches below 0 s has no upper bound of the throughput
+        prediction, ci_low, ci_high = throughput_prediction(100, (10, -2, 20))
+        self.assertEqual((prediction, ci_low), (10, 5))
+        self.assertTrue(np.isnan(ci_high))
+
+
+if __name__ == "__main__":
+    unittest.main()
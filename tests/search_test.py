@@ -0,0 +1,96 @@
+import tempfile
+import numpy as np
+import tensorflow as tf
+import unittest
+import unittest.mock
+
+from presto.search import search_split_position, _profile_candidate
+
+class SearchTest(unittest.TestCase):
+
+    def _spec(self):
+        schema = tf.TensorSpec([64], tf.float32)
+        return [
+            {"name": "source", "type": "source", "op": tf.data.Dataset.range(1000).map(lambda i: tf.fill([64], tf.cast(i, tf.float32)))
+           , "output_schema": schema},
+            {"name": "double", "type": "op", "op": lambda x: x * 2, "input_schema": schema, "output_schema": schema},
+            {"name": "square", "type": "op", "op": tf.square, "input_schema": schema, "output_schema": schema},
+        ]
+
+    def test_search_split_position(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            best, search_df = search_split_position(self._spec()
+                                                  , split_positions = [None, 1, 2, 3]
+                                                  , preprocessing_time_weight = 0
+                                                  , storage_consumption_weight = 1
+                                                  , throughput_weight = 0
+                                                  , initial_sample_count = 10
+                                                  , max_sample_count = 40
+                                                  , growth_factor = 2
+                                                  , shard_directory_prefix = directory + "/shards")
+
+        # fully online stores nothing, every split is dominated in storage
+        self.assertEqual(best.meta_info["split_name"], "0-fully-online")
+        self.assertEqual(search_df["round"].max(), 0)
+        self.assertListEqual(search_df["dominated"].tolist(), [False, True, True, True])
+
+    def test_search_split_position_halving(self):
+        # (throughput_sps, storage_consumption_mb) per split position and sample count, position 4 is dominated by 2 and 3
+        metrics = {
+            10: {1: (100, 10), 2: (200, 20), 3: (300, 30), 4: (150, 40)}
+          , 20: {2: (200, 20), 3: (300, 25)}
+          , 40: {3: (300, 25)}
+        }
+        def profile_candidate(strategy, sample_count, runs_total, system_cache_enabled):
+            throughput_sps, storage_consumption_mb = metrics[sample_count][strategy._split_position]
+            return {"preprocessing_time_s": 1.0, "storage_consumption_mb": storage_consumption_mb, "throughput_sps": throughput_sps}
+
+        spec = self._spec() + [{"name": "negate", "type": "op", "op": lambda x: -x, "input_schema": self._spec()[-1]["output_schema"], "output_schema": self._spec()[-1]["output_schema"]}]
+        with tempfile.TemporaryDirectory() as directory, unittest.mock.patch("presto.search._profile_candidate", side_effect=profile_candidate) as profiled:
+            best, search_df = search_split_position(spec
+                                                  , split_positions = [1, 2, 3, 4]
+                                                  , preprocessing_time_weight = 0
+                                                  , storage_consumption_weight = 1
+                                                  , throughput_weight = 2
+                                                  , initial_sample_count = 10
+                                                  , max_sample_count = 40
+                                                  , growth_factor = 2
+                                                  , system_cache_enabled = True
+                                                  , shard_directory_prefix = directory + "/shards")
+
+        self.assertEqual(profiled.call_count, 4 + 2 + 1)
+        self.assertTrue(all(call.args[3] for call in profiled.call_args_list))
+        rounds = search_df.groupby("round")
+        self.assertListEqual(rounds["sample_count"].first().tolist(), [10, 20, 40])
+        self.assertListEqual(rounds.size().tolist(), [4, 2, 1])
+
+        first_round = search_df[search_df["round"] == 0].set_index("split_position")
+        self.assertListEqual(first_round["dominated"].tolist(), [False, False, False, True])
+        # scores: 2 * normalized throughput + 1 - normalized storage
+        np.testing.assert_allclose(first_round["score"].tolist(), [1.0, 1 + 2 / 3, 2 + 1 / 3, 0.5])
+        self.assertListEqual(first_round["advanced"].tolist(), [False, True, True, False])
+
+        second_round = search_df[search_df["round"] == 1].set_index("split_position")
+        np.testing.assert_allclose(second_round["score"].tolist(), [1.0, 2.0])
+        self.assertListEqual(second_round["advanced"].tolist(), [False, True])
+        self.assertEqual(best._split_position, 3)
+
+    def test_profile_candidate_system_cache(self):
+        class Runs:
+            '''Logs like a strategy with system caching, only the first run materializes
+            '''
+            def __init__(self):
+                self.meta_info = {"offline_processing_and_save_time_s": [5.0], "shard_cum_size_MB": [7.0], "throughput_sps": [1.0]}
+
+            def execute_full_pipeline(self, run_id, sample_count, runs_total, system_cache_enabled):
+                self.meta_info["offline_processing_and_save_time_s"].append(2.0 if run_id == 0 else 0)
+                self.meta_info["shard_cum_size_MB"].append(10.0 if run_id == 0 else 0)
+                self.meta_info["throughput_sps"].append(100.0 + run_id * 100)
+
+        metrics = _profile_candidate(Runs(), 10, 3, system_cache_enabled=True)
+        self.assertDictEqual(metrics, {"preprocessing_time_s": 2.0, "storage_consumption_mb": 10.0, "throughput_sps": 200.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
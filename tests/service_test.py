@@ -0,0 +1,74 @@
+import tempfile
+import tensorflow as tf
+import unittest
+
+from presto import pipeline
+from presto.service import LocalWorkerPool
+
+def pipeline_definition(sample_count):
+    '''Factory that the worker processes import, the last step runs in Python
+    '''
+    schema = tf.TensorSpec([], tf.int64)
+    square = lambda x: x * x
+    add_one = lambda x: tf.py_function(lambda y: y + 1, [x], tf.int64)
+    return [
+        {"name": "source", "type": "source", "op": tf.data.Dataset.range(sample_count), "output_schema": schema},
+        {"name": "square", "type": "op", "op": square, "input_schema": schema, "output_schema": schema},
+        {"name": "add one", "type": "op", "op": add_one, "input_schema": schema, "output_schema": schema},
+    ]
+
+def unseeded_pipeline_definition(sample_count):
+    '''Factory with a shuffle that has another order in every worker
+    '''
+    return [{**pipeline_definition(sample_count)[0], "op": tf.data.Dataset.range(sample_count).shuffle(sample_count)}] + pipeline_definition(sample_count)[1:]
+
+class ServiceTest(unittest.TestCase):
+
+    def _config(self, split_position):
+        return {
+            "pipeline_factory": ["tests.service_test", "pipeline_definition", {"sample_count": 10}]
+          , "split_position": split_position
+          , "split_options": {"serialization_format": "tensor"}
+          , "schema_inference": False
+          , "thread_count": 2
+          , "read_parallelism": 1
+          , "vectorized_batch_size": None
+          , "compression_type": ""
+        }
+
+    def test_fully_online(self):
+        workers = LocalWorkerPool(2, self._config(None))
+        try:
+            element_spec = tf.TensorSpec([], tf.int64)
+            # every sample is processed by exactly one worker, also in the py_function step
+            self.assertListEqual(sorted(workers.dataset(element_spec).as_numpy_iterator()), [i * i + 1 for i in range(10)])
+            self.assertListEqual(sorted(workers.dataset(element_spec, sample_count=4).as_numpy_iterator()), [i * i + 1 for i in range(4)])
+        finally:
+            workers.stop()
+
+    def test_unseeded_source(self):
+        config = self._config(None)
+        config["pipeline_factory"] = ["tests.service_test", "unseeded_pipeline_definition", {"sample_count": 1000}]
+        # the workers would read overlapping parts of the source
+        with self.assertRaises(Exception):
+            LocalWorkerPool(2, config)
+
+    def test_split(self):
+        offline, _ = pipeline.serialized_split(pipeline_definition(10), 2, serialization_format="tensor")
+        records = pipeline.build_pipeline(offline)
+        with tempfile.TemporaryDirectory() as directory:
+            shard_files = []
+            for shard in range(3):
+                shard_files.append(f"{directory}/shard-{shard}.tfrecord")
+                tf.data.experimental.TFRecordWriter(shard_files[-1]).write(records.shard(3, shard))
+
+            workers = LocalWorkerPool(2, self._config(2))
+            try:
+                samples = workers.dataset(tf.TensorSpec([], tf.int64), shard_files=shard_files)
+                self.assertListEqual(sorted(samples.as_numpy_iterator()), [i * i + 1 for i in range(10)])
+            finally:
+                workers.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()